@@ -3,17 +3,43 @@ FastAPI application for Nova Demo
 Multimodal AI chat with MCP (Model Context Protocol) support
 """
 
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+# Load .env before importing services, which read their settings at import
+load_dotenv()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 # Import routers
-from routers import chat, mcp
+from routers import admin, chat, mcp
+from services.diagnostics import loop_monitor
+from services.metrics import metrics
+from services.warmup import warm_up, drain, readiness
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  """Warm shared clients, the model catalog and MCP sessions on startup; drain on shutdown
+
+  The loop-lag monitor starts first so stalls during warmup are recorded too.
+  """
+  loop_monitor.start()
+  await warm_up()
+  yield
+  await drain()
+  await loop_monitor.stop()
+
 
 # Create FastAPI app
 app = FastAPI(
   title="Nova Demo API",
   description="Multimodal AI chat with MCP support",
-  version="1.0.0"
+  version="1.0.0",
+  lifespan=lifespan,
 )
 
 # Enable CORS for all origins
@@ -28,6 +54,7 @@ app.add_middleware(
 # Include routers
 app.include_router(chat.router)
 app.include_router(mcp.router)
+app.include_router(admin.router)
 
 
 @app.get("/")
@@ -38,3 +65,15 @@ async def root():
     "status": "running",
     "version": "1.0.0"
   }
+
+
+@app.get("/ready")
+async def ready():
+  """Readiness check - reports which components are warm"""
+  return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
+
+@app.get("/metrics")
+async def get_metrics():
+  """In-process counters, gauges and latency summaries"""
+  return metrics.snapshot()
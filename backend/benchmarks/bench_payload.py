@@ -0,0 +1,109 @@
+"""
+Payload-build time against chat history length
+
+Compares the previous path (rebuild every message's content dicts, then
+json-encode the whole payload) with message records, on the first turn
+(cold: every record is built and encoded) and the next turn (warm: the
+history comes from the record cache and only the new message is encoded).
+Both paths must produce byte-identical bodies.
+
+Run from the backend directory:
+  python -m benchmarks.bench_payload --lengths 10 100 500 2000
+"""
+
+import argparse
+import base64
+import json
+import os
+import time
+
+from models.schemas import Message
+from services.ingestion import data_url, encode_payload
+from services.message_records import RecordCache
+
+
+def make_history(length: int, text_chars: int, image_every: int, image_kb: int):
+  image = base64.b64encode(os.urandom(image_kb * 1024)).decode()
+  history = []
+  for i in range(length):
+    role = "user" if i % 2 == 0 else "assistant"
+    message = {"role": role, "content": f"turn {i} " + "lorem ipsum " * (text_chars // 12)}
+    if image_every and i % image_every == 0:
+      message["image"] = {"data": image, "format": "jpeg"}
+    history.append(message)
+  return history
+
+
+def parse(history):
+  # A fresh request: new Message objects every turn, as the client resends the history
+  return [Message.model_validate(message) for message in history]
+
+
+def dict_messages(chat_history):
+  messages = []
+  for msg in chat_history:
+    content = []
+    if msg.content:
+      content.append({"type": "text", "text": msg.content})
+    if msg.image:
+      url = data_url(f"data:image/{msg.image['format']};base64,", msg.image["data"])
+      content.append({"type": "image_url", "image_url": {"url": url}})
+    messages.append({"role": msg.role, "content": content})
+  return messages
+
+
+def build(messages) -> bytes:
+  parts, length = encode_payload({"model": "bench/model", "messages": messages, "stream": True})
+  body = b"".join(parts)
+  assert len(body) == length
+  return body
+
+
+def timed(fn, repeat: int, setup=None) -> float:
+  """Best of `repeat` runs in ms; if given, setup runs untimed before each run and its result is passed to fn"""
+  best = float("inf")
+  for _ in range(repeat):
+    args = (setup(),) if setup else ()
+    started = time.perf_counter()
+    fn(*args)
+    best = min(best, time.perf_counter() - started)
+  return best * 1000
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 500, 2000])
+  parser.add_argument("--text-chars", type=int, default=600)
+  parser.add_argument("--image-every", type=int, default=20)
+  parser.add_argument("--image-kb", type=int, default=96)
+  parser.add_argument("--repeat", type=int, default=5)
+  args = parser.parse_args()
+
+  print(f"{'messages':>8} {'dicts ms':>10} {'cold ms':>10} {'warm ms':>10}")
+  for length in args.lengths:
+    history = make_history(length, args.text_chars, args.image_every, args.image_kb)
+    previous = parse(history[:-1])
+    current = parse(history)
+
+    baseline = build(dict_messages(current))
+    cache = RecordCache(max_bytes=1 << 40)
+    assert build([cache.record_for(msg) for msg in current]) == baseline
+
+    def fresh_cache():
+      return RecordCache(max_bytes=1 << 40)
+
+    def warm_cache():
+      # Last turn's history is cached and encoded; only the newest message is new.
+      # Rebuilt for every run, otherwise runs after the first would find the newest one cached too
+      cache = fresh_cache()
+      build([cache.record_for(msg) for msg in previous])
+      return cache
+
+    def run(cache):
+      build([cache.record_for(msg) for msg in current])
+
+    print(
+      f"{length:>8} {timed(lambda: build(dict_messages(current)), args.repeat):>10.2f}"
+      f" {timed(run, args.repeat, setup=fresh_cache):>10.2f}"
+      f" {timed(run, args.repeat, setup=warm_cache):>10.2f}"
+    )
@@ -40,3 +40,10 @@ class ChatRequest(BaseModel):
   use_mcp: bool = False
   approved_tool_calls: Optional[List[dict]] = []
 
+
+
+class FanoutRequest(BaseModel):
+  """Request model for streaming one chat history to several models"""
+  model_ids: List[str]
+  chat_history: List[Message]
+  use_mcp: bool = False
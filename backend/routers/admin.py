@@ -0,0 +1,66 @@
+"""
+Admin diagnostics routes, enabled only when ADMIN_TOKEN is set
+"""
+
+import os
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from services.diagnostics import loop_monitor, profiler
+from services.mcp_service import mcp_manager
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def require_admin(authorization: Optional[str] = Header(default=None)):
+  """Bearer-token check; the routes don't exist unless a token is configured"""
+  token = os.getenv("ADMIN_TOKEN")
+  if not token:
+    raise HTTPException(status_code=404, detail="Not Found")
+  supplied = (authorization or "").removeprefix("Bearer ").strip()
+  # compare_digest only takes ASCII strs, so compare bytes; a non-ASCII header is a 401, not a 500
+  if not secrets.compare_digest(supplied.encode("utf-8"), token.encode("utf-8")):
+    raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@router.get("/loop-stalls", dependencies=[Depends(require_admin)])
+async def get_loop_stalls():
+  """
+  Recent event-loop stalls over LOOP_LAG_THRESHOLD
+
+  Returns:
+    Monitor settings and each stall's duration and the stack of the blocking frame
+  """
+  return loop_monitor.snapshot()
+
+
+@router.get("/mcp-pool", dependencies=[Depends(require_admin)])
+async def get_mcp_pool():
+  """
+  Connected MCP clients and pool limits
+
+  Returns:
+    Pool bounds plus each client's key, tenant, pinned flag, size estimate and idle time
+  """
+  return mcp_manager.pool.stats()
+
+
+@router.post("/profile", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def run_profile(
+  seconds: float = Query(10, gt=0),
+  interval_ms: float = Query(5, gt=0),
+  include_idle: bool = False,
+):
+  """
+  Sample every thread's stack for `seconds` on this worker
+
+  Returns:
+    Collapsed stacks (`frame;frame count` per line) for flamegraph.pl or speedscope
+  """
+  if profiler.busy:
+    raise HTTPException(status_code=409, detail="A profile is already running")
+  stacks = await profiler.profile(seconds, interval_ms / 1000, include_idle)
+  return "\n".join(stacks) + "\n"
@@ -2,53 +2,404 @@
 Chat-related API routes
 """
 
-from fastapi import APIRouter
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
-import requests
+from starlette.background import BackgroundTask
+from pydantic import ValidationError
 
-from models.schemas import ChatRequest
+from models.schemas import ChatRequest, FanoutRequest
 from services.chat_service import ChatService
+from services.fanout import merge_streams
+from services.image_service import max_edge_for_model
+from services.http_client import openrouter_api_key
+from services.model_catalog import model_catalog
+from services.admission import admission_controller, AdmissionRejected, client_identity
+from services.ingestion import read_json_body, describe_payload
 import json
 
+WS_MAX_STREAMS = int(os.getenv("WS_MAX_STREAMS", "8"))
+WS_APPROVAL_TIMEOUT = float(os.getenv("WS_APPROVAL_TIMEOUT", "120"))
+FANOUT_MAX_MODELS = int(os.getenv("FANOUT_MAX_MODELS", "8"))
+
 router = APIRouter()
 
 @router.post("/chat_streaming")
-async def chat_streaming(request: ChatRequest):
+async def chat_streaming(http_request: Request):
   """
   Chat endpoint with streaming support and optional MCP tools
   
   Args:
-    request: ChatRequest with model_id, chat_history, and MCP settings
+    http_request: Raw request carrying a ChatRequest JSON body. The body is
+      read incrementally so large attachments are spooled to disk, and the
+      client address is used for rate limiting
   
   Returns:
-    Streaming response
+    Streaming response, or 429 with Retry-After when overloaded
   """
-  # Get model data
-  all_models = requests.get('https://openrouter.ai/api/v1/models').json()['data']
-  model_data = next((m for m in all_models if m['id'] == request.model_id), None)
+  client_key = client_identity(
+    http_request.client.host if http_request.client else None,
+    http_request.headers.get("x-forwarded-for"),
+  )
+  # Only the rate limit is charged up front; the generation slot is taken once
+  # the body is in, so a slow upload never holds one
+  try:
+    admission_controller.check_rate_limits(client_key, openrouter_api_key())
+  except AdmissionRejected as e:
+    raise _busy(e)
+
+  ticket = None
+  attachments = []
+
+  def finish():
+    if ticket is not None:
+      ticket.release()
+    for attachment in attachments:
+      attachment.close()
+
+  try:
+    body, attachments = await read_json_body(http_request)
+    try:
+      request = ChatRequest.model_validate(body)
+    except ValidationError as e:
+      raise RequestValidationError(e.errors())
+    try:
+      ticket = await admission_controller.acquire_slot()
+    except AdmissionRejected as e:
+      raise _busy(e)
+    return await _start_stream(request, finish)
+  except BaseException:
+    finish()
+    raise
+
+
+def _busy(e: AdmissionRejected) -> HTTPException:
+  """429 with a Retry-After hint for a request admission turned away"""
+  return HTTPException(
+    status_code=429,
+    detail={"error": "Server busy, please retry", "reason": e.reason},
+    headers={"Retry-After": e.retry_after_header},
+  )
+
+
+async def _prepare_chat(request: ChatRequest):
+  """Look up the model and build the upstream payload; (None, None) if the model is unknown"""
+  model_data = await model_catalog.get_model(request.model_id)
   
   if not model_data:
-    return {"error": "Model not found"}
+    return None, None
 
   chat_service = ChatService(request.model_id, model_data)
+  await chat_service.preprocess_attachments(request.chat_history)
   messages = chat_service.prepare_messages(request.chat_history)
   
-  # Check if any messages have PDFs
-  has_pdf = any(msg.pdf for msg in request.chat_history)
+  # Check if any PDFs still need the provider's file parser
+  has_pdf = chat_service.needs_file_parser(request.chat_history)
   
   payload = await chat_service.create_payload(
     messages,
     use_mcp=request.use_mcp,
     has_pdf=has_pdf
   )
-  print(f"Payload for model {request.model_id}: {json.dumps(payload)}")
+  print(f"Payload for model {request.model_id}: {json.dumps(describe_payload(payload))}")
+  return chat_service, payload
+
+
+async def _start_stream(request: ChatRequest, finish):
+  """Build the upstream payload and wrap the stream so the admission slot and spooled files are freed when it ends"""
+  chat_service, payload = await _prepare_chat(request)
+  if payload is None:
+    finish()
+    return {"error": "Model not found"}
+
+  async def event_generator():
+    try:
+      async for event in chat_service.stream_response(
+              payload,
+              use_mcp=request.use_mcp,
+              accumulated_tool_calls=request.approved_tool_calls
+          ):
+          yield event
+    finally:
+      finish()
+  
+  # The background task covers clients that disconnect before the body starts
+  return StreamingResponse(
+    event_generator(),
+    media_type="application/stream+json",
+    background=BackgroundTask(finish),
+  )
+
+
+@router.post("/chat_fanout")
+async def chat_fanout(http_request: Request):
+  """
+  Stream one chat history to several models concurrently
+  
+  Args:
+    http_request: Raw request carrying a FanoutRequest JSON body (model_ids,
+      chat_history, use_mcp), read incrementally like /chat_streaming
+  
+  Returns:
+    NDJSON stream of model-tagged chunks ending with a per-model summary of
+    time to first token and throughput; 429 with Retry-After when overloaded
+  """
+  client_key = client_identity(
+    http_request.client.host if http_request.client else None,
+    http_request.headers.get("x-forwarded-for"),
+  )
+  # One rate-limit charge per fan-out request, taken before the body is read
+  # like /chat_streaming; the per-model slots are taken once it is in
+  try:
+    admission_controller.check_rate_limits(client_key, openrouter_api_key())
+  except AdmissionRejected as e:
+    raise _busy(e)
+
+  tickets = []
+  attachments = []
+
+  def finish():
+    for ticket in tickets:
+      ticket.release()
+    for attachment in attachments:
+      attachment.close()
+
+  try:
+    body, attachments = await read_json_body(http_request)
+    try:
+      request = FanoutRequest.model_validate(body)
+    except ValidationError as e:
+      raise RequestValidationError(e.errors())
+    model_ids = list(dict.fromkeys(request.model_ids))
+    if not model_ids or len(model_ids) > FANOUT_MAX_MODELS:
+      raise HTTPException(status_code=400, detail=f"Provide between 1 and {FANOUT_MAX_MODELS} model ids")
+
+    model_data = await asyncio.gather(*[model_catalog.get_model(model_id) for model_id in model_ids])
+    unknown = [model_id for model_id, data in zip(model_ids, model_data) if not data]
+    if unknown:
+      raise HTTPException(status_code=404, detail={"error": "Model not found", "models": unknown})
+
+    # Each model is its own generation, so each needs an admission slot
+    admitted = await asyncio.gather(
+      *[admission_controller.acquire_slot() for _ in model_ids],
+      return_exceptions=True,
+    )
+    tickets = [ticket for ticket in admitted if not isinstance(ticket, BaseException)]
+    rejected = [error for error in admitted if isinstance(error, BaseException)]
+    if rejected:
+      if not isinstance(rejected[0], AdmissionRejected):
+        raise rejected[0]
+      raise _busy(rejected[0])
+
+    services = [ChatService(model_id, data) for model_id, data in zip(model_ids, model_data)]
+
+    # Attachments are prepared once, downscaled to the smallest edge any of the models accepts
+    max_edge = min(max_edge_for_model(model_id) for model_id in model_ids)
+    await services[0].preprocess_attachments(request.chat_history, max_edge=max_edge)
+    messages = services[0].prepare_messages(request.chat_history)
+    has_pdf = ChatService.needs_file_parser(request.chat_history)
+
+    streams = {}
+    for chat_service in services:
+      payload = await chat_service.create_payload(
+        # Tool rounds append to the message list, so every model gets its own
+        list(messages),
+        use_mcp=request.use_mcp,
+        has_pdf=has_pdf,
+      )
+      streams[chat_service.model_id] = chat_service.stream_response(payload, use_mcp=request.use_mcp)
+  except BaseException:
+    finish()
+    raise
 
   async def event_generator():
-    async for event in chat_service.stream_response(
-            payload,
-            use_mcp=request.use_mcp,
-            accumulated_tool_calls=request.approved_tool_calls
-        ):
-        yield event
-  
-  return StreamingResponse(event_generator(), media_type="application/stream+json")
+    try:
+      async for line in merge_streams(streams):
+        yield line
+    finally:
+      finish()
+
+  return StreamingResponse(
+    event_generator(),
+    media_type="application/x-ndjson",
+    background=BackgroundTask(finish),
+  )
+
+
+class ChatSocketSession:
+  """
+  One browser session's WebSocket, carrying several chat streams at once
+
+  Every frame is a JSON text message with a `type`; stream frames carry the
+  client-chosen `stream` id.
+
+  Client to server:
+    {"type": "start", "stream": id, "request": ChatRequest, "approve_tools": bool}
+    {"type": "approval", "stream": id, "approved": [tool_call_id, ...] | true | false}
+    {"type": "cancel", "stream": id}
+    {"type": "ping"}
+
+  Server to client:
+    {"type": "data", "stream": id, "data": <upstream chunk>}
+    {"type": "approval_request", "stream": id, "tool_calls": [...]}
+    {"type": "end" | "cancelled", "stream": id}
+    {"type": "error", "stream": id, "error": str, "retry_after"?: seconds}
+    {"type": "pong"}
+  """
+
+  def __init__(self, websocket: WebSocket):
+    self.websocket = websocket
+    self.client_key = client_identity(
+      websocket.client.host if websocket.client else None,
+      websocket.headers.get("x-forwarded-for"),
+    )
+    self.streams: Dict[str, asyncio.Task] = {}
+    self.approvals: Dict[str, asyncio.Future] = {}
+    self.send_lock = asyncio.Lock()
+
+  async def send(self, frame: Dict[str, Any]):
+    await self.send_text(json.dumps(frame))
+
+  async def send_text(self, text: str):
+    async with self.send_lock:
+      await self.websocket.send_text(text)
+
+  async def error(self, stream_id: Optional[str], message: str, **extra: Any):
+    await self.send({"type": "error", "stream": stream_id, "error": message, **extra})
+
+  async def run(self):
+    try:
+      while True:
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+          break
+        text = message.get("text")
+        if text is None:
+          await self.error(None, "Frames must be JSON text, not binary")
+          continue
+        try:
+          frame = json.loads(text)
+        except json.JSONDecodeError:
+          await self.error(None, "Frames must be JSON")
+          continue
+        if not isinstance(frame, dict):
+          await self.error(None, "Frames must be JSON objects")
+          continue
+        await self.handle(frame)
+    except WebSocketDisconnect:
+      pass
+    finally:
+      for future in self.approvals.values():
+        future.cancel()
+      for task in self.streams.values():
+        task.cancel()
+      await asyncio.gather(*self.streams.values(), return_exceptions=True)
+
+  async def handle(self, frame: Dict[str, Any]):
+    kind = frame.get("type")
+    stream_id = frame.get("stream")
+
+    if kind == "ping":
+      await self.send({"type": "pong"})
+    elif kind == "start":
+      if not isinstance(stream_id, str) or stream_id in self.streams:
+        await self.error(stream_id, "Missing or duplicate stream id")
+      elif len(self.streams) >= WS_MAX_STREAMS:
+        await self.error(stream_id, f"At most {WS_MAX_STREAMS} concurrent streams per connection")
+      else:
+        try:
+          request = ChatRequest.model_validate(frame.get("request") or {})
+        except ValidationError as e:
+          await self.error(stream_id, "Invalid request", detail=e.errors(include_url=False, include_context=False))
+          return
+        task = asyncio.create_task(self.run_stream(stream_id, request, bool(frame.get("approve_tools"))))
+        self.streams[stream_id] = task
+        task.add_done_callback(lambda _: self.streams.pop(stream_id, None))
+    elif kind == "cancel":
+      task = self.streams.get(stream_id)
+      if task is not None:
+        task.cancel()
+    elif kind == "approval":
+      future = self.approvals.get(stream_id)
+      if future is not None and not future.done():
+        future.set_result(frame.get("approved"))
+    else:
+      await self.error(stream_id, f"Unknown frame type {kind!r}")
+
+  async def request_approval(self, stream_id: str, tool_calls: List[Dict[str, Any]]) -> Set[str]:
+    """Ask the client which tool calls may run; ids not approved in time are declined"""
+    future = asyncio.get_running_loop().create_future()
+    self.approvals[stream_id] = future
+    try:
+      await self.send({"type": "approval_request", "stream": stream_id, "tool_calls": tool_calls})
+      async with asyncio.timeout(WS_APPROVAL_TIMEOUT):
+        approved = await future
+    except TimeoutError:
+      approved = False
+    finally:
+      self.approvals.pop(stream_id, None)
+
+    if approved is True:
+      return {tool_call["id"] for tool_call in tool_calls}
+    if isinstance(approved, list):
+      return set(approved)
+    return set()
+
+  async def send_cancelled(self, stream_id: str):
+    try:
+      await self.send({"type": "cancelled", "stream": stream_id})
+    except Exception:
+      pass  # the socket is already gone
+
+  async def run_stream(self, stream_id: str, request: ChatRequest, approve_tools: bool):
+    try:
+      ticket = await admission_controller.acquire(self.client_key, openrouter_api_key())
+    except AdmissionRejected as e:
+      await self.error(stream_id, "Server busy, please retry", reason=e.reason, retry_after=e.retry_after)
+      return
+    except asyncio.CancelledError:
+      # Cancelled while still queued for a generation slot
+      await self.send_cancelled(stream_id)
+      raise
+
+    try:
+      chat_service, payload = await _prepare_chat(request)
+      if payload is None:
+        await self.error(stream_id, "Model not found")
+        return
+      approve = (lambda tool_calls: self.request_approval(stream_id, tool_calls)) if approve_tools else None
+      # Upstream chunks are already JSON, so they are spliced into the frame rather than re-encoded
+      prefix = '{"type":"data","stream":' + json.dumps(stream_id) + ',"data":'
+      async for event in chat_service.stream_response(
+        payload,
+        use_mcp=request.use_mcp,
+        accumulated_tool_calls=request.approved_tool_calls,
+        approve_tools=approve,
+      ):
+        await self.send_text(prefix + event + "}")
+      await self.send({"type": "end", "stream": stream_id})
+    except asyncio.CancelledError:
+      await self.send_cancelled(stream_id)
+      raise
+    except Exception as e:
+      print(f"Stream {stream_id} failed: {e}")
+      await self.error(stream_id, str(e))
+    finally:
+      ticket.release()
+
+
+@router.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+  """
+  Multiplexed chat streaming over one persistent connection
+
+  See ChatSocketSession for the frame protocol. Each stream is admitted like
+  a /chat_streaming request and can be cancelled on its own; with
+  approve_tools, MCP tool calls wait for an in-band approval frame.
+  """
+  await websocket.accept()
+  await ChatSocketSession(websocket).run()
@@ -0,0 +1,281 @@
+"""
+Admission control for chat generations
+
+Caps the number of concurrently active upstream generations, holds a bounded
+wait queue in front of them and applies per-client and per-API-key token
+buckets. Requests that cannot be admitted are rejected quickly with a retry
+hint instead of piling up on the event loop.
+"""
+
+import asyncio
+import hashlib
+import ipaddress
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple, Union
+
+from services.metrics import metrics
+
+
+class AdmissionRejected(Exception):
+  """Raised when a request cannot be admitted right now"""
+
+  def __init__(self, reason: str, retry_after: float):
+    super().__init__(reason)
+    self.reason = reason
+    self.retry_after = retry_after
+
+  @property
+  def retry_after_header(self) -> str:
+    return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+  """Classic token bucket refilled continuously at `rate` tokens per second"""
+
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+
+  def _refill(self, now: float):
+    elapsed = now - self.updated
+    if elapsed > 0:
+      self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+      self.updated = now
+
+  def try_acquire(self, now: Optional[float] = None) -> Tuple[bool, float]:
+    """Take one token. Returns (admitted, seconds until a token is available)"""
+    now = time.monotonic() if now is None else now
+    self._refill(now)
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return True, 0.0
+    if self.rate <= 0:
+      return False, 60.0
+    return False, (1 - self.tokens) / self.rate
+
+  def refund(self):
+    self.tokens = min(self.capacity, self.tokens + 1)
+
+  def is_idle(self, now: float) -> bool:
+    self._refill(now)
+    return self.tokens >= self.capacity
+
+
+class TokenBucketMap:
+  """Token buckets keyed by an identity, pruned once they refill completely"""
+
+  def __init__(self, rate_per_minute: float, burst: float, max_keys: int = 10000):
+    self.rate = rate_per_minute / 60.0
+    self.burst = burst
+    self.max_keys = max_keys
+    self.buckets: Dict[str, TokenBucket] = {}
+
+  def get(self, key: str) -> TokenBucket:
+    bucket = self.buckets.get(key)
+    if bucket is None:
+      if len(self.buckets) >= self.max_keys:
+        self.prune()
+      bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+    return bucket
+
+  def prune(self):
+    now = time.monotonic()
+    for key in [k for k, b in self.buckets.items() if b.is_idle(now)]:
+      del self.buckets[key]
+
+
+class AdmissionTicket:
+  """Handle for an admitted generation; releasing it is idempotent"""
+
+  def __init__(self, controller: "AdmissionController", queue_time: float):
+    self.controller = controller
+    self.queue_time = queue_time
+    self.started = time.monotonic()
+    self.released = False
+
+  def release(self):
+    if self.released:
+      return
+    self.released = True
+    metrics.observe("admission.generation_seconds", time.monotonic() - self.started)
+    self.controller._release()
+
+
+class AdmissionController:
+  """Global concurrency limit with a bounded wait queue and rate limits"""
+
+  def __init__(
+    self,
+    max_active: int = 16,
+    max_queued: int = 32,
+    queue_timeout: float = 10.0,
+    client_rate_per_minute: float = 30,
+    client_burst: float = 10,
+    api_key_rate_per_minute: float = 120,
+    api_key_burst: float = 40,
+    max_tool_calls: int = 8,
+  ):
+    self.max_active = max_active
+    self.max_queued = max_queued
+    self.queue_timeout = queue_timeout
+    self.active = 0
+    self.queued = 0
+    self._slots = asyncio.Semaphore(max_active)
+    self._tool_slots = asyncio.Semaphore(max_tool_calls)
+    self.client_buckets = TokenBucketMap(client_rate_per_minute, client_burst)
+    self.api_key_buckets = TokenBucketMap(api_key_rate_per_minute, api_key_burst)
+
+  @classmethod
+  def from_env(cls) -> "AdmissionController":
+    """Build a controller from ADMISSION_* environment variables"""
+    return cls(
+      max_active=int(os.getenv("ADMISSION_MAX_ACTIVE", "16")),
+      max_queued=int(os.getenv("ADMISSION_MAX_QUEUED", "32")),
+      queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+      client_rate_per_minute=float(os.getenv("ADMISSION_CLIENT_RATE_PER_MINUTE", "30")),
+      client_burst=float(os.getenv("ADMISSION_CLIENT_BURST", "10")),
+      api_key_rate_per_minute=float(os.getenv("ADMISSION_API_KEY_RATE_PER_MINUTE", "120")),
+      api_key_burst=float(os.getenv("ADMISSION_API_KEY_BURST", "40")),
+      max_tool_calls=int(os.getenv("ADMISSION_MAX_TOOL_CALLS", "8")),
+    )
+
+  def _update_gauges(self):
+    metrics.set_gauge("admission.active", self.active)
+    metrics.set_gauge("admission.queued", self.queued)
+
+  def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+    metrics.increment(f"admission.rejected.{reason}")
+    return AdmissionRejected(reason, retry_after)
+
+  def check_rate_limits(self, client_key: str, api_key: Optional[str] = None):
+    """Take one token from the client's and the API key's buckets, or raise AdmissionRejected"""
+    client_bucket = self.client_buckets.get(client_key)
+    ok, retry_after = client_bucket.try_acquire()
+    if not ok:
+      raise self._reject("client_rate", retry_after)
+
+    if api_key:
+      key_id = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+      ok, retry_after = self.api_key_buckets.get(key_id).try_acquire()
+      if not ok:
+        # Don't charge the client for a request the key bucket turned away
+        client_bucket.refund()
+        raise self._reject("api_key_rate", retry_after)
+
+  def _estimated_wait(self) -> float:
+    # Rough guess from recent generation times, used only as a retry hint
+    summary = metrics.summaries.get("admission.generation_seconds")
+    per_generation = summary.percentile(0.5) if summary and summary.count else 5.0
+    return per_generation * (self.queued + 1) / max(1, self.max_active)
+
+  async def acquire(self, client_key: str, api_key: Optional[str] = None) -> AdmissionTicket:
+    """
+    Admit a generation or raise AdmissionRejected
+
+    Rate limits are checked first, then the request either takes a free
+    slot, waits in the bounded queue for up to `queue_timeout` seconds, or
+    is rejected immediately when the queue is already full.
+    """
+    self.check_rate_limits(client_key, api_key)
+    return await self.acquire_slot()
+
+  async def acquire_slot(self) -> AdmissionTicket:
+    """
+    Take a generation slot without charging the rate limits
+
+    For callers that already called check_rate_limits, e.g. before reading
+    a request body, so a slow upload never holds a slot.
+    """
+    if self.active >= self.max_active and self.queued >= self.max_queued:
+      raise self._reject("queue_full", self._estimated_wait())
+
+    enqueued = time.monotonic()
+    self.queued += 1
+    self._update_gauges()
+    try:
+      async with asyncio.timeout(self.queue_timeout):
+        await self._slots.acquire()
+    except TimeoutError:
+      raise self._reject("queue_timeout", self._estimated_wait())
+    finally:
+      self.queued -= 1
+
+    queue_time = time.monotonic() - enqueued
+    self.active += 1
+    self._update_gauges()
+    metrics.increment("admission.admitted")
+    metrics.observe("admission.queue_seconds", queue_time)
+    return AdmissionTicket(self, queue_time)
+
+  def _release(self):
+    self.active -= 1
+    self._slots.release()
+    self._update_gauges()
+
+  @asynccontextmanager
+  async def tool_slot(self):
+    """Limit the number of MCP tool calls running at once across all requests"""
+    enqueued = time.monotonic()
+    async with self._tool_slots:
+      metrics.observe("admission.tool_queue_seconds", time.monotonic() - enqueued)
+      yield
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_trusted_proxies(raw: str) -> List[Network]:
+  """Networks from a comma-separated list of addresses and CIDR ranges"""
+  networks = []
+  for entry in raw.split(","):
+    entry = entry.strip()
+    if not entry:
+      continue
+    try:
+      networks.append(ipaddress.ip_network(entry, strict=False))
+    except ValueError:
+      print(f"Ignoring invalid ADMISSION_TRUSTED_PROXIES entry: {entry}")
+  return networks
+
+
+TRUSTED_PROXIES = parse_trusted_proxies(os.getenv("ADMISSION_TRUSTED_PROXIES", ""))
+
+
+def _is_trusted(address: Optional[str], trusted: List[Network]) -> bool:
+  try:
+    ip = ipaddress.ip_address((address or "").strip())
+  except ValueError:
+    return False
+  return any(ip in network for network in trusted)
+
+
+def client_identity(
+  host: Optional[str],
+  forwarded_for: Optional[str],
+  trusted: Optional[List[Network]] = None,
+) -> str:
+  """
+  Identify a client for rate limiting
+
+  Uses the peer address unless the peer is a trusted proxy. Then it walks
+  X-Forwarded-For from the right and takes the first hop that is not a
+  trusted proxy: hops to the left of it were supplied by the client and can
+  be forged.
+  """
+  trusted = TRUSTED_PROXIES if trusted is None else trusted
+  if not forwarded_for or not _is_trusted(host, trusted):
+    return host or "unknown"
+  hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+  for hop in reversed(hops):
+    if not _is_trusted(hop, trusted):
+      return hop
+  return hops[0] if hops else host or "unknown"
+
+
+# Global admission controller instance
+admission_controller = AdmissionController.from_env()
@@ -2,18 +2,24 @@
 Chat service for handling AI model interactions
 """
 
-import os
-from dotenv import load_dotenv
-import requests
 import json
 import asyncio
-from typing import AsyncGenerator, Generator, Dict, Any, List
+from typing import AsyncGenerator, Awaitable, Callable, Generator, Dict, Any, List, Optional, Set
 from models.schemas import Message
 from services.mcp_service import mcp_manager
+from services.admission import admission_controller
+from services.image_service import image_preprocessor, max_edge_for_model
+from services.pdf_service import pdf_extractor, local_extraction_enabled
+from services.http_client import http_pool, openrouter_api_key, OPENROUTER_BASE_URL
+from services.ingestion import describe_payload, encode_payload, stream_parts
+from services.message_records import MessageRecord, record_cache
+from services.tool_calls import ToolCallAssembler
+from services.tool_results import FETCH_TOOL, FETCH_TOOL_NAME, tool_result_store
+from services.prompt_cache import add_breakpoints, explicit_breakpoints, record_usage, stable_tools, system_first
+
+# Longest upstream error body passed on to the client
+UPSTREAM_ERROR_MAX_CHARS = 2000
 
-load_dotenv()
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-print("OPENROUTER_API_KEY:", OPENROUTER_API_KEY)
 
 class ChatService:
   """Service for managing chat interactions with AI models"""
@@ -22,85 +28,61 @@ class ChatService:
     self.model_id = model_id
     self.model_data = model_data
 
-  def prepare_messages(self, chat_history: List[Message]) -> List[Dict[str, Any]]:
-    """Convert individual messages to OpenRouter message format, handling different modalities"""
-    messages = []
-
-    for msg in chat_history:
-      content = []
-
-      # Add text content
-      if msg.content:
-        content.append({"type": "text", "text": msg.content})
-
-      # Add image content
-      if msg.image:
-        img_data = msg.image
-        url = f"data:image/{img_data['format']};base64,{img_data['data']}"
-        content.append({"type": "image_url", "image_url": {"url": url}})
-
-      # Add audio content
-      if msg.audio:
-        audio_data = msg.audio
-        content.append(
-          {
-            "type": "input_audio",
-            "input_audio": {
-              "data": audio_data["data"],
-              "format": audio_data["format"],
-            },
-          }
-        )
-
-      # Add PDF content
-      if msg.pdf:
-        pdf_data = msg.pdf
-        pdf_url = f"data:application/pdf;base64,{pdf_data['data']}"
-        content.append(
-          {
-            "type": "file",
-            "file": {
-              "filename": pdf_data["filename"],
-              "file_data": pdf_url,
-            },
-          }
-        )
-
-      messages.append({"role": msg.role, "content": content})
-
-    return messages
+  async def preprocess_attachments(self, chat_history: List[Message], max_edge: Optional[int] = None):
+    """Downscale images and, in local mode, extract PDF text in place before prepare_messages"""
+    max_edge = max_edge or max_edge_for_model(self.model_id)
+    with_images = [msg for msg in chat_history if msg.image]
+    with_pdfs = [msg for msg in chat_history if msg.pdf] if local_extraction_enabled() else []
+    results = await asyncio.gather(
+      *[image_preprocessor.preprocess(msg.image, max_edge) for msg in with_images],
+      *[pdf_extractor.extract(msg.pdf, max_edge) for msg in with_pdfs],
+    )
+    for msg, image in zip(with_images, results):
+      msg.image = image
+    for msg, extracted in zip(with_pdfs, results[len(with_images):]):
+      if extracted is not None:
+        msg.pdf = {"filename": msg.pdf["filename"], "extracted": extracted}
+
+  @staticmethod
+  def needs_file_parser(chat_history: List[Message]) -> bool:
+    """Whether any PDF still has to be parsed by the provider"""
+    return any(msg.pdf and "extracted" not in msg.pdf for msg in chat_history)
+
+  def prepare_messages(self, chat_history: List[Message]) -> List[MessageRecord]:
+    """
+    Convert individual messages to compact records in OpenRouter message format
+
+    Messages already seen in an earlier turn reuse their cached record and
+    its encoded JSON, so only the new turn is built and serialised.
+    """
+    messages = [record_cache.record_for(msg) for msg in chat_history]
+
+    # System content leads so the cacheable prefix is the same every turn
+    return system_first(messages)
 
   async def create_payload(
     self,
-    messages: List[Dict[str, Any]],
+    messages: List[Any],
     use_mcp: bool = False,
     has_pdf: bool = False,
   ) -> Dict[str, Any]:
-    """Create overall request payload for OpenRouter API"""
+    """Create overall request payload for OpenRouter API, with prompt-cache breakpoints where the model needs them"""
     output_modalities = self.model_data["architecture"]["output_modalities"]
 
     payload = {
       "model": self.model_id,
-      "messages": messages,
+      "messages": add_breakpoints(messages, explicit_breakpoints(self.model_id, self.model_data)),
       "modalities": output_modalities,
+      # Final chunk carries token usage, including cache reads and writes
+      "usage": {"include": True},
     }
 
     # Add MCP tools if enabled
     if use_mcp:
       try:
-        clients = await mcp_manager.get_or_create_all_clients()
-        tools = await asyncio.gather(
-          *[client.get_available_tools() for client in clients],
-          return_exceptions=True,
-        )
+        tools = await mcp_manager.get_tools_payload()
         if tools:
-          # flatten and nullcheck tools list
-          payload["tools"] = [
-            tool
-            for sublist in tools
-            for tool in sublist
-            if not isinstance(tool, Exception)
-          ]
+          payload["tools"] = stable_tools(tools + [FETCH_TOOL])
       except Exception as e:
         print(f"Failed to load MCP tools: {e}")
 
@@ -115,11 +97,21 @@ class ChatService:
     payload: Dict[str, Any],
     use_mcp: bool = False,
     accumulated_tool_calls: List[Dict[str, Any]] = None,
+    dispatched: Optional[Dict[int, "asyncio.Future"]] = None,
+    approve_tools: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Set[str]]]] = None,
   ) -> AsyncGenerator[str, None]:
-    """Stream chat response from OpenRouter API"""
-    url = "https://openrouter.ai/api/v1/chat/completions"
+    """
+    Stream chat response from OpenRouter API
+
+    Tool calls are dispatched to MCP as soon as their arguments are complete,
+    while the rest of the stream is still arriving; `dispatched` carries those
+    in-flight results into the follow-up round. With `approve_tools`, nothing
+    runs early: the finished calls are passed to it and only the ids it returns
+    are executed, the rest are answered as declined.
+    """
+    url = OPENROUTER_BASE_URL + "/chat/completions"
     headers = {
-      "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+      "Authorization": f"Bearer {openrouter_api_key()}",
       "Content-Type": "application/json",
     }
 
@@ -129,114 +121,146 @@ class ChatService:
     if accumulated_tool_calls:
       # If there are pre-accumulated tool calls, execute them and continue
       payload = await self._execute_tools(
-        accumulated_tool_calls, payload
+        accumulated_tool_calls, payload, dispatched
       )
-      print("Updated payload with accumulated tool calls:", payload)
-
-    accumulated_tool_calls = []
-
-    with requests.post(url, headers=headers, json=payload, stream=True) as r:
-      accumulated_message = ""
-      tool_calls_complete = False
-
-      for chunk in r.iter_content(chunk_size=1024, decode_unicode=False):
-        chunk = chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
-        buffer += chunk
-
-        while True:
-          try:
-            line_end = buffer.find("\n")
-            if line_end == -1:
-              break
+      print("Updated payload with accumulated tool calls:", describe_payload(payload))
+
+    assembler = ToolCallAssembler()
+    dispatched = {}
+
+    def dispatch(indices: List[int]):
+      if approve_tools is not None:
+        return
+      for index in indices:
+        dispatched[index] = asyncio.create_task(self._call_tool(assembler.get(index)))
+
+    # Spooled attachments are streamed from disk into the body rather than copied into it
+    parts, content_length = encode_payload(payload)
+    headers["Content-Length"] = str(content_length)
+
+    try:
+      async with http_pool.client.stream("POST", url, headers=headers, content=stream_parts(parts)) as r:
+        if r.status_code >= 400:
+          # Surfaced in OpenRouter's own error chunk shape so callers see why the stream is empty
+          detail = (await r.aread()).decode("utf-8", errors="replace")[:UPSTREAM_ERROR_MAX_CHARS]
+          print(f"Upstream error {r.status_code} for {self.model_id}: {detail}")
+          yield json.dumps({"error": {"code": r.status_code, "message": detail}})
+          return
+
+        accumulated_message = ""
+        tool_calls_complete = False
+
+        async for chunk in r.aiter_text():
+          buffer += chunk
+
+          while True:
+            try:
+              line_end = buffer.find("\n")
+              if line_end == -1:
+                break
+
+              line = buffer[:line_end].strip()
+              buffer = buffer[line_end + 1 :]
+
+              if line.startswith("data: "):
+                data = line[6:]
+                try:
+                  parsed_data = json.loads(data)
+                  if parsed_data.get("usage"):
+                    record_usage(self.model_id, parsed_data["usage"])
+
+                  # Handle tool calls in streaming response
+                  if (
+                    use_mcp
+                    and "choices" in parsed_data
+                    and len(parsed_data["choices"]) > 0
+                  ):
+                    choice = parsed_data["choices"][0]
 
-            line = buffer[:line_end].strip()
-            buffer = buffer[line_end + 1 :]
+                    if (
+                      "delta" in choice
+                      and "content" in choice["delta"]
+                    ):
+                      accumulated_message += (
+                        choice["delta"]["content"] or ""
+                      )
 
-            if line.startswith("data: "):
-              data = line[6:]
-              try:
-                parsed_data = json.loads(data)
+                    if (
+                      "delta" in choice
+                      and "tool_calls" in choice["delta"]
+                    ):
+                      dispatch(assembler.add(choice["delta"]["tool_calls"]))
 
-                # Handle tool calls in streaming response
-                if (
-                  use_mcp
-                  and "choices" in parsed_data
-                  and len(parsed_data["choices"]) > 0
-                ):
-                  choice = parsed_data["choices"][0]
+                    if choice.get("finish_reason"):
+                      dispatch(assembler.finish())
 
                   if (
-                    "delta" in choice
-                    and "content" in choice["delta"]
+                    not use_mcp
+                    or not assembler
                   ):
-                    accumulated_message += (
-                      choice["delta"]["content"] or ""
-                    )
+                    print("Streaming data:", data)
+                    yield data
 
-                  if (
-                    "delta" in choice
-                    and "tool_calls" in choice["delta"]
-                  ):
-                    self._accumulate_tool_calls(
-                      choice["delta"]["tool_calls"],
-                      accumulated_tool_calls,
-                    )
-
-                if (
-                  not use_mcp
-                  or not accumulated_tool_calls
-                ):
-                  print("Streaming data:", data)
-                  print("acc mcp:", accumulated_tool_calls)
-                  yield data
-
-              except json.JSONDecodeError:
-                pass
-          except Exception:
-            break
-
-      # Handle tool calls after streaming
-      print("Final accumulated tool calls:", accumulated_tool_calls)
+                except json.JSONDecodeError:
+                  pass
+            except Exception:
+              break
+
+        # Handle tool calls after streaming
+        dispatch(assembler.finish())
+        accumulated_tool_calls = assembler.tool_calls()
+        print("Final accumulated tool calls:", accumulated_tool_calls)
       if use_mcp and accumulated_tool_calls:
+        if approve_tools is not None:
+          approved = await approve_tools(accumulated_tool_calls)
+          for index, tool_call in enumerate(accumulated_tool_calls):
+            if tool_call["id"] not in approved:
+              declined = asyncio.get_running_loop().create_future()
+              declined.set_result({
+                "success": False,
+                "error": "Tool call declined by the user",
+                "tool_name": tool_call["function"]["name"],
+              })
+              dispatched[index] = declined
         async for event in self.stream_response(
           payload,
           use_mcp=use_mcp,
           accumulated_tool_calls=accumulated_tool_calls,
+          dispatched=dispatched,
+          approve_tools=approve_tools,
         ):
           yield event
-
-  def _accumulate_tool_calls(self, tool_calls: List[Dict], accumulated: List[Dict]):
-    """Accumulate streaming tool call data"""
-    for tool_call in tool_calls:
-      if tool_call.get("index") is not None:
-        index = tool_call["index"]
-        while len(accumulated) <= index:
-          accumulated.append(
-            {
-              "id": "",
-              "type": "function",
-              "function": {"name": "", "arguments": ""},
-            }
-          )
-
-        if "id" in tool_call:
-          accumulated[index]["id"] = tool_call["id"]
-        if "function" in tool_call:
-          if "name" in tool_call["function"]:
-            accumulated[index]["function"]["name"] = tool_call["function"][
-              "name"
-            ]
-          if "arguments" in tool_call["function"]:
-            accumulated[index]["function"]["arguments"] += tool_call[
-              "function"
-            ]["arguments"]
+    finally:
+      # Don't leave tool calls running if the client went away mid-stream
+      for task in dispatched.values():
+        task.cancel()
+
+  async def _call_tool(self, tool_call: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one assembled tool call through MCP"""
+    tool_name = tool_call["function"]["name"]
+    try:
+      tool_args = json.loads(tool_call["function"]["arguments"] or "{}")
+    except json.JSONDecodeError as e:
+      return {"success": False, "error": f"Invalid tool arguments: {e}", "tool_name": tool_name}
+    if not isinstance(tool_args, dict):
+      return {"success": False, "error": "Tool arguments must be a JSON object", "tool_name": tool_name}
+    if tool_name == FETCH_TOOL_NAME:
+      # Pages of truncated results are served locally, not by an MCP server
+      try:
+        page = int(tool_args.get("page", 1))
+      except (TypeError, ValueError) as e:
+        return {"success": False, "error": f"Invalid page: {e}", "tool_name": tool_name, "tool_args": tool_args}
+      return tool_result_store.fetch(str(tool_args.get("handle", "")), page)
+    async with admission_controller.tool_slot():
+      return await mcp_manager.call_tool(tool_name, tool_args)
 
   async def _execute_tools(
     self,
     tool_calls: List[Dict],
     payload: Dict[str, Any],
+    dispatched: Optional[Dict[int, "asyncio.Future"]] = None,
   ) -> Dict[str, Any]:
-    """Execute approved tool calls and stream final response"""
+    """Execute tool calls, awaiting any already dispatched during streaming, and append the results"""
     print("tool_calls:", tool_calls)
     await mcp_manager.get_or_create_all_clients()
 
@@ -245,10 +269,13 @@ class ChatService:
       {"role": "assistant", "content": "", "tool_calls": tool_calls}
     )
 
-    for tool_call in tool_calls:
+    dispatched = dispatched or {}
+    for index, tool_call in enumerate(tool_calls):
       tool_name = tool_call["function"]["name"]
-      tool_args = json.loads(tool_call["function"]["arguments"] or "{}")
-      tool_result = await mcp_manager.call_tool(tool_name, tool_args)
+      if index in dispatched:
+        tool_result = await dispatched.pop(index)
+      else:
+        tool_result = await self._call_tool(tool_call)
 
       messages.append(
         {
@@ -256,7 +283,7 @@ class ChatService:
           "tool_call_id": tool_call["id"],
           "name": tool_name,
           "content": (
-            json.dumps(tool_result)
+            tool_result_store.budget(tool_name, tool_result)
             if tool_result["success"]
             else f"Error: {tool_result['error']}"
           ),
@@ -278,9 +305,9 @@ class ChatService:
     """
     messages = self.prepare_messages(chat_history)
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
+    url = OPENROUTER_BASE_URL + "/chat/completions"
     headers = {
-      "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+      "Authorization": f"Bearer {openrouter_api_key()}",
       "Content-Type": "application/json",
     }
 
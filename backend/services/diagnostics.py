@@ -0,0 +1,181 @@
+"""
+Runtime diagnostics: event-loop lag monitor and on-demand sampling profiler
+
+Blocking calls inside async code (sync HTTP clients, large prints, file I/O)
+stall every request on the worker without showing up anywhere. The lag
+monitor pairs a heartbeat coroutine with a watchdog thread. The coroutine
+stamps the time every `interval`. The watchdog notices when the stamp goes
+stale past the threshold and grabs the loop thread's stack while it is still
+blocked, which shows the blocking frame itself rather than whatever ran next.
+When idle it costs one coroutine wakeup and one thread wakeup per interval.
+
+The profiler does nothing until asked. It then samples every thread's stack
+from a helper thread for N seconds and returns collapsed stacks
+(`frame;frame;frame count`), which flamegraph.pl and speedscope read directly.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from services.metrics import metrics
+
+LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+MAX_STALLS = int(os.getenv("LOOP_LAG_MAX_STALLS", "50"))
+MAX_PROFILE_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Innermost Python frames of threads parked waiting for work (selectors, conditions, pool workers)
+IDLE_FRAMES = {"select", "poll", "wait", "_worker", "accept"}
+
+
+def _frame_label(frame) -> str:
+  code = frame.f_code
+  return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def collapse_stack(frame) -> str:
+  """Root-first `;`-joined frame labels, the collapsed-stack format"""
+  labels = []
+  while frame is not None:
+    labels.append(_frame_label(frame))
+    frame = frame.f_back
+  return ";".join(reversed(labels))
+
+
+class LoopLagMonitor:
+  """Records event-loop stalls longer than a threshold with the stack that caused them"""
+
+  def __init__(
+    self,
+    interval: float = LAG_INTERVAL,
+    threshold: float = LAG_THRESHOLD,
+    max_stalls: int = MAX_STALLS,
+  ):
+    self.interval = interval
+    self.threshold = threshold
+    self.stalls: Deque[Dict[str, Any]] = deque(maxlen=max_stalls)
+    self.last_beat = 0.0
+    self.loop_thread_id: Optional[int] = None
+    self._stall: Optional[Dict[str, Any]] = None
+    self._task: Optional[asyncio.Task] = None
+    self._stop = threading.Event()
+    self._watchdog: Optional[threading.Thread] = None
+
+  @property
+  def running(self) -> bool:
+    return self._task is not None and not self._task.done()
+
+  def start(self):
+    """Start monitoring the running loop; call from inside it"""
+    if self.running:
+      return
+    self.loop_thread_id = threading.get_ident()
+    self.last_beat = time.monotonic()
+    self._stop.clear()
+    self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+    self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+    self._watchdog.start()
+
+  async def stop(self):
+    self._stop.set()
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+    if self._watchdog is not None:
+      self._watchdog.join(timeout=self.interval * 2)
+      self._watchdog = None
+
+  async def _heartbeat(self):
+    while True:
+      expected = time.monotonic() + self.interval
+      await asyncio.sleep(self.interval)
+      now = time.monotonic()
+      self.last_beat = now
+      lag = max(0.0, now - expected)
+      metrics.observe("event_loop.lag_seconds", lag)
+
+      stall = self._stall
+      if stall is not None:
+        # The loop is back; the watchdog already has the stack, fill in how long it was blocked
+        self._stall = None
+        stall["duration"] = round(lag, 6)
+        metrics.increment("event_loop.stalls")
+
+  def _watch(self):
+    while not self._stop.wait(self.interval):
+      if self._stall is not None:
+        continue
+      blocked = time.monotonic() - self.last_beat - self.interval
+      if blocked < self.threshold:
+        continue
+      frame = sys._current_frames().get(self.loop_thread_id)
+      if frame is None:
+        continue
+      stall = {
+        "detected_at": time.time(),
+        "blocked_for": round(blocked, 6),
+        "duration": None,
+        "stack": traceback.format_stack(frame),
+      }
+      self._stall = stall
+      self.stalls.append(stall)
+
+  def snapshot(self) -> Dict[str, Any]:
+    return {
+      "running": self.running,
+      "interval": self.interval,
+      "threshold": self.threshold,
+      "stalls": list(self.stalls),
+    }
+
+
+class SamplingProfiler:
+  """Samples all thread stacks for a fixed window; one profile at a time"""
+
+  def __init__(self, max_seconds: float = MAX_PROFILE_SECONDS):
+    self.max_seconds = max_seconds
+    self._lock = asyncio.Lock()
+
+  @property
+  def busy(self) -> bool:
+    return self._lock.locked()
+
+  def _sample(self, seconds: float, interval: float, include_idle: bool) -> Counter:
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+      for thread_id, frame in sys._current_frames().items():
+        if thread_id == me:
+          continue
+        # Threads parked in a wait would otherwise dominate every profile
+        if not include_idle and frame.f_code.co_name in IDLE_FRAMES:
+          continue
+        name = names.get(thread_id) or str(thread_id)
+        stacks[f"{name};{collapse_stack(frame)}"] += 1
+      time.sleep(interval)
+    return stacks
+
+  async def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> List[str]:
+    """Sample for `seconds` and return collapsed stacks, most frequent first"""
+    seconds = min(max(seconds, 0.1), self.max_seconds)
+    async with self._lock:
+      stacks = await asyncio.to_thread(self._sample, seconds, max(interval, 0.001), include_idle)
+    metrics.increment("profiler.runs")
+    return [f"{stack} {count}" for stack, count in stacks.most_common()]
+
+
+# Global diagnostics instances
+loop_monitor = LoopLagMonitor()
+profiler = SamplingProfiler()
@@ -0,0 +1,119 @@
+"""
+Merging concurrent model streams into one tagged stream
+
+Each model's stream is pumped by its own task into a shared queue, so a slow
+model never holds up the others. Every chunk is forwarded as one NDJSON line
+tagged with its model id. A final summary line reports each model's time to
+first token and throughput.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
+
+from services.metrics import metrics
+
+
+class StreamStats:
+  """Timing and output counters for one model's stream"""
+
+  def __init__(self, model_id: str):
+    self.model_id = model_id
+    self.started = time.monotonic()
+    self.first_token: Optional[float] = None
+    self.finished: Optional[float] = None
+    self.chunks = 0
+    self.chars = 0
+    self.completion_tokens: Optional[int] = None
+    self.error: Optional[str] = None
+
+  def record(self, event: str):
+    self.chunks += 1
+    try:
+      parsed = json.loads(event)
+    except json.JSONDecodeError:
+      return
+    error = parsed.get("error")
+    if error:
+      self.error = f"{error.get('code')}: {error.get('message')}" if isinstance(error, dict) else str(error)
+    for choice in parsed.get("choices") or []:
+      content = (choice.get("delta") or {}).get("content")
+      if content:
+        if self.first_token is None:
+          self.first_token = time.monotonic()
+        self.chars += len(content)
+    usage = parsed.get("usage")
+    if usage and usage.get("completion_tokens") is not None:
+      self.completion_tokens = usage["completion_tokens"]
+
+  def finish(self):
+    self.finished = time.monotonic()
+    if self.first_token is not None:
+      metrics.observe("fanout.ttft_seconds", self.first_token - self.started)
+
+  def summary(self) -> Dict[str, Any]:
+    end = self.finished or time.monotonic()
+    generating = end - self.first_token if self.first_token is not None else None
+    summary: Dict[str, Any] = {
+      "ttft_seconds": round(self.first_token - self.started, 4) if self.first_token is not None else None,
+      "total_seconds": round(end - self.started, 4),
+      "chunks": self.chunks,
+      "chars": self.chars,
+      "completion_tokens": self.completion_tokens,
+      "chars_per_second": round(self.chars / generating, 2) if generating else None,
+      "tokens_per_second": (
+        round(self.completion_tokens / generating, 2)
+        if generating and self.completion_tokens is not None
+        else None
+      ),
+    }
+    if self.error:
+      summary["error"] = self.error
+    return summary
+
+
+async def merge_streams(streams: Dict[str, AsyncIterator[str]]) -> AsyncGenerator[str, None]:
+  """
+  Interleave several upstream chunk streams as NDJSON lines
+
+  Yields `{"type": "data", "model": id, "data": chunk}` as chunks arrive,
+  `{"type": "error", ...}` if a model fails, and finally
+  `{"type": "summary", "models": {id: stats}}`.
+  """
+  queue: asyncio.Queue = asyncio.Queue()
+  stats = {model_id: StreamStats(model_id) for model_id in streams}
+
+  async def pump(model_id: str, stream: AsyncIterator[str]):
+    # Chunks are already JSON, so they are spliced into the line rather than re-encoded
+    prefix = '{"type":"data","model":' + json.dumps(model_id) + ',"data":'
+    try:
+      async for event in stream:
+        stats[model_id].record(event)
+        queue.put_nowait(prefix + event + "}\n")
+    except Exception as e:
+      print(f"Fan-out stream for {model_id} failed: {e}")
+      stats[model_id].error = str(e)
+      queue.put_nowait(json.dumps({"type": "error", "model": model_id, "error": str(e)}) + "\n")
+    finally:
+      stats[model_id].finish()
+      queue.put_nowait(None)
+
+  tasks = [asyncio.create_task(pump(model_id, stream)) for model_id, stream in streams.items()]
+  try:
+    remaining = len(tasks)
+    while remaining:
+      line = await queue.get()
+      if line is None:
+        remaining -= 1
+        continue
+      yield line
+    yield json.dumps({
+      "type": "summary",
+      "models": {model_id: s.summary() for model_id, s in stats.items()},
+    }) + "\n"
+  finally:
+    # The client went away or everything finished; either way stop any stream still running
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
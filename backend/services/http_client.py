@@ -0,0 +1,50 @@
+"""
+Shared HTTP client pool for upstream requests
+"""
+
+import os
+from typing import Optional
+
+import httpx
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+
+def openrouter_api_key() -> Optional[str]:
+  """Read the OpenRouter key at call time so it reflects the loaded environment"""
+  return os.getenv("OPENROUTER_API_KEY")
+
+
+class HttpClientPool:
+  """Lazily created, process-wide httpx.AsyncClient with keep-alive connections"""
+
+  def __init__(self, max_connections: int = 100, max_keepalive: int = 20):
+    self.limits = httpx.Limits(
+      max_connections=max_connections,
+      max_keepalive_connections=max_keepalive,
+    )
+    # Generations stream for a long time, so only bound connect and pool waits
+    self.timeout = httpx.Timeout(connect=10.0, read=300.0, write=60.0, pool=30.0)
+    self._client: Optional[httpx.AsyncClient] = None
+
+  @property
+  def client(self) -> httpx.AsyncClient:
+    if self._client is None or self._client.is_closed:
+      self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+    return self._client
+
+  async def warm(self):
+    """Open a TLS connection to OpenRouter so the first request can reuse it"""
+    await self.client.head(OPENROUTER_BASE_URL + "/models")
+
+  async def close(self):
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
+
+
+# Global HTTP client pool instance
+http_pool = HttpClientPool(
+  max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+  max_keepalive=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+)
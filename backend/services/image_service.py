@@ -0,0 +1,138 @@
+"""
+Image preprocessing for multimodal chats
+
+Browser uploads are often full-resolution phone photos, far larger than what
+vision models actually look at. Images are decoded, downscaled to the model's
+effective maximum edge and re-encoded before being forwarded upstream. The
+work runs in a process pool and results are cached by content hash.
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from services.metrics import metrics
+from services.ingestion import SpooledAttachment, content_digest
+from services.worker_pool import ByteBoundedLRU, PooledWorker
+
+try:
+  from PIL import Image
+except ImportError:
+  print("Pillow not installed, images will be forwarded unchanged. Install with: pip install pillow")
+  Image = None
+
+# Longest edge each provider effectively processes; larger inputs get downsampled upstream anyway
+MODEL_MAX_EDGE = {
+  "openai/": 2048,
+  "anthropic/": 1568,
+  "google/": 3072,
+  "meta-llama/": 1120,
+  "qwen/": 1792,
+}
+DEFAULT_MAX_EDGE = 1568
+MAX_EDGE_OVERRIDE = int(os.getenv("IMAGE_MAX_EDGE") or 0)
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", "2"))
+
+# Animated or vector formats are passed through untouched
+PASSTHROUGH_FORMATS = {"gif", "svg+xml"}
+
+
+def max_edge_for_model(model_id: str) -> int:
+  """Effective maximum image edge for a model, by provider prefix"""
+  if MAX_EDGE_OVERRIDE:
+    return MAX_EDGE_OVERRIDE
+  for prefix, edge in MODEL_MAX_EDGE.items():
+    if model_id.startswith(prefix):
+      return edge
+  return DEFAULT_MAX_EDGE
+
+
+def encode_image(raw: bytes, max_edge: int, quality: int) -> Tuple[str, bytes, bool]:
+  """
+  Fit decoded image bytes within max_edge and re-encode them as PNG (if
+  transparent) or JPEG
+
+  Returns (format, encoded bytes, whether the image was resized).
+  """
+  with Image.open(BytesIO(raw)) as img:
+    img.load()
+    resized = max(img.size) > max_edge
+    if resized:
+      img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    out = BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+      img.save(out, format="PNG", optimize=True)
+      fmt = "png"
+    else:
+      img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+      fmt = "jpeg"
+  return fmt, out.getvalue(), resized
+
+
+def downscale_image(data: Optional[str], path: Optional[str], max_edge: int, quality: int) -> Optional[Tuple[str, str]]:
+  """
+  Decode a base64 image (passed inline or as a spooled file path), fit it
+  within max_edge and re-encode it
+
+  Runs inside a worker process. Returns (format, base64 data), or None when
+  re-encoding would not make the image smaller.
+  """
+  if path is not None:
+    with open(path, "rb") as f:
+      data = f.read()
+  raw = base64.b64decode(data)
+  fmt, encoded, resized = encode_image(raw, max_edge, quality)
+  if not resized and len(encoded) >= len(raw):
+    return None
+  return fmt, base64.b64encode(encoded).decode("ascii")
+
+
+class ImagePreprocessor(PooledWorker):
+  """Process-pool image downscaler with a byte-bounded LRU cache"""
+
+  def __init__(self, max_workers: int = POOL_WORKERS, cache_max_bytes: int = CACHE_MAX_BYTES):
+    super().__init__(max_workers)
+    # None marks images that are already small enough to forward as-is
+    self.cache = ByteBoundedLRU(cache_max_bytes, lambda entry: len(entry["data"]) if entry else 0)
+
+  async def preprocess(self, image: Dict[str, str], max_edge: int) -> Dict[str, str]:
+    """Return a downscaled copy of an {data, format} image dict, or the original on failure"""
+    if Image is None or image.get("format") in PASSTHROUGH_FORMATS:
+      return image
+
+    data = image["data"]
+    key = hashlib.sha256(f"{max_edge}:{JPEG_QUALITY}:{content_digest(data)}".encode()).hexdigest()
+    hit, cached = self.cache.get(key)
+    if hit:
+      metrics.increment("images.cache_hits")
+      return cached or image
+
+    loop = asyncio.get_running_loop()
+    try:
+      # Spooled images are read from disk by the worker instead of being pickled across
+      if isinstance(data, SpooledAttachment) and not data.escaped:
+        args = (None, data.path)
+      else:
+        args = (data.read() if isinstance(data, SpooledAttachment) else data, None)
+      result = await loop.run_in_executor(self.pool, downscale_image, *args, max_edge, JPEG_QUALITY)
+    except Exception as e:
+      print(f"Image preprocessing failed, forwarding original: {e}")
+      metrics.increment("images.errors")
+      return image
+
+    entry = {"data": result[1], "format": result[0]} if result else None
+    metrics.increment("images.processed")
+    if entry:
+      metrics.observe("images.bytes_saved", len(data) - len(entry["data"]))
+    self.cache.put(key, entry)
+    return entry or image
+
+
+# Global image preprocessor instance
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,399 @@
+"""
+Memory-bounded ingestion of large request bodies
+
+A chat request can carry many megabytes of base64 images, audio and PDFs.
+Parsing it the usual way holds every attachment as a Python str. Building the
+payload then copies it again into data URLs, then into a logged JSON dump,
+then into the request body. Here the body is read in chunks and any long
+JSON string is written straight to a temp file. The JSON parser only ever
+sees a small skeleton with placeholders. Attachments stay on disk as
+SpooledAttachment handles and are streamed into the upstream body chunk by
+chunk.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import secrets
+import tempfile
+import weakref
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+# The frontend accepts PDFs up to 50 MB, which is about 67 MB as a base64 data URL.
+# Each attachment is sent twice (data and url) and the whole history is resent every
+# turn, so no fixed request size fits; the request limit is off (0) unless configured.
+MAX_REQUEST_BYTES = int(os.getenv("INGEST_MAX_REQUEST_BYTES", "0"))
+MAX_ATTACHMENT_BYTES = int(os.getenv("INGEST_MAX_ATTACHMENT_BYTES", str(70 * 1024 * 1024)))
+SPOOL_THRESHOLD = int(os.getenv("INGEST_SPOOL_THRESHOLD", str(256 * 1024)))
+READ_CHUNK = 256 * 1024
+
+# Fields whose values may stay spooled; anything else is read back into a str.
+# The frontend sends `url` next to `data`, repeating the whole data URL.
+ATTACHMENT_FIELDS = {"image": ("data", "url"), "audio": ("data", "url"), "pdf": ("data", "url")}
+
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+
+class SpooledAttachment:
+  """A long JSON string value kept in a temp file instead of memory"""
+
+  def __init__(self):
+    fd, self.path = tempfile.mkstemp(prefix="nova-attachment-")
+    self._file = os.fdopen(fd, "wb")
+    self._hash = hashlib.sha256()
+    self.size = 0
+    self.escaped = False  # contains JSON escapes, so raw bytes are not the decoded value
+    self._finalizer = weakref.finalize(self, _unlink, self.path)
+
+  def write(self, data: bytes):
+    self._file.write(data)
+    self._hash.update(data)
+    self.size += len(data)
+    if self.size > MAX_ATTACHMENT_BYTES:
+      raise HTTPException(status_code=413, detail="Attachment too large")
+
+  def finish(self):
+    self._file.close()
+    self.digest = self._hash.hexdigest()
+
+  def iter_chunks(self, chunk_size: int = READ_CHUNK) -> Iterator[bytes]:
+    """Raw JSON-escaped bytes of the value, without the surrounding quotes"""
+    with open(self.path, "rb") as f:
+      while chunk := f.read(chunk_size):
+        yield chunk
+
+  def read(self) -> str:
+    """Materialise the value as a str; only for small or fallback cases"""
+    with open(self.path, "rb") as f:
+      raw = f.read()
+    if self.escaped:
+      return json.loads(b'"' + raw + b'"')
+    return raw.decode("utf-8")
+
+  def iter_decoded(self, chunk_size: int = READ_CHUNK) -> Iterator[bytes]:
+    """Base64-decode the value in bounded chunks"""
+    if self.escaped:
+      yield base64.b64decode(self.read())
+      return
+    chunk_size -= chunk_size % 4
+    for chunk in self.iter_chunks(chunk_size):
+      yield base64.b64decode(chunk)
+
+  def close(self):
+    self._finalizer()
+
+  def __len__(self) -> int:
+    return self.size
+
+  def __repr__(self) -> str:
+    return f"<attachment {self.size} bytes>"
+
+
+def _unlink(path: str):
+  try:
+    os.unlink(path)
+  except FileNotFoundError:
+    pass
+
+
+class DataUrl:
+  """A data: URL whose payload is a spooled attachment, serialised lazily"""
+
+  def __init__(self, prefix: str, attachment: SpooledAttachment):
+    self.prefix = prefix
+    self.attachment = attachment
+
+  def __repr__(self) -> str:
+    return f"<{self.prefix}... {self.attachment.size} bytes>"
+
+
+class PreEncoded(ABC):
+  """
+  A payload value that serialises itself once
+
+  encode_payload splices the value's memoised `encoded()` parts into the body
+  instead of re-encoding it, so repeated payload builds only encode new values.
+  """
+
+  __slots__ = ()
+
+  @abstractmethod
+  def encoded(self) -> Tuple[List[Any], int]:
+    """Body parts and their total length, as encode_payload returns them"""
+
+  @abstractmethod
+  def to_dict(self) -> Dict[str, Any]:
+    """The plain JSON value, for logging"""
+
+
+def content_digest(value: Any) -> str:
+  """sha256 of an attachment value, whether it is a str or spooled"""
+  if isinstance(value, SpooledAttachment):
+    return value.digest
+  return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def data_url(prefix: str, value: Any) -> Any:
+  """Build a data URL, deferring the copy when the payload is spooled"""
+  if isinstance(value, SpooledAttachment):
+    return DataUrl(prefix, value)
+  return prefix + value
+
+
+class SkeletonBuilder:
+  """
+  Incremental scanner that copies JSON structure into a small skeleton and
+  diverts string values longer than the threshold into SpooledAttachments
+  """
+
+  def __init__(self, threshold: int = SPOOL_THRESHOLD):
+    self.threshold = threshold
+    self.nonce = secrets.token_hex(8)
+    self.skeleton = bytearray()
+    self.attachments: List[SpooledAttachment] = []
+    self.in_string = False
+    self.escape_pending = False
+    self.pending = bytearray()
+    self.current: Optional[SpooledAttachment] = None
+    self.current_escaped = False
+
+  def placeholder(self, index: int) -> str:
+    return f"\x00spool:{self.nonce}:{index}"
+
+  def _string_data(self, data: bytes):
+    if self.current is not None:
+      self.current.write(data)
+      return
+    self.pending += data
+    if len(self.pending) > self.threshold:
+      self.current = SpooledAttachment()
+      self.current.write(bytes(self.pending))
+      self.pending.clear()
+
+  def _end_string(self):
+    if self.current is None:
+      self.skeleton += b'"' + self.pending + b'"'
+      self.pending.clear()
+    else:
+      self.current.escaped = self.current_escaped
+      self.current.finish()
+      self.attachments.append(self.current)
+      self.skeleton += json.dumps(self.placeholder(len(self.attachments) - 1)).encode()
+      self.current = None
+    self.current_escaped = False
+    self.in_string = False
+
+  def feed(self, chunk: bytes):
+    pos = 0
+    end = len(chunk)
+    while pos < end:
+      if not self.in_string:
+        quote = chunk.find(b'"', pos)
+        if quote == -1:
+          self.skeleton += chunk[pos:]
+          return
+        self.skeleton += chunk[pos:quote]
+        self.in_string = True
+        pos = quote + 1
+        continue
+
+      if self.escape_pending:
+        # The character after a backslash is part of the escape, never a terminator
+        self._string_data(chunk[pos:pos + 1])
+        self.escape_pending = False
+        pos += 1
+        continue
+
+      match = _STRING_SPECIAL.search(chunk, pos)
+      if match is None:
+        self._string_data(chunk[pos:])
+        return
+      special = match.start()
+      if chunk[special] == 0x5C:  # backslash
+        self._string_data(chunk[pos:special + 1])
+        self.escape_pending = True
+        self.current_escaped = True
+        pos = special + 1
+      else:
+        self._string_data(chunk[pos:special])
+        self._end_string()
+        pos = special + 1
+
+  def close_all(self):
+    for attachment in self.attachments:
+      attachment.close()
+    if self.current is not None:
+      self.current.finish()
+      self.current.close()
+
+
+def _restore(value: Any, builder: SkeletonBuilder, allow_spooled: bool) -> Any:
+  """Swap placeholders back in: handles for attachment fields, plain strs elsewhere"""
+  if isinstance(value, str) and value.startswith(f"\x00spool:{builder.nonce}:"):
+    attachment = builder.attachments[int(value.rsplit(":", 1)[1])]
+    if allow_spooled:
+      return attachment
+    text = attachment.read()
+    attachment.close()
+    return text
+  if isinstance(value, list):
+    return [_restore(v, builder, allow_spooled) for v in value]
+  if isinstance(value, dict):
+    return {k: _restore(v, builder, allow_spooled) for k, v in value.items()}
+  return value
+
+
+def restore_request(body: Dict[str, Any], builder: SkeletonBuilder) -> Dict[str, Any]:
+  """Restore placeholders in a parsed chat request, keeping attachment fields spooled"""
+  restored = {k: _restore(v, builder, False) for k, v in body.items() if k != "chat_history"}
+  history = []
+  for message in body.get("chat_history") or []:
+    if not isinstance(message, dict):
+      history.append(_restore(message, builder, False))
+      continue
+    fields = {}
+    for key, value in message.items():
+      if key in ATTACHMENT_FIELDS and isinstance(value, dict):
+        fields[key] = {
+          k: _restore(v, builder, k in ATTACHMENT_FIELDS[key]) for k, v in value.items()
+        }
+      else:
+        fields[key] = _restore(value, builder, False)
+    history.append(fields)
+  restored["chat_history"] = history
+  return restored
+
+
+async def read_json_body(request: Request, threshold: int = SPOOL_THRESHOLD) -> Tuple[Dict[str, Any], List[SpooledAttachment]]:
+  """
+  Read a JSON request body with large strings spooled to disk
+
+  Enforces MAX_REQUEST_BYTES (413) when set and returns the parsed body together
+  with every attachment created, so the caller can close them when done.
+  """
+  declared = request.headers.get("content-length")
+  if declared:
+    try:
+      declared_bytes = int(declared)
+    except ValueError:
+      raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if MAX_REQUEST_BYTES and declared_bytes > MAX_REQUEST_BYTES:
+      raise HTTPException(status_code=413, detail="Request body too large")
+
+  builder = SkeletonBuilder(threshold)
+  received = 0
+  try:
+    async for chunk in request.stream():
+      received += len(chunk)
+      if MAX_REQUEST_BYTES and received > MAX_REQUEST_BYTES:
+        raise HTTPException(status_code=413, detail="Request body too large")
+      builder.feed(chunk)
+    if builder.in_string:
+      raise HTTPException(status_code=400, detail="Malformed JSON body")
+    try:
+      body = json.loads(bytes(builder.skeleton))
+    except json.JSONDecodeError as e:
+      raise HTTPException(status_code=400, detail=f"Malformed JSON body: {e}")
+    if not isinstance(body, dict):
+      raise HTTPException(status_code=400, detail="Expected a JSON object")
+    return restore_request(body, builder), builder.attachments
+  except BaseException:
+    builder.close_all()
+    raise
+
+
+def encode_payload(payload: Dict[str, Any]) -> Tuple[List[Any], int]:
+  """
+  Serialise a payload that may contain spooled values
+
+  Returns the body as a list of parts, either bytes or objects to stream
+  from disk, plus the total Content-Length. PreEncoded values contribute
+  their cached parts.
+  """
+  spooled: List[Any] = []
+  nonce = secrets.token_hex(8)
+
+  def default(value: Any) -> str:
+    if isinstance(value, (SpooledAttachment, DataUrl, PreEncoded)):
+      spooled.append(value)
+      return f"\x00spool:{nonce}:{len(spooled) - 1}"
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+  skeleton = json.dumps(payload, default=default, separators=(",", ":"))
+  if not spooled:
+    body = skeleton.encode("utf-8")
+    return [body], len(body)
+
+  parts: List[Any] = []
+  length = 0
+  pattern = re.compile(r'"\\u0000spool:' + nonce + r':(\d+)"')
+  pos = 0
+  for match in pattern.finditer(skeleton):
+    text = skeleton[pos:match.start()].encode("utf-8")
+    value = spooled[int(match.group(1))]
+    pos = match.end()
+    if isinstance(value, PreEncoded):
+      fragment, fragment_length = value.encoded()
+      parts += [text, *fragment]
+      length += len(text) + fragment_length
+      continue
+    attachment = value.attachment if isinstance(value, DataUrl) else value
+    prefix = b'"' + (value.prefix.encode("utf-8") if isinstance(value, DataUrl) else b"")
+    parts += [text + prefix, attachment, b'"']
+    length += len(text) + len(prefix) + attachment.size + 1
+  tail = skeleton[pos:].encode("utf-8")
+  parts.append(tail)
+  length += len(tail)
+  return _coalesce(parts), length
+
+
+def _coalesce(parts: List[Any]) -> List[Any]:
+  """Join runs of adjacent bytes parts so the body is sent in as few writes as possible"""
+  coalesced: List[Any] = []
+  run: List[bytes] = []
+  for part in parts:
+    if isinstance(part, bytes):
+      run.append(part)
+      continue
+    if run:
+      coalesced.append(b"".join(run))
+      run = []
+    coalesced.append(part)
+  if run:
+    coalesced.append(b"".join(run))
+  return coalesced
+
+
+async def stream_parts(parts: List[Any]) -> AsyncIterator[bytes]:
+  """Yield encoded body parts, reading spooled attachments chunk by chunk off the event loop"""
+  for part in parts:
+    if isinstance(part, SpooledAttachment):
+      f = await asyncio.to_thread(open, part.path, "rb")
+      try:
+        while chunk := await asyncio.to_thread(f.read, READ_CHUNK):
+          yield chunk
+      finally:
+        f.close()
+    else:
+      yield part
+
+
+def describe_payload(value: Any, limit: int = 200) -> Any:
+  """Copy of a payload with long strings and attachments abbreviated, for logging"""
+  if isinstance(value, str):
+    return value if len(value) <= limit else f"{value[:limit]}... ({len(value)} chars)"
+  if isinstance(value, (SpooledAttachment, DataUrl)):
+    return repr(value)
+  if isinstance(value, PreEncoded):
+    return describe_payload(value.to_dict(), limit)
+  if isinstance(value, list):
+    return [describe_payload(v, limit) for v in value]
+  if isinstance(value, dict):
+    return {k: describe_payload(v, limit) for k, v in value.items()}
+  return value
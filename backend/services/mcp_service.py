@@ -1,7 +1,10 @@
 import asyncio
+import hashlib
 import json
 import os
-from typing import Optional, Dict, List, Any
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List, Any, Tuple
 
 try:
   from fastmcp import Client
@@ -9,11 +12,38 @@ except ImportError:
   print("FastMCP not installed. Please install with: pip install fastmcp")
   Client = None
 
+from services.metrics import metrics
+
+POOL_MAX_CLIENTS = int(os.getenv("MCP_POOL_MAX_CLIENTS", "32"))
+POOL_MAX_BYTES = int(os.getenv("MCP_POOL_MAX_BYTES", str(1024 * 1024 * 1024)))
+POOL_IDLE_SECONDS = float(os.getenv("MCP_POOL_IDLE_SECONDS", "300"))
+POOL_MAX_PER_TENANT = int(os.getenv("MCP_POOL_MAX_PER_TENANT", "4"))
+# Rough resident cost of a client; stdio servers run as a subprocess
+STDIO_CLIENT_BYTES = int(os.getenv("MCP_STDIO_CLIENT_BYTES", str(64 * 1024 * 1024)))
+HTTP_CLIENT_BYTES = 1024 * 1024
+# Backoff before retrying default servers that failed to connect
+RETRY_MIN_SECONDS = float(os.getenv("MCP_RETRY_MIN_SECONDS", "5"))
+RETRY_MAX_SECONDS = float(os.getenv("MCP_RETRY_MAX_SECONDS", "300"))
+
+
+def canonical_config_key(config: Dict[str, Any]) -> str:
+  """Digest of a server config that is the same for equal configs regardless of key order"""
+  encoded = json.dumps(config, sort_keys=True, separators=(",", ":"), default=str)
+  return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def estimate_client_bytes(config: Dict[str, Any], client: "MCPClient") -> int:
+  """Approximate memory held by a connected client, for the pool's byte bound"""
+  base = STDIO_CLIENT_BYTES if config.get("command") else HTTP_CLIENT_BYTES
+  return base + len(json.dumps(client.available_tools))
+
+
 class MCPClient:
   def __init__(self):
     self.client: Optional[Client] = None
     self.available_tools = []
     self.connected = False
+    self.active_calls = 0
 
   def convert_tool_format(self, tool):
     """Convert MCP tool definition to OpenAI-compatible tool definition"""
@@ -103,6 +133,14 @@ class MCPClient:
 
   async def call_tool(self, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
     """Execute a tool call through the MCP server"""
+    # The pool never evicts a client while a call is in flight
+    self.active_calls += 1
+    try:
+      return await self._call_tool(tool_name, tool_args)
+    finally:
+      self.active_calls -= 1
+
+  async def _call_tool(self, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
     print(f"Calling tool {tool_name} with args {tool_args}")
     if not self.connected or not self.client:
       print("MCP client not connected")
@@ -158,52 +196,301 @@ class MCPClient:
       }
 
   async def cleanup(self):
-    """Clean up the MCP client connection"""
-    # FastMCP clients clean up automatically when exiting context
+    """Close the session and, for stdio servers, terminate the subprocess"""
+    # FastMCP keeps stdio subprocesses alive between sessions, so exiting the context isn't enough
+    client, self.client = self.client, None
     self.connected = False
-    self.client = None
+    if client is not None:
+      try:
+        await client.close()
+      except Exception as e:
+        print(f"Error closing MCP client: {e}")
+
+
+class PooledClient:
+  """Pool bookkeeping for one connected client"""
+
+  def __init__(self, client: MCPClient, tenant: Optional[str], pinned: bool, size: int):
+    self.client = client
+    self.tenant = tenant
+    self.pinned = pinned
+    self.size = size
+    self.last_used = time.monotonic()
+
+
+class MCPClientPool:
+  """
+  Connected MCP clients keyed by canonical config
+
+  Bounded by count and estimated bytes with LRU eviction, by clients per
+  tenant, and by idle time. Pinned clients (the default servers) and clients
+  with a tool call in flight are never evicted. Evicted clients are returned
+  to the caller, which shuts them down outside the pool.
+  """
+
+  def __init__(
+    self,
+    max_clients: int = POOL_MAX_CLIENTS,
+    max_bytes: int = POOL_MAX_BYTES,
+    idle_timeout: float = POOL_IDLE_SECONDS,
+    max_per_tenant: int = POOL_MAX_PER_TENANT,
+  ):
+    self.max_clients = max_clients
+    self.max_bytes = max_bytes
+    self.idle_timeout = idle_timeout
+    self.max_per_tenant = max_per_tenant
+    self.entries: "OrderedDict[str, PooledClient]" = OrderedDict()
+    self.bytes = 0
+
+  def __contains__(self, key: str) -> bool:
+    return key in self.entries
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def items(self) -> List[Tuple[str, MCPClient]]:
+    return [(key, entry.client) for key, entry in self.entries.items()]
+
+  def get(self, key: str) -> Optional[MCPClient]:
+    """Return a pooled client and mark it most recently used"""
+    entry = self.entries.get(key)
+    if entry is None:
+      return None
+    entry.last_used = time.monotonic()
+    self.entries.move_to_end(key)
+    return entry.client
+
+  def add(self, key: str, client: MCPClient, tenant: Optional[str] = None, pinned: bool = False, size: int = 0) -> List[MCPClient]:
+    """Insert a client and return any clients evicted to make room"""
+    evicted = [self._remove(key, "replaced")] if key in self.entries else []
+    self.entries[key] = PooledClient(client, tenant, pinned, size)
+    self.bytes += size
+
+    if tenant is not None:
+      owned = [k for k, e in self.entries.items() if e.tenant == tenant]
+      excess = len(owned) - self.max_per_tenant
+      for victim in self._evictable(owned, exclude=key)[:max(0, excess)]:
+        evicted.append(self._remove(victim, "tenant"))
+
+    for victim in self._evictable(list(self.entries), exclude=key):
+      if len(self.entries) <= self.max_clients and self.bytes <= self.max_bytes:
+        break
+      evicted.append(self._remove(victim, "capacity"))
+
+    self._report()
+    return [client for client in evicted if client is not None]
+
+  def expire(self) -> List[MCPClient]:
+    """Remove and return clients idle for longer than idle_timeout"""
+    cutoff = time.monotonic() - self.idle_timeout
+    idle = [k for k in self._evictable(list(self.entries)) if self.entries[k].last_used < cutoff]
+    evicted = [self._remove(key, "idle") for key in idle]
+    if evicted:
+      self._report()
+    return evicted
+
+  def has_evictable(self) -> bool:
+    return any(not entry.pinned for entry in self.entries.values())
+
+  def clear(self) -> List[MCPClient]:
+    evicted = [entry.client for entry in self.entries.values()]
+    self.entries.clear()
+    self.bytes = 0
+    self._report()
+    return evicted
+
+  def _evictable(self, keys: List[str], exclude: Optional[str] = None) -> List[str]:
+    """Keys that may be evicted, least recently used first"""
+    return [
+      key for key in keys
+      if key != exclude and not self.entries[key].pinned and not self.entries[key].client.active_calls
+    ]
+
+  def _remove(self, key: str, reason: str) -> MCPClient:
+    entry = self.entries.pop(key)
+    self.bytes -= entry.size
+    metrics.increment(f"mcp_pool.evictions.{reason}")
+    return entry.client
+
+  def _report(self):
+    metrics.set_gauge("mcp_pool.clients", len(self.entries))
+    metrics.set_gauge("mcp_pool.bytes", self.bytes)
+
+  def stats(self) -> Dict[str, Any]:
+    now = time.monotonic()
+    return {
+      "clients": len(self.entries),
+      "bytes": self.bytes,
+      "max_clients": self.max_clients,
+      "max_bytes": self.max_bytes,
+      "idle_timeout": self.idle_timeout,
+      "max_per_tenant": self.max_per_tenant,
+      "entries": [
+        {
+          "key": key,
+          "tenant": entry.tenant,
+          "pinned": entry.pinned,
+          "bytes": entry.size,
+          "active_calls": entry.client.active_calls,
+          "idle_seconds": round(now - entry.last_used, 1),
+        }
+        for key, entry in self.entries.items()
+      ],
+    }
+
 
 # Global MCP client manager
 class MCPManager:
-  def __init__(self):
-    self.clients: Dict[str, MCPClient] = {}
-    self.default_configs = json.load(open(os.path.join(os.path.dirname(__file__), 'mcp_servers.json')))
+  def __init__(self, config_path: str = os.path.join(os.path.dirname(__file__), 'mcp_servers.json')):
+    self.pool = MCPClientPool()
+    self.config_path = config_path
+    self._default_configs: Optional[Dict[str, Any]] = None
+    self._tools_payload: Optional[List[Dict[str, Any]]] = None
+    self._retry_at = 0.0
+    self._retry_delay = RETRY_MIN_SECONDS
+    self._connecting: Dict[str, asyncio.Future] = {}
+    self._reaper: Optional[asyncio.Task] = None
 
-  async def get_or_create_client(self, server_type: str = "filesystem", custom_config: Optional[Dict] = None) -> MCPClient:
-    """Get existing client or create new one"""
-    client_key = f"{server_type}_{hash(str(custom_config) if custom_config else '')}"
-    
-    if client_key not in self.clients:
-      client = MCPClient()
-      config = custom_config or self.default_configs.get(server_type)
-      
-      if not config:
-        raise ValueError(f"No configuration found for server type: {server_type}")
-      
-      success = await client.connect_to_server(config)
-      if success:
-        self.clients[client_key] = client
-      else:
-        raise Exception(f"Failed to connect to {server_type} MCP server")
-    
-    return self.clients[client_key]
+  @property
+  def default_configs(self) -> Dict[str, Any]:
+    """Server configs from mcp_servers.json, read on first use"""
+    if self._default_configs is None:
+      self.load_configs()
+    return self._default_configs
+
+  def load_configs(self):
+    with open(self.config_path) as f:
+      self._default_configs = json.load(f)
+
+  @staticmethod
+  def _client_key(server_type: str, custom_config: Optional[Dict] = None) -> str:
+    if not custom_config:
+      return f"{server_type}:default"
+    return f"{server_type}:{canonical_config_key(custom_config)}"
+
+  async def get_or_create_client(
+    self,
+    server_type: str = "filesystem",
+    custom_config: Optional[Dict] = None,
+    tenant: Optional[str] = None,
+  ) -> MCPClient:
+    """
+    Get a pooled client or connect a new one
+
+    Default servers are pinned. Custom configs can be evicted and count
+    against `tenant`'s per-tenant cap, so callers must pass the identity of
+    the client they connect for (e.g. `client_identity` of the request).
+    """
+    if custom_config and not tenant:
+      raise ValueError("Custom MCP configs must be connected on behalf of a tenant")
+    client_key = self._client_key(server_type, custom_config)
+    client = self.pool.get(client_key)
+    if client is not None:
+      return client
+
+    # Concurrent requests for the same config share one connection attempt
+    pending = self._connecting.get(client_key)
+    if pending is None:
+      pending = asyncio.ensure_future(self._connect(client_key, server_type, custom_config, tenant))
+      self._connecting[client_key] = pending
+      pending.add_done_callback(lambda _: self._connecting.pop(client_key, None))
+    return await asyncio.shield(pending)
+
+  async def _connect(self, client_key: str, server_type: str, custom_config: Optional[Dict], tenant: Optional[str]) -> MCPClient:
+    config = custom_config or self.default_configs.get(server_type)
+    if not config:
+      raise ValueError(f"No configuration found for server type: {server_type}")
+
+    client = MCPClient()
+    success = await client.connect_to_server(config)
+    if not success:
+      await client.cleanup()
+      raise Exception(f"Failed to connect to {server_type} MCP server")
+
+    evicted = self.pool.add(
+      client_key,
+      client,
+      tenant=tenant,
+      pinned=not custom_config,
+      size=estimate_client_bytes(config, client),
+    )
+    self._tools_payload = None
+    await self._shutdown(evicted)
+    if self.pool.has_evictable() and (self._reaper is None or self._reaper.done()):
+      self._reaper = asyncio.create_task(self._reap_idle())
+    return client
+
+  async def _shutdown(self, clients: List[MCPClient]):
+    if clients:
+      await asyncio.gather(*[client.cleanup() for client in clients], return_exceptions=True)
+
+  async def _reap_idle(self):
+    """Close idle custom clients; exits once only pinned clients remain"""
+    while self.pool.has_evictable():
+      await asyncio.sleep(max(1.0, self.pool.idle_timeout / 4))
+      await self._shutdown(self.pool.expire())
 
   async def get_or_create_all_clients(self) -> List[MCPClient]:
-    """Get or create clients for all default server types"""
+    """Get or create clients for all default server types, connecting in parallel"""
+    server_types = list(self.default_configs.keys())
+    results = await asyncio.gather(
+      *[self.get_or_create_client(server_type) for server_type in server_types],
+      return_exceptions=True,
+    )
     clients = []
-    for server_type in self.default_configs.keys():
-      try:
-        print(f"Creating MCP client for server type: {server_type}")
-        client = await self.get_or_create_client(server_type)
-        clients.append(client)
-      except Exception as e:
-        print(f"Error creating client for {server_type}: {e}")
+    for server_type, result in zip(server_types, results):
+      if isinstance(result, Exception):
+        print(f"Error creating client for {server_type}: {result}")
+      else:
+        clients.append(result)
     return clients
 
+  async def get_tools_payload(self) -> List[Dict[str, Any]]:
+    """
+    OpenAI-format tool list across all default servers
+
+    The list is only cached once every default server is connected. While
+    some are down, requests get the tools of the connected ones, and the
+    missing servers are retried with exponential backoff.
+    """
+    if self._tools_payload is not None:
+      return self._tools_payload
+
+    if time.monotonic() < self._retry_at:
+      clients = [
+        client
+        for client in (self.pool.get(self._client_key(server_type)) for server_type in self.default_configs)
+        if client is not None
+      ]
+    else:
+      clients = await self.get_or_create_all_clients()
+
+    tools = []
+    for client in clients:
+      tools.extend(await client.get_available_tools())
+
+    if len(clients) == len(self.default_configs):
+      self._tools_payload = tools
+      self._retry_delay = RETRY_MIN_SECONDS
+    elif time.monotonic() >= self._retry_at:
+      self._retry_at = time.monotonic() + self._retry_delay
+      print(f"MCP tools incomplete ({len(clients)}/{len(self.default_configs)} servers), retrying in {self._retry_delay:.0f}s")
+      self._retry_delay = min(self._retry_delay * 2, RETRY_MAX_SECONDS)
+    return tools
+
+  async def warm_up(self) -> Dict[str, bool]:
+    """Connect every default server and prebuild the tool payload; returns per-server status"""
+    await self.get_tools_payload()
+    return {
+      server_type: self._client_key(server_type) in self.pool
+      for server_type in self.default_configs
+    }
+
   async def call_tool(self, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
     """Call a tool on the connected mcp clients matching the tool name"""
-    for client in self.clients.values():
+    for client_key, client in self.pool.items():
       if any(tool['function']['name'] == tool_name for tool in client.available_tools):
+        self.pool.get(client_key)
         return await client.call_tool(tool_name, tool_args)
     return {
       "success": False,
@@ -214,9 +501,13 @@ class MCPManager:
 
   async def cleanup_all(self):
     """Clean up all MCP client connections"""
-    for client in self.clients.values():
-      await client.cleanup()
-    self.clients.clear()
+    if self._reaper is not None:
+      self._reaper.cancel()
+      self._reaper = None
+    await self._shutdown(self.pool.clear())
+    self._tools_payload = None
+    self._retry_at = 0.0
+    self._retry_delay = RETRY_MIN_SECONDS
 
 # Global MCP manager instance
 mcp_manager = MCPManager()
@@ -0,0 +1,223 @@
+"""
+Compact message records with memoised JSON fragments
+
+The client resends the whole chat history every turn. Without this module,
+every message is rebuilt into OpenRouter content dicts and the full history
+is JSON-encoded again, on every turn and again on every tool round. A
+MessageRecord is a frozen, slotted snapshot of one prepared message with
+typed parts. Each part is encoded once, into the same part list encode_payload
+produces, so building a payload concatenates cached bytes and only encodes
+what is new. Prompt-cache breakpoints are spliced into those bytes when the
+record is encoded, so marked copies of a record share its encodings.
+
+Records are also kept across requests in a byte-bounded LRU, keyed by the
+message's role, text and attachment values. Next turn, the unchanged history
+reuses its records and their encoded bytes. Records that reference spooled
+attachments are only reused within their own request, because their temp
+files are deleted when the request ends.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, List, Optional, Tuple, Union
+
+from models.schemas import Message
+from services.ingestion import PreEncoded, SpooledAttachment, data_url, encode_payload
+from services.metrics import metrics
+
+RECORD_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+CACHE_CONTROL = {"type": "ephemeral"}
+CACHE_CONTROL_SUFFIX = b',"cache_control":' + json.dumps(CACHE_CONTROL, separators=(",", ":")).encode() + b"}"
+
+
+@dataclass(frozen=True, slots=True)
+class TextPart:
+  """A text content part"""
+  text: str
+
+  @property
+  def size(self) -> int:
+    return len(self.text)
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {"type": "text", "text": self.text}
+
+
+@dataclass(frozen=True, slots=True)
+class AttachmentRef:
+  """A base64 attachment, held as a str or a SpooledAttachment"""
+  kind: str  # "image", "audio" or "pdf"
+  data: Any
+  format: str = ""
+  filename: str = ""
+
+  @property
+  def spooled(self) -> bool:
+    return isinstance(self.data, SpooledAttachment)
+
+  @property
+  def size(self) -> int:
+    return self.data.size if self.spooled else len(self.data)
+
+  def to_dict(self) -> Dict[str, Any]:
+    if self.kind == "image":
+      return {"type": "image_url", "image_url": {"url": data_url(f"data:image/{self.format};base64,", self.data)}}
+    if self.kind == "audio":
+      return {"type": "input_audio", "input_audio": {"data": self.data, "format": self.format}}
+    return {
+      "type": "file",
+      "file": {"filename": self.filename, "file_data": data_url("data:application/pdf;base64,", self.data)},
+    }
+
+
+Part = Union[TextPart, AttachmentRef]
+
+
+@dataclass(frozen=True, slots=True)
+class MessageRecord(PreEncoded):
+  """One prepared chat message that encodes its parts to JSON at most once"""
+  role: str
+  parts: Tuple[Part, ...]
+  breakpoints: FrozenSet[int] = frozenset()
+  _fragments: Optional[Tuple[Tuple[List[Any], int], ...]] = field(default=None, init=False, repr=False, compare=False)
+
+  @property
+  def spooled(self) -> bool:
+    return any(isinstance(part, AttachmentRef) and part.spooled for part in self.parts)
+
+  @property
+  def size(self) -> int:
+    return sum(part.size for part in self.parts)
+
+  def content(self) -> List[Dict[str, Any]]:
+    content = [part.to_dict() for part in self.parts]
+    for index in self.breakpoints:
+      content[index]["cache_control"] = CACHE_CONTROL
+    return content
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {"role": self.role, "content": self.content()}
+
+  def fragments(self) -> Tuple[Tuple[List[Any], int], ...]:
+    """Encoded parts, without cache_control; shared by every breakpoint variant"""
+    if self._fragments is None:
+      # Frozen records still memoise; the fragments are derived purely from the fields
+      object.__setattr__(self, "_fragments", tuple(encode_payload(part.to_dict()) for part in self.parts))
+      metrics.increment("message_records.encoded")
+    return self._fragments
+
+  def encoded(self) -> Tuple[List[Any], int]:
+    head = b'{"role":' + json.dumps(self.role).encode("utf-8") + b',"content":['
+    parts: List[Any] = [head]
+    length = len(head)
+    for index, (fragment, fragment_length) in enumerate(self.fragments()):
+      if index:
+        parts.append(b",")
+        length += 1
+      if index in self.breakpoints:
+        # Splice cache_control in before the part's closing brace
+        parts += [*fragment[:-1], fragment[-1][:-1] + CACHE_CONTROL_SUFFIX]
+        length += fragment_length - 1 + len(CACHE_CONTROL_SUFFIX)
+      else:
+        parts += fragment
+        length += fragment_length
+    parts.append(b"]}")
+    return parts, length + 2
+
+  def with_breakpoints(self, indices: Iterable[int]) -> "MessageRecord":
+    """Copy with cache_control on the given parts, reusing this record's part encodings"""
+    indices = frozenset(indices)
+    if indices == self.breakpoints:
+      return self
+    variant = replace(self, breakpoints=indices)
+    object.__setattr__(variant, "_fragments", self.fragments())
+    return variant
+
+
+def build_parts(msg: Message) -> Tuple[Part, ...]:
+  """Content parts for a message, in the order OpenRouter expects them"""
+  parts: List[Part] = []
+
+  if msg.content:
+    parts.append(TextPart(msg.content))
+
+  if msg.image:
+    parts.append(AttachmentRef("image", msg.image["data"], format=msg.image["format"]))
+
+  if msg.audio:
+    parts.append(AttachmentRef("audio", msg.audio["data"], format=msg.audio["format"]))
+
+  # Locally extracted PDFs become text chunks plus page images
+  if msg.pdf and "extracted" in msg.pdf:
+    extracted = msg.pdf["extracted"]
+    parts += [TextPart(chunk) for chunk in extracted["chunks"]]
+    parts += [AttachmentRef("image", image["data"], format=image["format"]) for image in extracted["images"]]
+  elif msg.pdf:
+    parts.append(AttachmentRef("pdf", msg.pdf["data"], filename=msg.pdf["filename"]))
+
+  return tuple(parts)
+
+
+def message_key(msg: Message) -> Optional[Hashable]:
+  """Identity of a message's prepared content, or None if it holds spooled attachments"""
+  key: List[Hashable] = [msg.role, msg.content]
+  for kind in ("image", "audio", "pdf"):
+    value = getattr(msg, kind)
+    if not value:
+      key.append(None)
+      continue
+    if "extracted" in value:
+      extracted = value["extracted"]
+      key.append((
+        value["filename"],
+        tuple(extracted["chunks"]),
+        tuple((image["format"], image["data"]) for image in extracted["images"]),
+      ))
+      continue
+    if isinstance(value.get("data"), SpooledAttachment):
+      return None
+    key.append((value.get("format"), value.get("filename"), value.get("data")))
+  return tuple(key)
+
+
+class RecordCache:
+  """Byte-bounded LRU of message records shared across requests"""
+
+  def __init__(self, max_bytes: int = RECORD_CACHE_MAX_BYTES):
+    self.max_bytes = max_bytes
+    self.entries: "OrderedDict[Hashable, MessageRecord]" = OrderedDict()
+    self.bytes = 0
+    self.lock = threading.Lock()
+
+  def record_for(self, msg: Message) -> MessageRecord:
+    key = message_key(msg)
+    if key is None:
+      return MessageRecord(msg.role, build_parts(msg))
+
+    with self.lock:
+      record = self.entries.get(key)
+      if record is not None:
+        self.entries.move_to_end(key)
+        metrics.increment("message_records.hits")
+        return record
+
+    record = MessageRecord(msg.role, build_parts(msg))
+    metrics.increment("message_records.misses")
+    # The memoised part encodings roughly double what the record holds
+    size = 2 * record.size
+    with self.lock:
+      if size <= self.max_bytes and key not in self.entries:
+        self.entries[key] = record
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+          _, evicted = self.entries.popitem(last=False)
+          self.bytes -= 2 * evicted.size
+    return record
+
+
+# Global message record cache instance
+record_cache = RecordCache()
@@ -0,0 +1,78 @@
+"""
+Lightweight in-process metrics registry
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Any, Deque
+
+
+class Summary:
+  """Running summary of observed values with a bounded window for percentiles"""
+
+  def __init__(self, window: int = 1024):
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.recent: Deque[float] = deque(maxlen=window)
+
+  def observe(self, value: float):
+    self.count += 1
+    self.total += value
+    self.max = max(self.max, value)
+    self.recent.append(value)
+
+  def percentile(self, q: float) -> float:
+    if not self.recent:
+      return 0.0
+    ordered = sorted(self.recent)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+  def snapshot(self) -> Dict[str, float]:
+    return {
+      "count": self.count,
+      "sum": round(self.total, 6),
+      "avg": round(self.total / self.count, 6) if self.count else 0.0,
+      "max": round(self.max, 6),
+      "p50": round(self.percentile(0.50), 6),
+      "p95": round(self.percentile(0.95), 6),
+    }
+
+
+class MetricsRegistry:
+  """Process-wide counters, gauges and summaries keyed by name"""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.counters: Dict[str, float] = {}
+    self.gauges: Dict[str, float] = {}
+    self.summaries: Dict[str, Summary] = {}
+
+  def increment(self, name: str, value: float = 1):
+    with self._lock:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+  def set_gauge(self, name: str, value: float):
+    with self._lock:
+      self.gauges[name] = value
+
+  def observe(self, name: str, value: float):
+    with self._lock:
+      summary = self.summaries.get(name)
+      if summary is None:
+        summary = self.summaries[name] = Summary()
+      summary.observe(value)
+
+  def snapshot(self) -> Dict[str, Any]:
+    with self._lock:
+      return {
+        "counters": dict(self.counters),
+        "gauges": dict(self.gauges),
+        "summaries": {
+          name: summary.snapshot() for name, summary in self.summaries.items()
+        },
+      }
+
+
+# Global metrics registry instance
+metrics = MetricsRegistry()
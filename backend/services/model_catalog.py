@@ -0,0 +1,47 @@
+"""
+Cached OpenRouter model catalog
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from services.http_client import http_pool, OPENROUTER_BASE_URL
+
+
+class ModelCatalog:
+  """Model metadata from OpenRouter, refreshed at most every `ttl` seconds"""
+
+  def __init__(self, ttl: float = 600.0):
+    self.ttl = ttl
+    self.models: Dict[str, Dict[str, Any]] = {}
+    self.fetched_at = 0.0
+    self._lock = asyncio.Lock()
+
+  @property
+  def fresh(self) -> bool:
+    return bool(self.models) and time.monotonic() - self.fetched_at < self.ttl
+
+  async def refresh(self):
+    """Fetch the full catalog from OpenRouter"""
+    async with self._lock:
+      if self.fresh:
+        return
+      response = await http_pool.client.get(OPENROUTER_BASE_URL + "/models")
+      response.raise_for_status()
+      self.models = {m["id"]: m for m in response.json()["data"]}
+      self.fetched_at = time.monotonic()
+
+  async def get_model(self, model_id: str) -> Optional[Dict[str, Any]]:
+    """Metadata for one model, refreshing the catalog when stale or the id is unknown"""
+    if not self.fresh or model_id not in self.models:
+      try:
+        await self.refresh()
+      except Exception as e:
+        # Serve stale data rather than failing the request
+        print(f"Failed to refresh model catalog: {e}")
+    return self.models.get(model_id)
+
+
+# Global model catalog instance
+model_catalog = ModelCatalog()
@@ -0,0 +1,200 @@
+"""
+Local PDF text extraction
+
+By default PDFs are sent upstream as base64 files and parsed by OpenRouter's
+file-parser plugin, which re-parses the whole document on every turn. With
+PDF_EXTRACTION=local the text (plus embedded images for pages without a text
+layer) is extracted here once, in a process pool, cached by content hash and
+sent as plain text chunks within a token budget. Embedded images come in
+whatever format the PDF stores (JPEG 2000, TIFF, raw bitmaps), so the worker
+re-encodes them to PNG or JPEG within the model's maximum edge, like uploads.
+"""
+
+import asyncio
+import base64
+import os
+import tempfile
+from typing import Dict, List, Optional, Any
+
+from services.metrics import metrics
+from services.ingestion import SpooledAttachment, content_digest
+from services.image_service import JPEG_QUALITY, Image, encode_image
+from services.tokens import CHARS_PER_TOKEN
+from services.worker_pool import ByteBoundedLRU, PooledWorker
+
+try:
+  from pypdf import PdfReader
+except ImportError:
+  print("pypdf not installed, PDFs will be parsed by the provider. Install with: pip install pypdf")
+  PdfReader = None
+
+PDF_EXTRACTION = os.getenv("PDF_EXTRACTION", "provider")
+TOKEN_BUDGET = int(os.getenv("PDF_TOKEN_BUDGET", "24000"))
+CHUNK_TOKENS = int(os.getenv("PDF_CHUNK_TOKENS", "2000"))
+MAX_PAGE_IMAGES = int(os.getenv("PDF_MAX_PAGE_IMAGES", "8"))
+CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+POOL_WORKERS = int(os.getenv("PDF_POOL_WORKERS", "2"))
+
+# Pages with less text than this are treated as scanned and get their images attached
+MIN_PAGE_TEXT = 20
+# Base64 decodes in 4-character groups, so spool in multiples of 4
+SPOOL_CHUNK = 4 * 1024 * 1024
+# Formats providers accept as-is when Pillow is not available to re-encode
+PROVIDER_IMAGE_FORMATS = {"png", "jpeg"}
+
+
+def local_extraction_enabled() -> bool:
+  return PDF_EXTRACTION == "local" and PdfReader is not None
+
+
+def page_image(name: str, raw: bytes, max_edge: int) -> Optional[Dict[str, str]]:
+  """An embedded image as a {format, data} dict providers accept, or None if it can't be converted"""
+  fmt = (name.rsplit(".", 1)[-1] or "png").lower()
+  fmt = "jpeg" if fmt == "jpg" else fmt
+  if Image is not None:
+    try:
+      encoded_fmt, encoded, resized = encode_image(raw, max_edge, JPEG_QUALITY)
+    except Exception as e:
+      print(f"Could not re-encode embedded image {name}: {e}")
+      return None
+    # Keep an already acceptable original when re-encoding would only make it bigger
+    if resized or fmt not in PROVIDER_IMAGE_FORMATS or len(encoded) < len(raw):
+      fmt, raw = encoded_fmt, encoded
+  elif fmt not in PROVIDER_IMAGE_FORMATS:
+    return None
+  return {"format": fmt, "data": base64.b64encode(raw).decode("ascii")}
+
+
+def extract_pdf(path: str, max_images: int, max_edge: int) -> Dict[str, Any]:
+  """
+  Extract per-page text from a PDF file, one page at a time
+
+  Runs inside a worker process. Pages without a usable text layer contribute
+  their embedded images instead, re-encoded within max_edge, up to max_images
+  in total.
+  """
+  reader = PdfReader(path)
+  pages: List[str] = []
+  images: List[Dict[str, Any]] = []
+
+  for number, page in enumerate(reader.pages, start=1):
+    text = (page.extract_text() or "").strip()
+    pages.append(text)
+    if len(text) >= MIN_PAGE_TEXT or len(images) >= max_images:
+      continue
+    try:
+      for image in page.images:
+        if len(images) >= max_images:
+          break
+        converted = page_image(image.name, image.data, max_edge)
+        if converted is not None:
+          images.append({"page": number, **converted})
+    except Exception as e:
+      print(f"Could not extract images from page {number}: {e}")
+
+  return {"pages": pages, "images": images}
+
+
+def chunk_pages(pages: List[str], filename: str, token_budget: int, chunk_tokens: int) -> List[str]:
+  """Group page texts into labelled chunks of about chunk_tokens, stopping at token_budget"""
+  budget_chars = token_budget * CHARS_PER_TOKEN
+  chunk_chars = chunk_tokens * CHARS_PER_TOKEN
+  chunks: List[str] = []
+  parts: List[str] = []
+  size = 0
+  first_page = 1
+  used = 0
+
+  def flush(last_page: int):
+    if parts:
+      chunks.append(f"[{filename}, pages {first_page}-{last_page}]\n" + "\n\n".join(parts))
+
+  for number, text in enumerate(pages, start=1):
+    if not text:
+      continue
+    truncated = used + len(text) > budget_chars
+    if truncated:
+      text = text[: max(0, budget_chars - used)]
+    if size and size + len(text) > chunk_chars:
+      flush(number - 1)
+      parts, size, first_page = [], 0, number
+    parts.append(text)
+    size += len(text)
+    used += len(text)
+    if truncated:
+      flush(number)
+      chunks.append(f"[{filename}: truncated after page {number} of {len(pages)} to fit the context budget]")
+      return chunks
+
+  flush(len(pages))
+  return chunks
+
+
+def spool_base64(data) -> str:
+  """
+  Decode base64 (a str or spooled attachment) into a temporary file in
+  bounded chunks and return its path
+
+  The file is removed again if decoding fails.
+  """
+  with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+    try:
+      if isinstance(data, SpooledAttachment):
+        for chunk in data.iter_decoded(SPOOL_CHUNK):
+          f.write(chunk)
+      else:
+        for start in range(0, len(data), SPOOL_CHUNK):
+          f.write(base64.b64decode(data[start:start + SPOOL_CHUNK]))
+    except BaseException:
+      f.close()
+      os.unlink(f.name)
+      raise
+    return f.name
+
+
+def result_size(result: Dict[str, Any]) -> int:
+  return sum(len(p) for p in result["pages"]) + sum(len(i["data"]) for i in result["images"])
+
+
+class PdfExtractor(PooledWorker):
+  """Process-pool PDF extractor with a byte-bounded LRU cache keyed by content hash"""
+
+  def __init__(self, max_workers: int = POOL_WORKERS, cache_max_bytes: int = CACHE_MAX_BYTES):
+    super().__init__(max_workers)
+    self.cache = ByteBoundedLRU(cache_max_bytes, result_size)
+
+  async def extract(self, pdf: Dict[str, str], max_edge: int) -> Optional[Dict[str, Any]]:
+    """
+    Extract a {data, filename} PDF dict, fitting page images within max_edge
+
+    Returns {"chunks": [...], "images": [...]} ready for prepare_messages, or
+    None if extraction failed and the PDF should go to the provider instead.
+    """
+    key = f"{max_edge}:{content_digest(pdf['data'])}"
+    hit, result = self.cache.get(key)
+    if hit:
+      metrics.increment("pdf.cache_hits")
+    else:
+      loop = asyncio.get_running_loop()
+      path = None
+      try:
+        path = await asyncio.to_thread(spool_base64, pdf["data"])
+        result = await loop.run_in_executor(self.pool, extract_pdf, path, MAX_PAGE_IMAGES, max_edge)
+      except Exception as e:
+        print(f"Local PDF extraction failed for {pdf.get('filename')}: {e}")
+        metrics.increment("pdf.errors")
+        return None
+      finally:
+        if path is not None:
+          os.unlink(path)
+      metrics.increment("pdf.extracted")
+      self.cache.put(key, result)
+
+    return {
+      "chunks": chunk_pages(result["pages"], pdf["filename"], TOKEN_BUDGET, CHUNK_TOKENS),
+      "images": result["images"],
+    }
+
+
+# Global PDF extractor instance
+pdf_extractor = PdfExtractor()
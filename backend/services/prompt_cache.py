@@ -0,0 +1,153 @@
+"""
+Prompt-cache breakpoints for long, stable conversation prefixes
+
+Every turn resends the whole conversation. Providers cache a request prefix
+only if it is byte-identical from turn to turn, so tools and system content
+go first in a fixed order. OpenAI, DeepSeek and similar providers then cache
+automatically. Anthropic and Gemini only cache up to content blocks marked
+with `cache_control`, so for models that bill cache writes we mark the end of
+the stable prefix (the history before the newest message) and the largest
+blocks within it.
+"""
+
+import os
+from typing import Any, Dict, List
+
+from services.ingestion import DataUrl, SpooledAttachment
+from services.message_records import CACHE_CONTROL, MessageRecord
+from services.metrics import metrics
+from services.tokens import CHARS_PER_TOKEN
+
+# Providers ignore breakpoints on prefixes shorter than this
+MIN_CACHE_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+# Anthropic allows four breakpoints per request; OpenRouter only uses the last one for Gemini
+MAX_BREAKPOINTS = {"anthropic/": 4, "google/": 1}
+DEFAULT_MAX_BREAKPOINTS = 4
+
+
+def explicit_breakpoints(model_id: str, model_data: Dict[str, Any]) -> int:
+  """How many cache_control breakpoints a model takes; 0 if it caches automatically or not at all"""
+  pricing = model_data.get("pricing") or {}
+  try:
+    bills_cache_writes = float(pricing.get("input_cache_write") or 0) > 0
+  except (TypeError, ValueError):
+    bills_cache_writes = False
+  for prefix, limit in MAX_BREAKPOINTS.items():
+    if model_id.startswith(prefix):
+      return limit if bills_cache_writes or prefix == "anthropic/" else 0
+  return DEFAULT_MAX_BREAKPOINTS if bills_cache_writes else 0
+
+
+def stable_tools(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+  """Tools in name order, so MCP connection order never changes the prefix"""
+  return sorted(tools, key=lambda tool: tool.get("function", {}).get("name", ""))
+
+
+def _role(message: Any) -> str:
+  return message.role if isinstance(message, MessageRecord) else message.get("role")
+
+
+def _content(message: Any) -> Any:
+  return message.content() if isinstance(message, MessageRecord) else message.get("content")
+
+
+def system_first(messages: List[Any]) -> List[Any]:
+  """System messages moved to the front, keeping the relative order of everything else"""
+  system = [m for m in messages if _role(m) == "system"]
+  if not system:
+    return messages
+  return system + [m for m in messages if _role(m) != "system"]
+
+
+def _value_size(value: Any) -> int:
+  if isinstance(value, DataUrl):
+    return len(value.prefix) + value.attachment.size
+  if isinstance(value, SpooledAttachment):
+    return value.size
+  if isinstance(value, str):
+    return len(value)
+  return 0
+
+
+def part_size(part: Dict[str, Any]) -> int:
+  """Approximate serialised size of one content part"""
+  kind = part.get("type")
+  if kind == "text":
+    return len(part.get("text") or "")
+  if kind == "image_url":
+    return _value_size((part.get("image_url") or {}).get("url"))
+  if kind == "file":
+    return _value_size((part.get("file") or {}).get("file_data"))
+  if kind == "input_audio":
+    return _value_size((part.get("input_audio") or {}).get("data"))
+  return 0
+
+
+def add_breakpoints(messages: List[Any], limit: int) -> List[Any]:
+  """
+  Mark up to `limit` content parts of the stable prefix with cache_control
+
+  The prefix is every message before the last one. Its final part is always
+  marked when the prefix is long enough to cache, since that breakpoint covers
+  the whole history. Remaining breakpoints go on the largest parts, so a big
+  PDF or image stays cached even if the prefix after it changes. Marked
+  messages and parts are copied, never mutated, because messages may be
+  shared between payloads (e.g. fan-out) and records between requests.
+  """
+  if limit <= 0 or len(messages) < 2:
+    return messages
+
+  min_chars = MIN_CACHE_TOKENS * CHARS_PER_TOKEN
+  positions = []  # (cumulative size through this part, part size, message index, part index)
+  total = 0
+  for i, message in enumerate(messages[:-1]):
+    if isinstance(message, MessageRecord):
+      for j, part in enumerate(message.parts):
+        total += part.size
+        positions.append((total, part.size, i, j))
+      continue
+    content = _content(message)
+    if not isinstance(content, list):
+      total += len(content or "")
+      continue
+    for j, part in enumerate(content):
+      size = part_size(part)
+      total += size
+      positions.append((total, size, i, j))
+  if not positions or total < min_chars:
+    return messages
+
+  chosen = [positions[-1]]
+  by_size = sorted(positions[:-1], key=lambda p: p[1], reverse=True)
+  for position in by_size:
+    if len(chosen) >= limit:
+      break
+    if position[0] >= min_chars and position[1] >= min_chars:
+      chosen.append(position)
+
+  by_message: Dict[int, List[int]] = {}
+  for _, _, i, j in chosen:
+    by_message.setdefault(i, []).append(j)
+
+  marked = list(messages)
+  for i, indices in by_message.items():
+    if isinstance(marked[i], MessageRecord):
+      marked[i] = marked[i].with_breakpoints(indices)
+      continue
+    content = list(marked[i]["content"])
+    for j in indices:
+      content[j] = {**content[j], "cache_control": CACHE_CONTROL}
+    marked[i] = {**marked[i], "content": content}
+  metrics.increment("prompt_cache.breakpoints", len(chosen))
+  return marked
+
+
+def record_usage(model_id: str, usage: Dict[str, Any]):
+  """Count prompt, cache-read and cache-write tokens from a usage block, per provider"""
+  provider = model_id.split("/", 1)[0]
+  details = usage.get("prompt_tokens_details") or {}
+  cached = details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0
+  written = details.get("cache_write_tokens") or usage.get("cache_creation_input_tokens") or 0
+  metrics.increment(f"prompt_cache.prompt_tokens.{provider}", usage.get("prompt_tokens") or 0)
+  metrics.increment(f"prompt_cache.cached_tokens.{provider}", cached)
+  metrics.increment(f"prompt_cache.cache_write_tokens.{provider}", written)
@@ -0,0 +1,9 @@
+"""
+Rough token accounting
+
+PDF chunking, tool result pages and prompt-cache thresholds only need an
+estimate of token counts, so they share one characters-per-token ratio
+instead of running a tokenizer. It is close enough for English prose.
+"""
+
+CHARS_PER_TOKEN = 4
@@ -0,0 +1,122 @@
+"""
+Incremental assembly of streamed tool calls
+
+OpenAI-style streams deliver each tool call as a series of deltas keyed by
+`index`: the id and function name arrive first, then the JSON arguments in
+arbitrary fragments. ToolCallAssembler keeps fragments in a list and tracks
+JSON nesting as they arrive, so a call can be reported complete (and
+dispatched) as soon as its arguments close, when the next index starts, or
+when the choice finishes, instead of after the whole stream.
+"""
+
+import json
+from typing import Any, Dict, List
+
+
+class _PendingCall:
+  """One tool call being assembled"""
+
+  def __init__(self):
+    self.id = ""
+    self.name = ""
+    self.fragments: List[str] = []
+    self.depth = 0
+    self.started = False  # seen the opening brace
+    self.in_string = False
+    self.escaped = False
+    self.complete = False
+
+  def feed(self, fragment: str):
+    self.fragments.append(fragment)
+    for char in fragment:
+      if self.in_string:
+        if self.escaped:
+          self.escaped = False
+        elif char == "\\":
+          self.escaped = True
+        elif char == '"':
+          self.in_string = False
+      elif char == '"':
+        self.in_string = True
+      elif char in "{[":
+        self.depth += 1
+        self.started = True
+      elif char in "}]":
+        self.depth -= 1
+
+  @property
+  def arguments(self) -> str:
+    return "".join(self.fragments)
+
+  def looks_complete(self) -> bool:
+    """Balanced braces seen and the joined arguments parse as JSON"""
+    if not (self.started and self.depth == 0 and not self.in_string):
+      return False
+    try:
+      json.loads(self.arguments)
+      return True
+    except json.JSONDecodeError:
+      return False
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      "id": self.id,
+      "type": "function",
+      "function": {"name": self.name, "arguments": self.arguments},
+    }
+
+
+class ToolCallAssembler:
+  """Collects tool-call deltas and reports each call once its arguments are complete"""
+
+  def __init__(self):
+    self.calls: List[_PendingCall] = []
+
+  def __bool__(self) -> bool:
+    return bool(self.calls)
+
+  def add(self, deltas: List[Dict[str, Any]]) -> List[int]:
+    """Apply a delta's tool_calls; returns indices that just became complete"""
+    completed: List[int] = []
+    for delta in deltas:
+      index = delta.get("index")
+      if index is None:
+        continue
+      while len(self.calls) <= index:
+        self.calls.append(_PendingCall())
+
+      # A new index starting means every earlier call has been fully streamed
+      for earlier in range(index):
+        completed += self._complete(earlier)
+
+      call = self.calls[index]
+      if delta.get("id"):
+        call.id = delta["id"]
+      function = delta.get("function") or {}
+      if function.get("name"):
+        call.name = function["name"]
+      if function.get("arguments"):
+        call.feed(function["arguments"])
+        if call.looks_complete():
+          completed += self._complete(index)
+    return completed
+
+  def finish(self) -> List[int]:
+    """Mark every remaining call complete, e.g. on a finish_reason"""
+    completed: List[int] = []
+    for index in range(len(self.calls)):
+      completed += self._complete(index)
+    return completed
+
+  def _complete(self, index: int) -> List[int]:
+    call = self.calls[index]
+    if call.complete or not call.name:
+      return []
+    call.complete = True
+    return [index]
+
+  def get(self, index: int) -> Dict[str, Any]:
+    return self.calls[index].to_dict()
+
+  def tool_calls(self) -> List[Dict[str, Any]]:
+    return [call.to_dict() for call in self.calls]
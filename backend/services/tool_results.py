@@ -0,0 +1,207 @@
+"""
+Budgeting for large MCP tool results
+
+A tool result is appended to `messages` and resent upstream on every later
+round and turn, so one large listing can cost tens of thousands of tokens
+per request. Results over their tool's budget are stored here, compressed,
+under a random handle. The model gets back the first page plus a structural
+summary of the content. It can read further pages by calling the synthetic
+`fetch_tool_result` tool, which is answered locally without touching MCP.
+
+Handles live in this process's memory, so with several workers a fetch only
+succeeds on the worker that ran the original tool call.
+"""
+
+import json
+import os
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from services.metrics import metrics
+from services.tokens import CHARS_PER_TOKEN
+
+DEFAULT_MAX_TOKENS = int(os.getenv("TOOL_RESULT_MAX_TOKENS", "4000"))
+STORE_MAX_BYTES = int(os.getenv("TOOL_RESULT_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+STORE_TTL = float(os.getenv("TOOL_RESULT_TTL_SECONDS", "3600"))
+SUMMARY_MAX_ITEMS = 20
+
+FETCH_TOOL_NAME = "fetch_tool_result"
+FETCH_TOOL = {
+  "type": "function",
+  "function": {
+    "name": FETCH_TOOL_NAME,
+    "description": (
+      "Read another page of a tool result that was too large to return in full. "
+      "Use the handle and page count given in the truncated result."
+    ),
+    "parameters": {
+      "type": "object",
+      "properties": {
+        "handle": {"type": "string", "description": "Handle from the truncated result"},
+        "page": {"type": "integer", "description": "1-based page number", "minimum": 1},
+      },
+      "required": ["handle", "page"],
+    },
+  },
+}
+
+
+def tool_token_limits() -> Dict[str, int]:
+  """Per-tool overrides from TOOL_RESULT_LIMITS, a JSON object of tool name to max tokens"""
+  raw = os.getenv("TOOL_RESULT_LIMITS")
+  if not raw:
+    return {}
+  try:
+    return {name: int(tokens) for name, tokens in json.loads(raw).items()}
+  except (ValueError, AttributeError) as e:
+    print(f"Ignoring invalid TOOL_RESULT_LIMITS: {e}")
+    return {}
+
+
+def describe_item(text: str) -> Dict[str, Any]:
+  """Shape of one content item: JSON structure if it parses, otherwise its size"""
+  try:
+    value = json.loads(text)
+  except (ValueError, TypeError):
+    return {"type": "text", "chars": len(text)}
+  if isinstance(value, list):
+    shape: Dict[str, Any] = {"type": "list", "length": len(value)}
+    if value and isinstance(value[0], dict):
+      shape["item_keys"] = list(value[0])[:20]
+    return shape
+  if isinstance(value, dict):
+    shape = {"type": "object", "keys": list(value)[:20]}
+    for key, item in value.items():
+      if isinstance(item, list):
+        shape.setdefault("list_lengths", {})[key] = len(item)
+    return shape
+  return {"type": type(value).__name__, "chars": len(text)}
+
+
+class ToolResultStore:
+  """Compressed, byte-bounded store of full tool results keyed by handle, expiring after ttl idle seconds"""
+
+  def __init__(
+    self,
+    default_max_tokens: int = DEFAULT_MAX_TOKENS,
+    limits: Optional[Dict[str, int]] = None,
+    max_bytes: int = STORE_MAX_BYTES,
+    ttl: float = STORE_TTL,
+  ):
+    self.default_max_tokens = default_max_tokens
+    self.limits = tool_token_limits() if limits is None else limits
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.entries: "OrderedDict[str, Tuple[bytes, int, float]]" = OrderedDict()
+    self.bytes = 0
+    self.lock = threading.Lock()
+
+  def page_chars(self, tool_name: str) -> int:
+    return self.limits.get(tool_name, self.default_max_tokens) * CHARS_PER_TOKEN
+
+  def budget(self, tool_name: str, result: Dict[str, Any]) -> str:
+    """Message content for a successful tool result, truncated and stored if over budget"""
+    content = result.get("content") or []
+    full = json.dumps(result)
+    page_chars = self.page_chars(tool_name)
+    # Fetched pages are already page-sized; re-budgeting them would store pages of pages
+    if len(full) <= page_chars or tool_name == FETCH_TOOL_NAME:
+      return full
+
+    text = "\n".join(str(item) for item in content)
+    summary = [describe_item(str(item)) for item in content[:SUMMARY_MAX_ITEMS]]
+    if len(content) > SUMMARY_MAX_ITEMS:
+      summary.append(f"...and {len(content) - SUMMARY_MAX_ITEMS} more")
+
+    def truncated(handle: str, pages: int, page: str) -> str:
+      return json.dumps({
+        "success": True,
+        "tool_name": tool_name,
+        "tool_args": result.get("tool_args"),
+        "truncated": True,
+        "handle": handle,
+        "page": 1,
+        "pages": pages,
+        "total_chars": len(text),
+        "summary": summary,
+        "content": page,
+        "note": f"Result truncated. Call {FETCH_TOOL_NAME} with this handle and page=2..{pages} to read more.",
+      })
+
+    # The envelope and summary come out of the page budget. The page count depends
+    # on the page size, so its widest possible value stands in while measuring
+    handle = secrets.token_urlsafe(12)
+    available = page_chars - len(truncated(handle, len(text), ""))
+    floor = page_chars // 4
+    size = max(available, floor)
+    # Content is JSON-escaped in the message, so shrink the page until its escaped form fits
+    while size > floor and (escaped := len(json.dumps(text[:size])) - 2) > available:
+      size = max(floor, size * available // escaped)
+    page_chars = size
+    pages = max(1, -(-len(text) // page_chars))
+    self._put(handle, text, page_chars)
+    metrics.increment("tool_results.truncated")
+    metrics.observe("tool_results.chars_withheld", max(0, len(text) - page_chars))
+    return truncated(handle, pages, text[:page_chars])
+
+  def fetch(self, handle: str, page: int = 1) -> Dict[str, Any]:
+    """A page of a stored result, in the same shape as an MCP tool result"""
+    entry = self._get(handle)
+    if entry is None:
+      return {"success": False, "error": f"Unknown or expired result handle {handle}", "tool_name": FETCH_TOOL_NAME}
+    text, page_chars = entry
+    pages = max(1, -(-len(text) // page_chars))
+    if not 1 <= page <= pages:
+      return {"success": False, "error": f"Page {page} out of range 1..{pages}", "tool_name": FETCH_TOOL_NAME}
+    metrics.increment("tool_results.pages_fetched")
+    start = (page - 1) * page_chars
+    return {
+      "success": True,
+      "tool_name": FETCH_TOOL_NAME,
+      "handle": handle,
+      "page": page,
+      "pages": pages,
+      "content": [text[start:start + page_chars]],
+    }
+
+  def _put(self, handle: str, text: str, page_chars: int):
+    blob = zlib.compress(text.encode("utf-8"), 6)
+    with self.lock:
+      self._expire()
+      if len(blob) > self.max_bytes:
+        return  # too large to keep; fetches will report it as expired
+      self.entries[handle] = (blob, page_chars, time.monotonic())
+      self.bytes += len(blob)
+      while self.bytes > self.max_bytes:
+        _, (evicted, _, _) = self.entries.popitem(last=False)
+        self.bytes -= len(evicted)
+      metrics.set_gauge("tool_results.stored_bytes", self.bytes)
+
+  def _get(self, handle: str) -> Optional[Tuple[str, int]]:
+    with self.lock:
+      self._expire()
+      entry = self.entries.get(handle)
+      if entry is None:
+        return None
+      # Reads extend the TTL, which also keeps entries ordered by last use for _expire
+      blob, page_chars, _ = entry
+      self.entries[handle] = (blob, page_chars, time.monotonic())
+      self.entries.move_to_end(handle)
+    return zlib.decompress(blob).decode("utf-8"), page_chars
+
+  def _expire(self):
+    cutoff = time.monotonic() - self.ttl
+    while self.entries:
+      handle, (blob, _, stored) = next(iter(self.entries.items()))
+      if stored >= cutoff:
+        break
+      del self.entries[handle]
+      self.bytes -= len(blob)
+
+
+# Global tool result store instance
+tool_result_store = ToolResultStore()
@@ -0,0 +1,91 @@
+"""
+Startup warmup and shutdown draining, driven by the FastAPI lifespan
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict
+
+from services.admission import admission_controller
+from services.http_client import http_pool
+from services.image_service import image_preprocessor
+from services.mcp_service import mcp_manager
+from services.model_catalog import model_catalog
+from services.pdf_service import pdf_extractor
+
+STARTUP_DEADLINE = float(os.getenv("STARTUP_DEADLINE_SECONDS", "15"))
+SHUTDOWN_DRAIN = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+
+
+class Readiness:
+  """Tracks which components finished warming up"""
+
+  def __init__(self):
+    self.components: Dict[str, str] = {}
+    self.started = False
+    self.draining = False
+
+  def set(self, name: str, state: str):
+    self.components[name] = state
+
+  @property
+  def ready(self) -> bool:
+    # Cold components fall back to lazy initialisation, so only the phase matters here
+    return self.started and not self.draining
+
+  def snapshot(self) -> Dict[str, object]:
+    return {
+      "ready": self.ready,
+      "draining": self.draining,
+      "components": dict(self.components),
+    }
+
+
+readiness = Readiness()
+
+
+async def _warm_mcp():
+  for server_type, connected in (await mcp_manager.warm_up()).items():
+    readiness.set(f"mcp:{server_type}", "warm" if connected else "failed")
+
+
+async def warm_up(deadline: float = STARTUP_DEADLINE):
+  """Warm every component in parallel, giving up on whatever isn't done by the deadline"""
+  steps: Dict[str, Callable[[], Awaitable[None]]] = {
+    "http_client": http_pool.warm,
+    "model_catalog": model_catalog.refresh,
+    "mcp": _warm_mcp,
+  }
+  for name in steps:
+    readiness.set(name, "warming")
+
+  started = time.monotonic()
+  tasks = {asyncio.create_task(step()): name for name, step in steps.items()}
+  done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+  for task in done:
+    name = tasks[task]
+    error = task.exception()
+    readiness.set(name, "warm" if error is None else f"failed: {error}")
+  for task in pending:
+    task.cancel()
+    readiness.set(tasks[task], "timeout")
+
+  readiness.started = True
+  print(f"Warmup finished in {time.monotonic() - started:.2f}s: {readiness.components}")
+
+
+async def drain(timeout: float = SHUTDOWN_DRAIN):
+  """Stop reporting ready, let active generations finish, then release shared resources"""
+  readiness.draining = True
+  deadline = time.monotonic() + timeout
+  while admission_controller.active and time.monotonic() < deadline:
+    await asyncio.sleep(0.1)
+  if admission_controller.active:
+    print(f"Shutting down with {admission_controller.active} generations still active")
+
+  await mcp_manager.cleanup_all()
+  await http_pool.close()
+  image_preprocessor.shutdown()
+  pdf_extractor.shutdown()
@@ -0,0 +1,62 @@
+"""
+Process pool and result cache shared by the attachment preprocessors
+
+Image downscaling and PDF extraction are CPU-bound, so both run in a process
+pool started on first use, and both keep results in an LRU bounded by the
+bytes the results hold, keyed by content hash.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class ByteBoundedLRU:
+  """LRU cache bounded by the total of `size(value)` over its entries"""
+
+  def __init__(self, max_bytes: int, size: Callable[[Any], int]):
+    self.max_bytes = max_bytes
+    self.size = size
+    self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+    self.bytes = 0
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def get(self, key: Hashable) -> Tuple[bool, Any]:
+    """(hit, value); a hit can carry None, which callers may use as a cached "no result\""""
+    if key not in self.entries:
+      return False, None
+    self.entries.move_to_end(key)
+    return True, self.entries[key]
+
+  def put(self, key: Hashable, value: Any):
+    size = self.size(value)
+    if size > self.max_bytes:
+      return
+    if key in self.entries:
+      self.bytes -= self.size(self.entries.pop(key))
+    self.entries[key] = value
+    self.bytes += size
+    while self.bytes > self.max_bytes:
+      _, evicted = self.entries.popitem(last=False)
+      self.bytes -= self.size(evicted)
+
+
+class PooledWorker:
+  """Base for services that run work in a process pool created on first use"""
+
+  def __init__(self, max_workers: int):
+    self.max_workers = max_workers
+    self._pool: Optional[ProcessPoolExecutor] = None
+
+  @property
+  def pool(self) -> ProcessPoolExecutor:
+    if self._pool is None:
+      self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+    return self._pool
+
+  def shutdown(self):
+    if self._pool is not None:
+      self._pool.shutdown(wait=False, cancel_futures=True)
+      self._pool = None
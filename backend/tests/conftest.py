@@ -0,0 +1,12 @@
+"""
+Unit tests for the backend services
+
+The app imports its packages as top-level names (`services`, `models`,
+`routers`), as it does when run from the backend directory, so that
+directory goes on sys.path here. No test talks to OpenRouter or MCP.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,30 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import admin
+
+
+@pytest.fixture
+def client(monkeypatch):
+  monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+  app = FastAPI()
+  app.include_router(admin.router)
+  return TestClient(app)
+
+
+def test_routes_are_hidden_without_a_token(client, monkeypatch):
+  monkeypatch.delenv("ADMIN_TOKEN")
+  assert client.get("/admin/mcp-pool").status_code == 404
+
+
+@pytest.mark.parametrize("header", [None, "Bearer wrong", "Bearer s3crét".encode("utf-8")])
+def test_bad_tokens_are_rejected(client, header):
+  headers = {"Authorization": header} if header is not None else {}
+  assert client.get("/admin/mcp-pool", headers=headers).status_code == 401
+
+
+def test_valid_token(client):
+  response = client.get("/admin/mcp-pool", headers={"Authorization": "Bearer s3cret"})
+  assert response.status_code == 200
+  assert "entries" in response.json()
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected, TokenBucket, client_identity, parse_trusted_proxies
+
+
+def test_token_bucket_refills_over_time():
+  bucket = TokenBucket(rate=2, capacity=2)
+  now = bucket.updated
+  assert bucket.try_acquire(now)[0]
+  assert bucket.try_acquire(now)[0]
+  ok, retry_after = bucket.try_acquire(now)
+  assert not ok and retry_after == pytest.approx(0.5)
+  assert bucket.try_acquire(now + 0.5)[0]
+
+
+def test_zero_rate_bucket_never_refills():
+  bucket = TokenBucket(rate=0, capacity=1)
+  assert bucket.try_acquire()[0]
+  assert bucket.try_acquire() == (False, 60.0)
+
+
+def test_client_rate_limit():
+  controller = AdmissionController(client_rate_per_minute=0, client_burst=2)
+  controller.check_rate_limits("1.2.3.4")
+  controller.check_rate_limits("1.2.3.4")
+  with pytest.raises(AdmissionRejected) as e:
+    controller.check_rate_limits("1.2.3.4")
+  assert e.value.reason == "client_rate"
+  controller.check_rate_limits("5.6.7.8")
+
+
+def test_api_key_rejection_refunds_the_client():
+  controller = AdmissionController(client_burst=1, api_key_rate_per_minute=0, api_key_burst=0)
+  with pytest.raises(AdmissionRejected) as e:
+    controller.check_rate_limits("1.2.3.4", "key")
+  assert e.value.reason == "api_key_rate"
+  controller.check_rate_limits("1.2.3.4")
+
+
+def test_slots_queue_and_reject():
+  async def scenario():
+    controller = AdmissionController(max_active=1, max_queued=1, queue_timeout=0.05)
+    ticket = await controller.acquire_slot()
+    with pytest.raises(AdmissionRejected) as timed_out:
+      await controller.acquire_slot()
+    assert timed_out.value.reason == "queue_timeout"
+
+    waiter = asyncio.create_task(controller.acquire_slot())
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected) as full:
+      await controller.acquire_slot()
+    assert full.value.reason == "queue_full"
+
+    ticket.release()
+    ticket.release()  # idempotent
+    (await waiter).release()
+    assert controller.active == 0 and controller.queued == 0
+
+  asyncio.run(scenario())
+
+
+def test_acquire_slot_does_not_charge_rate_limits():
+  async def scenario():
+    controller = AdmissionController(client_rate_per_minute=0, client_burst=1)
+    for _ in range(3):
+      (await controller.acquire_slot()).release()
+    (await controller.acquire("1.2.3.4")).release()
+    with pytest.raises(AdmissionRejected):
+      await controller.acquire("1.2.3.4")
+
+  asyncio.run(scenario())
+
+
+def test_client_identity_trusts_only_configured_proxies():
+  trusted = parse_trusted_proxies("10.0.0.0/8, not-an-ip")
+  assert client_identity("1.2.3.4", "9.9.9.9", trusted) == "1.2.3.4"
+  assert client_identity("10.0.0.1", "6.6.6.6, 9.9.9.9, 10.0.0.2", trusted) == "9.9.9.9"
+  assert client_identity(None, None, trusted) == "unknown"
@@ -0,0 +1,31 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routers.chat as chat
+from services.admission import AdmissionController
+
+
+@pytest.fixture
+def client(monkeypatch):
+  # No free generation slots, so every stream waits in the admission queue
+  monkeypatch.setattr(chat, "admission_controller", AdmissionController(max_active=0, queue_timeout=30))
+  app = FastAPI()
+  app.include_router(chat.router)
+  with TestClient(app) as client:
+    yield client
+
+
+def test_binary_frame_is_answered_and_the_session_stays_open(client):
+  with client.websocket_connect("/ws/chat") as ws:
+    ws.send_bytes(b"\x00\x01")
+    assert ws.receive_json()["type"] == "error"
+    ws.send_json({"type": "ping"})
+    assert ws.receive_json() == {"type": "pong"}
+
+
+def test_cancelling_a_queued_stream_sends_cancelled(client):
+  with client.websocket_connect("/ws/chat") as ws:
+    ws.send_json({"type": "start", "stream": "s1", "request": {"model_id": "m", "chat_history": []}})
+    ws.send_json({"type": "cancel", "stream": "s1"})
+    assert ws.receive_json() == {"type": "cancelled", "stream": "s1"}
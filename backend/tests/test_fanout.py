@@ -0,0 +1,33 @@
+import asyncio
+import json
+
+import httpx
+
+from services.chat_service import ChatService
+from services.fanout import merge_streams
+from services.http_client import http_pool
+
+
+async def collect(stream):
+  return [event async for event in stream]
+
+
+def test_stream_response_reports_upstream_http_errors(monkeypatch):
+  transport = httpx.MockTransport(lambda request: httpx.Response(402, text="Insufficient credits"))
+  monkeypatch.setattr(http_pool, "_client", httpx.AsyncClient(transport=transport))
+  service = ChatService("some/model", {})
+  events = asyncio.run(collect(service.stream_response({"model": "some/model", "messages": []})))
+  assert [json.loads(event) for event in events] == [{"error": {"code": 402, "message": "Insufficient credits"}}]
+
+
+def test_merge_streams_records_error_chunks():
+  async def failing():
+    yield json.dumps({"error": {"code": 429, "message": "Rate limited"}})
+
+  async def working():
+    yield json.dumps({"choices": [{"delta": {"content": "hi"}}]})
+
+  lines = [json.loads(line) for line in asyncio.run(collect(merge_streams({"a": failing(), "b": working()})))]
+  summary = lines[-1]["models"]
+  assert summary["a"]["error"] == "429: Rate limited"
+  assert "error" not in summary["b"] and summary["b"]["chars"] == 2
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import pytest
+
+from services.ingestion import SkeletonBuilder, SpooledAttachment, encode_payload, restore_request, stream_parts
+
+
+def parse(body: dict, threshold: int = 16, chunk_size: int = 7):
+  builder = SkeletonBuilder(threshold)
+  raw = json.dumps(body).encode()
+  for i in range(0, len(raw), chunk_size):
+    builder.feed(raw[i:i + chunk_size])
+  return restore_request(json.loads(bytes(builder.skeleton)), builder), builder
+
+
+async def collect(parts):
+  return b"".join([chunk async for chunk in stream_parts(parts)])
+
+
+def test_stream_parts_round_trips_spooled_values():
+  body = {"message": "hi", "chat_history": [{"role": "user", "pdf": {"data": "A" * 1000}}]}
+  restored, builder = parse(body)
+  try:
+    parts, length = encode_payload(restored)
+    streamed = asyncio.run(collect(parts))
+  finally:
+    builder.close_all()
+  assert len(streamed) == length
+  assert json.loads(streamed) == body
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+def test_skeleton_spools_only_long_strings(chunk_size):
+  long = "B" * 100
+  body = {"message": "short", "chat_history": [{"role": "user", "content": "hi", "image": {"data": long, "format": "png"}}]}
+  restored, builder = parse(body, chunk_size=chunk_size)
+  try:
+    image = restored["chat_history"][0]["image"]
+    assert isinstance(image["data"], SpooledAttachment)
+    assert image["data"].read() == long
+    assert image["format"] == "png"
+    assert len(builder.skeleton) < len(json.dumps(body))
+  finally:
+    builder.close_all()
+
+
+def test_long_strings_outside_attachment_fields_are_read_back():
+  body = {"model_id": "m" * 100, "chat_history": [{"role": "user", "content": "c" * 100, "pdf": {"data": "P" * 100, "url": "data:" + "P" * 100, "filename": "f" * 100}}]}
+  restored, builder = parse(body)
+  try:
+    message = restored["chat_history"][0]
+    assert restored["model_id"] == body["model_id"]
+    assert message["content"] == "c" * 100
+    assert message["pdf"]["filename"] == "f" * 100
+    assert isinstance(message["pdf"]["data"], SpooledAttachment)
+    assert isinstance(message["pdf"]["url"], SpooledAttachment)
+  finally:
+    builder.close_all()
+
+
+def test_escaped_strings_round_trip():
+  text = 'quote " backslash \\ newline \n unicode \u00e9 ' * 5
+  body = {"chat_history": [{"role": "user", "audio": {"data": text, "format": "wav"}}]}
+  restored, builder = parse(body)
+  try:
+    audio = restored["chat_history"][0]["audio"]["data"]
+    assert audio.escaped
+    assert audio.read() == text
+    parts, _ = encode_payload(restored)
+    assert json.loads(asyncio.run(collect(parts))) == body
+  finally:
+    builder.close_all()
+
+
+def test_placeholders_from_the_client_are_not_trusted():
+  builder = SkeletonBuilder(16)
+  builder.feed(json.dumps({"chat_history": [{"role": "user", "content": "\x00spool:0000:0"}]}).encode())
+  restored = restore_request(json.loads(bytes(builder.skeleton)), builder)
+  assert restored["chat_history"][0]["content"] == "\x00spool:0000:0"
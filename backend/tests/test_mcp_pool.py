@@ -0,0 +1,69 @@
+from services.mcp_service import MCPClientPool
+
+
+class StubClient:
+  """Stands in for an MCPClient; the pool only reads active_calls"""
+
+  def __init__(self, name: str):
+    self.name = name
+    self.active_calls = 0
+
+
+def fill(pool, *names, **kwargs):
+  clients = {name: StubClient(name) for name in names}
+  evicted = []
+  for name, client in clients.items():
+    evicted += pool.add(name, client, **kwargs)
+  return clients, evicted
+
+
+def test_evicts_least_recently_used_over_capacity():
+  pool = MCPClientPool(max_clients=2, max_bytes=1000, idle_timeout=60, max_per_tenant=10)
+  clients, _ = fill(pool, "a", "b")
+  pool.get("a")
+  evicted = pool.add("c", StubClient("c"))
+  assert evicted == [clients["b"]]
+  assert list(pool.entries) == ["a", "c"]
+
+
+def test_evicts_by_bytes():
+  pool = MCPClientPool(max_clients=10, max_bytes=100, idle_timeout=60, max_per_tenant=10)
+  clients, evicted = fill(pool, "a", "b", "c", size=40)
+  assert evicted == [clients["a"]]
+  assert pool.bytes == 80
+
+
+def test_tenant_cap_only_evicts_that_tenants_clients():
+  pool = MCPClientPool(max_clients=10, max_bytes=1000, idle_timeout=60, max_per_tenant=2)
+  other = StubClient("other")
+  pool.add("other", other, tenant="10.0.0.2")
+  clients, evicted = fill(pool, "a", "b", "c", tenant="10.0.0.1")
+  assert evicted == [clients["a"]]
+  assert "other" in pool
+
+
+def test_pinned_and_busy_clients_are_never_evicted():
+  pool = MCPClientPool(max_clients=2, max_bytes=1000, idle_timeout=60, max_per_tenant=10)
+  pool.add("default", StubClient("default"), pinned=True)
+  busy = StubClient("busy")
+  busy.active_calls = 1
+  pool.add("busy", busy)
+  new = StubClient("new")
+  # Nothing else may go, so the pool runs over its bound rather than drop a live call
+  assert pool.add("new", new) == []
+  assert len(pool) == 3
+  busy.active_calls = 0
+  assert pool.add("newer", StubClient("newer")) == [busy, new]
+  assert list(pool.entries) == ["default", "newer"]
+
+
+def test_expire_removes_idle_clients_but_not_busy_or_pinned():
+  pool = MCPClientPool(max_clients=10, max_bytes=1000, idle_timeout=60, max_per_tenant=10)
+  clients, _ = fill(pool, "idle", "busy")
+  clients["busy"].active_calls = 1
+  pool.add("default", StubClient("default"), pinned=True)
+  for entry in pool.entries.values():
+    entry.last_used -= 120
+  assert pool.expire() == [clients["idle"]]
+  assert set(pool.entries) == {"busy", "default"}
+  assert pool.has_evictable()
@@ -0,0 +1,50 @@
+import json
+
+from models.schemas import Message
+from services.ingestion import encode_payload
+from services.message_records import AttachmentRef, MessageRecord, RecordCache, TextPart
+
+
+def body(record):
+  parts, length = record.encoded()
+  raw = b"".join(parts)
+  assert len(raw) == length
+  return json.loads(raw)
+
+
+def test_encoded_matches_plain_json():
+  record = MessageRecord("user", (TextPart("hi"), AttachmentRef("image", "QUJD", format="png")))
+  assert body(record) == record.to_dict()
+
+
+def test_breakpoint_variants_share_part_encodings():
+  record = MessageRecord("user", (TextPart("a" * 100), TextPart("b")))
+  variant = record.with_breakpoints([0])
+  assert variant.fragments() is record.fragments()
+  assert body(variant) == variant.to_dict()
+  assert body(variant)["content"][0]["cache_control"] == {"type": "ephemeral"}
+  assert record.with_breakpoints([]) is record
+
+
+def test_record_splices_into_payload():
+  record = MessageRecord("assistant", (TextPart("x"),)).with_breakpoints([0])
+  parts, length = encode_payload({"messages": [record]})
+  assert json.loads(b"".join(parts)) == {"messages": [record.to_dict()]}
+  assert len(b"".join(parts)) == length
+
+
+def test_cache_reuses_records_and_evicts_by_size():
+  cache = RecordCache(max_bytes=100)
+  first = cache.record_for(Message(role="user", content="a" * 20))
+  assert cache.record_for(Message(role="user", content="a" * 20)) is first
+  cache.record_for(Message(role="user", content="b" * 20))
+  cache.record_for(Message(role="user", content="c" * 20))
+  # Each record is charged twice its size, so only two of the three fit
+  assert cache.bytes == 80
+  assert cache.record_for(Message(role="user", content="a" * 20)) is not first
+
+
+def test_cache_skips_records_larger_than_the_bound():
+  cache = RecordCache(max_bytes=10)
+  cache.record_for(Message(role="user", content="a" * 20))
+  assert cache.bytes == 0 and not cache.entries
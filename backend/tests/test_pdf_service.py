@@ -0,0 +1,52 @@
+import asyncio
+import base64
+import glob
+import os
+import tempfile
+
+import pytest
+
+from services.pdf_service import PdfExtractor, chunk_pages, spool_base64
+
+pytest.importorskip("pypdf")
+
+
+def temp_pdfs():
+  return set(glob.glob(os.path.join(tempfile.gettempdir(), "*.pdf")))
+
+
+@pytest.mark.parametrize("data", ["abc", "not base64 at all!!"])
+def test_spool_base64_removes_its_file_on_bad_input(data):
+  before = temp_pdfs()
+  with pytest.raises(ValueError):  # binascii.Error is a ValueError
+    spool_base64(data)
+  assert temp_pdfs() == before
+
+
+def test_spool_base64_decodes_in_chunks():
+  raw = os.urandom(100_000)
+  path = spool_base64(base64.b64encode(raw).decode())
+  try:
+    with open(path, "rb") as f:
+      assert f.read() == raw
+  finally:
+    os.unlink(path)
+
+
+@pytest.mark.parametrize("data", ["abc", "not base64 at all!!"])
+def test_extract_returns_none_for_malformed_base64(data):
+  extractor = PdfExtractor(max_workers=1)
+  before = temp_pdfs()
+  try:
+    result = asyncio.run(extractor.extract({"data": data, "filename": "bad.pdf"}, 1568))
+  finally:
+    extractor.shutdown()
+  assert result is None
+  assert temp_pdfs() == before
+
+
+def test_chunk_pages_labels_and_truncates():
+  pages = ["a" * 40, "b" * 40, "c" * 40]
+  chunks = chunk_pages(pages, "doc.pdf", token_budget=25, chunk_tokens=10)
+  assert chunks[0].startswith("[doc.pdf, pages 1-1]")
+  assert "truncated after page 3 of 3" in chunks[-1]
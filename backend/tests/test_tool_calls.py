@@ -0,0 +1,44 @@
+from services.tool_calls import ToolCallAssembler
+
+
+def delta(index, arguments="", id=None, name=None):
+  function = {"arguments": arguments}
+  if name:
+    function["name"] = name
+  return {"index": index, "id": id, "function": function}
+
+
+def test_call_completes_when_its_arguments_close():
+  assembler = ToolCallAssembler()
+  assert assembler.add([delta(0, "", id="call_1", name="search")]) == []
+  assert assembler.add([delta(0, '{"query": "a}')]) == []
+  assert assembler.add([delta(0, ' b"')]) == []
+  assert assembler.add([delta(0, "}")]) == [0]
+  assert assembler.get(0) == {
+    "id": "call_1",
+    "type": "function",
+    "function": {"name": "search", "arguments": '{"query": "a} b"}'},
+  }
+  # Already reported calls are not reported again
+  assert assembler.finish() == []
+
+
+def test_next_index_completes_earlier_calls():
+  assembler = ToolCallAssembler()
+  assembler.add([delta(0, '{"x": ', id="call_1", name="first")])
+  assert assembler.add([delta(1, "", id="call_2", name="second")]) == [0]
+  assert assembler.finish() == [1]
+  assert [call["id"] for call in assembler.tool_calls()] == ["call_1", "call_2"]
+
+
+def test_escaped_quotes_do_not_end_strings():
+  assembler = ToolCallAssembler()
+  assembler.add([delta(0, '{"q": "say \\"}', id="call_1", name="echo")])
+  assert assembler.add([delta(0, '\\" now"}')]) == [0]
+
+
+def test_calls_without_a_name_are_never_reported():
+  assembler = ToolCallAssembler()
+  assembler.add([{"function": {"arguments": "{}"}}, delta(0, "{}")])
+  assert assembler.finish() == []
+  assert bool(assembler)
@@ -0,0 +1,48 @@
+import json
+
+from services.tool_results import FETCH_TOOL_NAME, SUMMARY_MAX_ITEMS, ToolResultStore
+
+
+def result(items):
+  return {"success": True, "tool_name": "list", "tool_args": {}, "content": items}
+
+
+def test_small_results_pass_through():
+  store = ToolResultStore(default_max_tokens=1000, limits={})
+  assert json.loads(store.budget("list", result(["ok"]))) == result(["ok"])
+
+
+def test_truncated_result_fits_the_budget_and_pages_cover_the_text():
+  store = ToolResultStore(default_max_tokens=500, limits={})
+  items = [json.dumps({"id": i, "name": "x" * 50}) for i in range(200)]
+  message = store.budget("list", result(items))
+  assert len(message) <= store.page_chars("list")
+
+  body = json.loads(message)
+  text = body["content"]
+  for page in range(2, body["pages"] + 1):
+    fetched = store.fetch(body["handle"], page)
+    assert fetched["success"]
+    text += fetched["content"][0]
+  assert text == "\n".join(items)
+
+
+def test_summary_is_capped():
+  store = ToolResultStore(default_max_tokens=500, limits={})
+  items = ["x" * 100 for _ in range(SUMMARY_MAX_ITEMS + 30)]
+  summary = json.loads(store.budget("list", result(items)))["summary"]
+  assert len(summary) == SUMMARY_MAX_ITEMS + 1
+  assert summary[-1] == "...and 30 more"
+
+
+def test_fetched_pages_are_not_budgeted_again():
+  store = ToolResultStore(default_max_tokens=10, limits={})
+  page = result(["y" * 500])
+  assert json.loads(store.budget(FETCH_TOOL_NAME, page)) == page
+
+
+def test_unknown_handle_and_out_of_range_page():
+  store = ToolResultStore(default_max_tokens=10, limits={})
+  assert not store.fetch("missing")["success"]
+  body = json.loads(store.budget("list", result(["z" * 200])))
+  assert not store.fetch(body["handle"], body["pages"] + 1)["success"]
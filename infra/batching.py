@@ -0,0 +1,125 @@
+"""
+Dynamic request batching for GPU pipelines
+
+Callers submit single items from any thread; a worker thread gathers them
+into batches of up to `max_batch_size`, waiting at most `max_wait` seconds
+after the first item arrives, runs the whole batch in one call and hands each
+result back to its caller. Nothing here depends on torch, so the scheduling
+can be exercised on CPU with a stub `run_batch`.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+
+class BatchStats:
+  """Batch-size and queue-wait counters for a BatchQueue"""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.batches = 0
+    self.items = 0
+    self.max_batch_size = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+
+  def record(self, batch_size: int, waits: List[float]):
+    with self.lock:
+      self.batches += 1
+      self.items += batch_size
+      self.max_batch_size = max(self.max_batch_size, batch_size)
+      self.total_wait += sum(waits)
+      self.max_wait = max(self.max_wait, *waits)
+
+  def snapshot(self) -> Dict[str, float]:
+    with self.lock:
+      return {
+        "batches": self.batches,
+        "items": self.items,
+        "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+        "max_batch_size": self.max_batch_size,
+        "avg_queue_wait": self.total_wait / self.items if self.items else 0.0,
+        "max_queue_wait": self.max_wait,
+      }
+
+
+class BatchQueue:
+  """Gathers submitted items into batches and runs them on a single worker thread"""
+
+  def __init__(
+    self,
+    run_batch: Callable[[List[Any]], List[Any]],
+    max_batch_size: int = 8,
+    max_wait: float = 0.05,
+  ):
+    self.run_batch = run_batch
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self.stats = BatchStats()
+    self._pending: Deque[Tuple[Any, Future, float]] = deque()
+    self._cond = threading.Condition()
+    self._closed = False
+    self._worker = threading.Thread(target=self._loop, name="batch-queue", daemon=True)
+    self._worker.start()
+
+  def submit(self, item: Any) -> Future:
+    """Queue one item and return a Future for its result"""
+    future: Future = Future()
+    with self._cond:
+      if self._closed:
+        raise RuntimeError("BatchQueue is closed")
+      self._pending.append((item, future, time.monotonic()))
+      self._cond.notify()
+    return future
+
+  def submit_many(self, items: List[Any]) -> List[Future]:
+    return [self.submit(item) for item in items]
+
+  def close(self):
+    """Stop accepting work; items already queued are still processed"""
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._worker.join()
+
+  def _next_batch(self) -> List[Tuple[Any, Future, float]]:
+    with self._cond:
+      while not self._pending and not self._closed:
+        self._cond.wait()
+      if not self._pending:
+        return []
+
+      # Hold the window open from the oldest item until the batch fills or it expires
+      deadline = self._pending[0][2] + self.max_wait
+      while len(self._pending) < self.max_batch_size and not self._closed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self._cond.wait(remaining)
+
+      count = min(self.max_batch_size, len(self._pending))
+      return [self._pending.popleft() for _ in range(count)]
+
+  def _loop(self):
+    while True:
+      batch = self._next_batch()
+      if not batch:
+        return
+
+      started = time.monotonic()
+      self.stats.record(len(batch), [started - enqueued for _, _, enqueued in batch])
+      items = [item for item, _, _ in batch]
+      try:
+        results = self.run_batch(items)
+        if len(results) != len(items):
+          raise RuntimeError(f"run_batch returned {len(results)} results for {len(items)} items")
+      except Exception as e:
+        for _, future, _ in batch:
+          future.set_exception(e)
+        continue
+
+      for (_, future, _), result in zip(batch, results):
+        future.set_result(result)
@@ -0,0 +1,81 @@
+"""
+Prompt-embedding cache for diffusion pipelines
+
+Text encoding (T5/UMT5 plus CLIP for Flux) runs on every call even when the
+prompt is a constant, like Wan2's negative prompt, or a popular repeat.
+EmbeddingCache sits in front of a pipeline's encoder: pinned entries are
+computed once at startup and never evicted, everything else lives in an LRU
+bounded by the bytes the embeddings occupy. The encoder is any callable, so
+the cache can be exercised on CPU with a stub.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+def embedding_nbytes(value: Any) -> int:
+  """Memory held by an embedding: torch tensors, numpy arrays, or tuples/lists of them"""
+  if value is None:
+    return 0
+  if isinstance(value, (tuple, list)):
+    return sum(embedding_nbytes(v) for v in value)
+  if hasattr(value, "element_size") and hasattr(value, "nelement"):
+    return value.element_size() * value.nelement()
+  return int(getattr(value, "nbytes", 0))
+
+
+class EmbeddingCache:
+  """Pinned + byte-bounded LRU cache of prompt embeddings"""
+
+  def __init__(self, encode: Callable[[str], Any], max_bytes: int = 1024**3):
+    self.encode = encode
+    self.max_bytes = max_bytes
+    self.pinned: Dict[Hashable, Any] = {}
+    self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+    self.sizes: Dict[Hashable, int] = {}
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+  def pin(self, prompt: str) -> Any:
+    """Encode a constant prompt now and keep it for the lifetime of the cache"""
+    if prompt not in self.pinned:
+      self.pinned[prompt] = self.encode(prompt)
+    return self.pinned[prompt]
+
+  def get(self, prompt: str) -> Any:
+    """Return the embedding for a prompt, encoding it on a miss"""
+    with self.lock:
+      if prompt in self.pinned:
+        self.hits += 1
+        return self.pinned[prompt]
+      if prompt in self.entries:
+        self.hits += 1
+        self.entries.move_to_end(prompt)
+        return self.entries[prompt]
+      self.misses += 1
+
+    # Encode outside the lock; a concurrent miss on the same prompt just encodes twice
+    value = self.encode(prompt)
+    size = embedding_nbytes(value)
+    with self.lock:
+      if size <= self.max_bytes and prompt not in self.entries:
+        self.entries[prompt] = value
+        self.sizes[prompt] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+          evicted, _ = self.entries.popitem(last=False)
+          self.bytes -= self.sizes.pop(evicted)
+    return value
+
+  def stats(self) -> Dict[str, int]:
+    with self.lock:
+      return {
+        "pinned": len(self.pinned),
+        "entries": len(self.entries),
+        "bytes": self.bytes,
+        "hits": self.hits,
+        "misses": self.misses,
+      }
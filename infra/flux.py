@@ -4,6 +4,10 @@ from pathlib import Path
 
 import modal
 
+from batching import BatchQueue
+from embedding_cache import EmbeddingCache
+from generation_cache import GenerationCache, generation_key
+
 cuda_version = "12.4.0"  # should be no greater than host CUDA version
 flavor = "devel"  # includes full CUDA toolkit
 operating_sys = "ubuntu22.04"
@@ -45,7 +49,7 @@ flux_image = flux_image.env(
     "TORCHINDUCTOR_CACHE_DIR": "/root/.inductor-cache",
     "TORCHINDUCTOR_FX_GRAPH_CACHE": "1",
   }
-)
+).add_local_python_source("batching", "embedding_cache", "generation_cache")
 
 app = modal.App("example-flux", image=flux_image)
 
@@ -57,6 +61,16 @@ with flux_image.imports():
 MINUTES = 60  # seconds
 VARIANT = "schnell"  # or "dev"
 NUM_INFERENCE_STEPS = 4  # use ~50 for [dev], smaller for [schnell]
+HEIGHT = 1024
+WIDTH = 1024
+GUIDANCE_SCALE = 0.0  # [schnell] is guidance-distilled; use ~3.5 for [dev]
+MAX_BATCH_SIZE = 8  # prompts per forward pass
+BATCH_WAIT_SECONDS = 0.05  # how long the first prompt waits for others to join its batch
+CACHE_PATH = Path("/cache") / "generations" / "flux"  # generated images, kept on the hf-hub-cache volume
+CACHE_MAX_BYTES = 5 * 1024**3
+EMBEDDING_CACHE_BYTES = 1024**3  # ~4 MB of T5 + CLIP embeddings per prompt
+
+hf_cache = modal.Volume.from_name("hf-hub-cache", create_if_missing=True)
 
 
 @app.cls(
@@ -64,7 +78,7 @@ NUM_INFERENCE_STEPS = 4  # use ~50 for [dev], smaller for [schnell]
   scaledown_window=20 * MINUTES,
   timeout=60 * MINUTES,  # leave plenty of time for compilation
   volumes={  # add Volumes to store serializable compilation artifacts, see section on torch.compile below
-    "/cache": modal.Volume.from_name("hf-hub-cache", create_if_missing=True),
+    "/cache": hf_cache,
     "/root/.nv": modal.Volume.from_name("nv-cache", create_if_missing=True),
     "/root/.triton": modal.Volume.from_name("triton-cache", create_if_missing=True),
     "/root/.inductor-cache": modal.Volume.from_name(
@@ -73,6 +87,7 @@ NUM_INFERENCE_STEPS = 4  # use ~50 for [dev], smaller for [schnell]
   },
   secrets=[modal.Secret.from_name("huggingface-secret")],
 )
+@modal.concurrent(max_inputs=MAX_BATCH_SIZE)  # let concurrent prompts reach the batch queue
 class Model:
   compile: bool = (  # see section on torch.compile below for details
     modal.parameter(default=False)
@@ -85,20 +100,105 @@ class Model:
       f"black-forest-labs/FLUX.1-{VARIANT}", dtype=torch.bfloat16
     ).to("cuda")  # move model to GPU
     self.pipe = optimize(pipe, compile=self.compile)
+    self.embeddings = EmbeddingCache(
+      lambda prompt: encode_prompt(self.pipe, prompt), max_bytes=EMBEDDING_CACHE_BYTES
+    )
+    # all GPU work goes through one worker thread that batches concurrent prompts
+    self.queue = BatchQueue(
+      lambda requests: run_pipeline_batch(self.pipe, requests, self.embeddings),
+      max_batch_size=MAX_BATCH_SIZE,
+      max_wait=BATCH_WAIT_SECONDS,
+    )
+    self.cache = GenerationCache(
+      CACHE_PATH, max_bytes=CACHE_MAX_BYTES, on_change=hf_cache.commit, reload=hf_cache.reload
+    )
+
+  @modal.exit()
+  def exit(self):
+    self.queue.close()
+    self.cache.flush()
+
+  @modal.method()
+  def inference(self, prompt: str, seed: int | None = None, use_cache: bool = True) -> bytes:
+    return self._generate([prompt], seed, use_cache)[0]
+
+  @modal.method()
+  def inference_batch(
+    self, prompts: list[str], seed: int | None = None, use_cache: bool = True
+  ) -> list[bytes]:
+    return self._generate(prompts, seed, use_cache)
 
+  def _generate(self, prompts: list[str], seed: int | None, use_cache: bool) -> list[bytes]:
+    """Serve cache hits directly and send the rest through the batch queue"""
+    results: list[bytes | None] = [None] * len(prompts)
+    pending = []
+    for i, prompt in enumerate(prompts):
+      key = generation_key(
+        prompt=prompt,
+        height=HEIGHT,
+        width=WIDTH,
+        steps=NUM_INFERENCE_STEPS,
+        guidance=GUIDANCE_SCALE,
+        seed=seed,
+        variant=VARIANT,
+      )
+      cached = self.cache.get(key) if use_cache else None
+      if cached is not None:
+        print("🎨 serving image from cache")
+        results[i] = cached
+      else:
+        pending.append((i, key, self.queue.submit({"prompt": prompt, "seed": seed})))
+
+    for i, key, future in pending:
+      results[i] = future.result()
+      if use_cache:
+        self.cache.put(key, results[i], "jpg")
+    return results
 
   @modal.method()
-  def inference(self, prompt: str) -> bytes:
-    print("🎨 generating image...")
-    out = self.pipe(
-      prompt,
-      output_type="pil",
-      num_inference_steps=NUM_INFERENCE_STEPS,
-    ).images[0]
+  def batch_stats(self) -> dict:
+    return {**self.queue.stats.snapshot(), "embeddings": self.embeddings.stats()}
+
+
+def make_generator(seed: int | None):
+  generator = torch.Generator("cpu")
+  if seed is None:
+    generator.seed()
+  else:
+    generator.manual_seed(seed)
+  return generator
+
+
+def encode_prompt(pipe, prompt: str):
+  """T5 and pooled CLIP embeddings for one prompt"""
+  with torch.no_grad():
+    prompt_embeds, pooled_prompt_embeds, _ = pipe.encode_prompt(
+      prompt=prompt, prompt_2=None, device=pipe.device
+    )
+  return prompt_embeds, pooled_prompt_embeds
+
+
+def run_pipeline_batch(pipe, requests: list[dict], embeddings: EmbeddingCache) -> list[bytes]:
+  """Run a batch of {prompt, seed} requests through the pipeline in one forward pass and JPEG-encode each image"""
+  print(f"🎨 generating {len(requests)} image(s)...")
+  encoded = [embeddings.get(request["prompt"]) for request in requests]
+  images = pipe(
+    prompt_embeds=torch.cat([prompt_embeds for prompt_embeds, _ in encoded]),
+    pooled_prompt_embeds=torch.cat([pooled for _, pooled in encoded]),
+    output_type="pil",
+    height=HEIGHT,
+    width=WIDTH,
+    guidance_scale=GUIDANCE_SCALE,
+    num_inference_steps=NUM_INFERENCE_STEPS,
+    generator=[make_generator(request["seed"]) for request in requests],
+  ).images
 
+  results = []
+  for image in images:
     byte_stream = BytesIO()
-    out.save(byte_stream, format="JPEG")
-    return byte_stream.getvalue()
+    image.save(byte_stream, format="JPEG")
+    results.append(byte_stream.getvalue())
+  return results
 
 
 def optimize(pipe, compile=True):
@@ -0,0 +1,229 @@
+"""
+Content-addressed cache for generated images and videos
+
+Generations are keyed on every parameter that affects the output (prompt,
+negative prompt, resolution, steps, guidance, seed, model variant). Artifacts
+live under `root/blobs/` named by the sha256 of their bytes, so identical
+outputs are stored once; a small JSON index maps generation keys to blobs
+and tracks last access for LRU and size-based eviction. Only the standard
+library is used, so the cache can be exercised on CPU against a temp dir.
+
+Several containers can share one cache directory (e.g. a Modal volume), each
+holding its own copy of the index. Changes are synced on a background thread,
+off the request path. A sync re-reads the index from disk, merges in this
+container's puts, removals and accesses, evicts, and only then saves it, so
+containers don't overwrite each other's entries. Blobs are deleted only when
+no entry in the merged index references them. A blob that another container
+wrote but has not synced yet can still be evicted; its entry then misses on
+lookup and the artifact is regenerated.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+READ_CHUNK = 1024 * 1024
+
+
+def generation_key(**params: Any) -> str:
+  """Stable key for a set of generation parameters"""
+  canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+  return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class GenerationCache:
+  """Content-addressed artifact store with an LRU, size-bounded index"""
+
+  def __init__(
+    self,
+    root: Path,
+    max_bytes: int = 20 * 1024**3,
+    max_entries: int = 10000,
+    on_change: Optional[Callable[[], None]] = None,
+    reload: Optional[Callable[[], None]] = None,
+  ):
+    self.root = Path(root)
+    self.blobs = self.root / "blobs"
+    self.index_path = self.root / "index.json"
+    self.max_bytes = max_bytes
+    self.max_entries = max_entries
+    self.on_change = on_change  # e.g. commit the backing volume
+    self.reload = reload  # e.g. reload the backing volume, to see other containers' changes
+    self.lock = threading.Lock()
+    self.sync_lock = threading.Lock()
+    self.blobs.mkdir(parents=True, exist_ok=True)
+    self.index: Dict[str, Dict[str, Any]] = self._load_index()
+    # Changes made here since the last sync, merged into the on-disk index by sync()
+    self._added: Dict[str, Dict[str, Any]] = {}
+    self._removed: Dict[str, str] = {}  # key -> digest
+    self._accessed: Dict[str, float] = {}
+    self._wake = threading.Event()
+    self._syncer: Optional[threading.Thread] = None
+
+  def _load_index(self) -> Dict[str, Dict[str, Any]]:
+    try:
+      return json.loads(self.index_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+      return {}
+
+  def _save_index(self):
+    # Write then rename so readers never see a half-written index
+    fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".json")
+    with os.fdopen(fd, "w") as f:
+      json.dump(self.index, f)
+    os.replace(tmp, self.index_path)
+
+  def blob_path(self, digest: str, ext: str) -> Path:
+    return self.blobs / digest[:2] / f"{digest}.{ext}"
+
+  def relative_path(self, key: str) -> Optional[str]:
+    """Path of a cached artifact relative to the cache's parent, for volume reads"""
+    path = self.lookup(key)
+    return str(path.relative_to(self.root.parent)) if path else None
+
+  def lookup(self, key: str) -> Optional[Path]:
+    """Return the artifact path for a key and mark it recently used"""
+    with self.lock:
+      entry = self.index.get(key)
+      if entry is None:
+        return None
+      path = self.blob_path(entry["digest"], entry["ext"])
+      if not path.exists():
+        # Evicted by another container
+        del self.index[key]
+        self._added.pop(key, None)
+        self._removed[key] = entry["digest"]
+        return None
+      entry["last_access"] = self._accessed[key] = time.time()
+      return path
+
+  def get(self, key: str) -> Optional[bytes]:
+    path = self.lookup(key)
+    return path.read_bytes() if path else None
+
+  def put(self, key: str, data: bytes, ext: str) -> Path:
+    """Store bytes for a key"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = self.blob_path(digest, ext)
+    if not path.exists():
+      path.parent.mkdir(parents=True, exist_ok=True)
+      # A unique temp name, since other threads or containers may be writing the same blob
+      fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+      with os.fdopen(fd, "wb") as f:
+        f.write(data)
+      os.replace(tmp, path)
+    return self._record(key, digest, ext, len(data))
+
+  def put_file(self, key: str, source: Path, ext: str, move: bool = True) -> Path:
+    """Move (or copy) an existing file into the store for a key"""
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+      while chunk := f.read(READ_CHUNK):
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    size = os.path.getsize(source)
+    path = self.blob_path(digest, ext)
+    if path.exists():
+      if move:
+        os.unlink(source)
+    else:
+      path.parent.mkdir(parents=True, exist_ok=True)
+      if move:
+        shutil.move(source, path)
+      else:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, path)
+    return self._record(key, digest, ext, size)
+
+  def _record(self, key: str, digest: str, ext: str, size: int) -> Path:
+    with self.lock:
+      now = time.time()
+      self.index[key] = self._added[key] = {
+        "digest": digest,
+        "ext": ext,
+        "size": size,
+        "created": now,
+        "last_access": now,
+      }
+      self._removed.pop(key, None)
+    self._schedule_sync()
+    return self.blob_path(digest, ext)
+
+  def total_bytes(self) -> int:
+    # Blobs shared by several keys count once
+    return sum({e["digest"]: e["size"] for e in self.index.values()}.values())
+
+  def _evict(self):
+    """Drop least recently used entries until within the count and size limits"""
+    by_age = sorted(self.index.items(), key=lambda item: item[1]["last_access"])
+    total = self.total_bytes()
+    for key, entry in by_age:
+      if len(self.index) <= self.max_entries and total <= self.max_bytes:
+        break
+      del self.index[key]
+      if not any(e["digest"] == entry["digest"] for e in self.index.values()):
+        total -= entry["size"]
+        self.blob_path(entry["digest"], entry["ext"]).unlink(missing_ok=True)
+
+  def _merge(self, disk: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """The on-disk index with this container's changes since the last sync applied"""
+    for key, digest in self._removed.items():
+      if disk.get(key, {}).get("digest") == digest:
+        del disk[key]
+    for key, entry in self._added.items():
+      current = disk.get(key)
+      if current is None or current["created"] <= entry["created"]:
+        disk[key] = entry
+    for key, accessed in self._accessed.items():
+      if key in disk:
+        disk[key]["last_access"] = max(disk[key]["last_access"], accessed)
+    return disk
+
+  def _schedule_sync(self):
+    self._wake.set()
+    with self.lock:
+      if self._syncer is None or not self._syncer.is_alive():
+        self._syncer = threading.Thread(target=self._sync_loop, name="generation-cache-sync", daemon=True)
+        self._syncer.start()
+
+  def _sync_loop(self):
+    while True:
+      self._wake.wait()
+      self._wake.clear()
+      try:
+        self.sync()
+      except Exception as e:
+        print(f"Generation cache sync failed: {e}")
+
+  def sync(self):
+    """Merge local changes into the shared index, evict, save and commit"""
+    with self.sync_lock:
+      if self.reload:
+        try:
+          # Commit first so reloading can't drop blobs written here
+          if self.on_change:
+            self.on_change()
+          self.reload()
+        except Exception as e:
+          print(f"Generation cache reload failed, merging with the local index: {e}")
+      with self.lock:
+        self.index = self._merge(self._load_index())
+        self._added.clear()
+        self._removed.clear()
+        self._accessed.clear()
+        self._evict()
+        self._save_index()
+      if self.on_change:
+        self.on_change()
+
+  def flush(self):
+    """Sync now, including last-access times updated by lookups"""
+    self.sync()
@@ -0,0 +1,212 @@
+"""
+Asynchronous job tracking for long-running generations
+
+Submitting returns a job id immediately; the generation itself is launched
+elsewhere (e.g. `Function.spawn` onto a GPU container) and reports progress
+back through a shared key-value store, so clients poll or subscribe instead
+of holding one HTTP connection open for minutes.
+
+The store only needs `get` and item assignment, so a plain dict works for
+local testing and a `modal.Dict` works across containers. Keys are split by
+writer: the submitting side owns `job:<id>`, `idem:<key>` and `order`, the
+worker owns `state:<id>`, so the two never overwrite each other's records.
+
+A worker that dies without raising (a timeout, preemption or OOM kill) never
+reports failure. Running workers therefore heartbeat, and the submitting side
+marks a job failed once its heartbeat is older than `stale_after`, or once it
+has been queued for longer than `queue_timeout`. This is the one case where
+the submitting side writes `state:<id>`.
+"""
+
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+class JobQueueFull(Exception):
+  """Raised when the number of unfinished jobs has reached the limit"""
+
+  def __init__(self, pending: int):
+    super().__init__(f"{pending} jobs already pending")
+    self.pending = pending
+
+
+class JobManager:
+  """Submission, idempotency and status for jobs backed by a shared store"""
+
+  def __init__(
+    self,
+    store: Any,
+    launch: Callable[[Dict[str, Any]], None],
+    max_pending: int = 16,
+    stale_after: float = 300,
+    queue_timeout: float = 3600,
+  ):
+    self.store = store
+    self.launch = launch
+    self.max_pending = max_pending
+    self.stale_after = stale_after
+    self.queue_timeout = queue_timeout
+    self.lock = threading.Lock()
+
+  def _state(self, job_id: str) -> Dict[str, Any]:
+    state = self.store.get(f"state:{job_id}") or {"status": QUEUED}
+    error = self._stale_error(job_id, state)
+    if error:
+      state = {**state, "status": FAILED, "error": error, "finished": time.time()}
+      self.store[f"state:{job_id}"] = state
+    return state
+
+  def _stale_error(self, job_id: str, state: Dict[str, Any]) -> Optional[str]:
+    """Why an unfinished job is presumed dead, or None if it is still live"""
+    now = time.time()
+    if state["status"] == RUNNING:
+      last_seen = state.get("heartbeat") or state.get("started") or now
+      if now - last_seen > self.stale_after:
+        return f"Worker stopped responding (no heartbeat for {now - last_seen:.0f}s)"
+    elif state["status"] == QUEUED:
+      job = self.store.get(f"job:{job_id}")
+      if job is not None and now - job["created"] > self.queue_timeout:
+        return f"Job was not started within {self.queue_timeout:.0f}s"
+    return None
+
+  def _active_ids(self) -> List[str]:
+    """Submission-ordered ids of unfinished jobs, pruning finished ones"""
+    order = self.store.get("order") or []
+    active = [job_id for job_id in order if self._state(job_id)["status"] not in FINISHED]
+    if len(active) != len(order):
+      self.store["order"] = active
+    return active
+
+  def submit(self, params: Dict[str, Any], idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """Create a job (or return the existing one for this idempotency key) and launch it"""
+    with self.lock:
+      if idempotency_key:
+        existing = self.store.get(f"idem:{idempotency_key}")
+        if existing and self._state(existing)["status"] != FAILED:
+          return self.status(existing)
+
+      active = self._active_ids()
+      if len(active) >= self.max_pending:
+        raise JobQueueFull(len(active))
+
+      job = {
+        "id": uuid.uuid4().hex,
+        "params": params,
+        "idempotency_key": idempotency_key,
+        "created": time.time(),
+      }
+      self.store[f"job:{job['id']}"] = job
+      self.store["order"] = active + [job["id"]]
+      if idempotency_key:
+        self.store[f"idem:{idempotency_key}"] = job["id"]
+
+    try:
+      self.launch(job)
+    except Exception as e:
+      JobReporter(self.store, job["id"]).failed(f"Failed to launch job: {e}")
+    return self.status(job["id"])
+
+  def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+    """Public view of a job: status, progress, queue position and result"""
+    job = self.store.get(f"job:{job_id}")
+    if job is None:
+      return None
+    state = self._state(job_id)
+    status = {
+      "id": job_id,
+      "status": state["status"],
+      "created": job["created"],
+      "step": state.get("step", 0),
+      "total_steps": state.get("total_steps"),
+      "result": state.get("result"),
+      "error": state.get("error"),
+    }
+    if state["status"] == QUEUED:
+      queued = [i for i in self._active_ids() if self._state(i)["status"] == QUEUED]
+      status["queue_position"] = queued.index(job_id) + 1 if job_id in queued else None
+    return status
+
+  def events(self, job_id: str, poll_interval: float = 1.0, timeout: float = 3600) -> Iterator[Dict[str, Any]]:
+    """Yield the job status whenever it changes, until it finishes or timeout passes"""
+    deadline = time.monotonic() + timeout
+    last = None
+    while time.monotonic() < deadline:
+      status = self.status(job_id)
+      if status is None:
+        return
+      if status != last:
+        yield status
+        last = status
+      if status["status"] in FINISHED:
+        return
+      time.sleep(poll_interval)
+
+
+class JobReporter:
+  """
+  Worker-side progress reporting for one job
+
+  While the job runs, a daemon thread refreshes its heartbeat every
+  `heartbeat_interval` seconds, including through stretches with no step
+  callbacks such as VAE decoding. If the worker dies, the heartbeat stops
+  with it.
+  """
+
+  def __init__(self, store: Any, job_id: str, heartbeat_interval: float = 30):
+    self.store = store
+    self.job_id = job_id
+    self.heartbeat_interval = heartbeat_interval
+    self.state: Dict[str, Any] = {"status": QUEUED}
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+
+  def _write(self, **changes: Any):
+    with self.lock:
+      self.state = {**self.state, **changes}
+      self.store[f"state:{self.job_id}"] = self.state
+
+  def running(self, total_steps: int) -> bool:
+    """Mark the job running and start heartbeating; False if it was already given up on"""
+    current = self.store.get(f"state:{self.job_id}") or {}
+    if current.get("status") in FINISHED:
+      return False
+    now = time.time()
+    self._write(status=RUNNING, step=0, total_steps=total_steps, started=now, heartbeat=now)
+    threading.Thread(target=self._heartbeat, name=f"heartbeat-{self.job_id}", daemon=True).start()
+    return True
+
+  def _heartbeat(self):
+    while not self.stopped.wait(self.heartbeat_interval):
+      with self.lock:
+        if self.state["status"] != RUNNING:
+          return
+        self.state = {**self.state, "heartbeat": time.time()}
+        self.store[f"state:{self.job_id}"] = self.state
+
+  def step(self, step: int):
+    self._write(step=step, heartbeat=time.time())
+
+  def done(self, result: Any):
+    self.stopped.set()
+    self._write(status=DONE, step=self.state.get("total_steps", 0), result=result, finished=time.time())
+
+  def failed(self, error: str):
+    self.stopped.set()
+    self._write(status=FAILED, error=error, finished=time.time())
+
+  def step_callback(self) -> Callable:
+    """A diffusers `callback_on_step_end` that records each completed denoising step"""
+
+    def callback(pipe, step_index, timestep, callback_kwargs):
+      self.step(step_index + 1)
+      return callback_kwargs
+
+    return callback
@@ -0,0 +1,12 @@
+"""
+CPU tests for the infra helpers
+
+The Modal apps import these modules as top-level names (they are mounted
+next to flux.py and wan2.py), so the infra directory goes on sys.path here.
+None of the tests need a GPU, Modal or the model weights.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
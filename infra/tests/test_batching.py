@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from batching import BatchQueue
+
+
+class StubPipeline:
+  """Records each batch it is given and returns one result per item"""
+
+  def __init__(self, delay: float = 0.0):
+    self.delay = delay
+    self.batches = []
+
+  def __call__(self, items):
+    self.batches.append(list(items))
+    time.sleep(self.delay)
+    return [item * 2 for item in items]
+
+
+def test_batch_fills_at_max_batch_size():
+  pipeline = StubPipeline()
+  queue = BatchQueue(pipeline, max_batch_size=4, max_wait=10)
+  started = time.monotonic()
+  futures = queue.submit_many(range(4))
+  assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6]
+  # A full batch runs at once rather than waiting out the 10s window
+  assert time.monotonic() - started < 5
+  assert pipeline.batches == [[0, 1, 2, 3]]
+  queue.close()
+
+
+def test_overflow_goes_to_the_next_batch():
+  pipeline = StubPipeline()
+  queue = BatchQueue(pipeline, max_batch_size=3, max_wait=0.05)
+  futures = queue.submit_many(range(7))
+  assert [future.result(timeout=5) for future in futures] == [i * 2 for i in range(7)]
+  assert all(len(batch) <= 3 for batch in pipeline.batches)
+  assert sorted(item for batch in pipeline.batches for item in batch) == list(range(7))
+  queue.close()
+
+
+def test_partial_batch_runs_after_max_wait():
+  pipeline = StubPipeline()
+  queue = BatchQueue(pipeline, max_batch_size=8, max_wait=0.2)
+  started = time.monotonic()
+  future = queue.submit(1)
+  assert future.result(timeout=5) == 2
+  elapsed = time.monotonic() - started
+  assert 0.15 <= elapsed < 2
+  assert pipeline.batches == [[1]]
+  queue.close()
+
+
+def test_items_within_the_window_share_a_batch():
+  pipeline = StubPipeline()
+  queue = BatchQueue(pipeline, max_batch_size=8, max_wait=0.3)
+  first = queue.submit(1)
+  time.sleep(0.05)
+  second = queue.submit(2)
+  assert (first.result(timeout=5), second.result(timeout=5)) == (2, 4)
+  assert pipeline.batches == [[1, 2]]
+  stats = queue.stats.snapshot()
+  assert stats["batches"] == 1 and stats["items"] == 2 and stats["max_batch_size"] == 2
+  queue.close()
+
+
+def test_exception_reaches_every_future():
+  def run_batch(items):
+    raise ValueError("pipeline crashed")
+
+  queue = BatchQueue(run_batch, max_batch_size=3, max_wait=10)
+  futures = queue.submit_many(range(3))
+  for future in futures:
+    with pytest.raises(ValueError, match="pipeline crashed"):
+      future.result(timeout=5)
+  queue.close()
+
+
+def test_result_count_mismatch_reaches_every_future():
+  queue = BatchQueue(lambda items: items[:-1], max_batch_size=3, max_wait=10)
+  futures = queue.submit_many(range(3))
+  for future in futures:
+    with pytest.raises(RuntimeError, match="2 results for 3 items"):
+      future.result(timeout=5)
+  queue.close()
+
+
+def test_failed_batch_does_not_stop_the_worker():
+  calls = []
+
+  def run_batch(items):
+    calls.append(items)
+    if len(calls) == 1:
+      raise ValueError("first batch fails")
+    return items
+
+  queue = BatchQueue(run_batch, max_batch_size=1, max_wait=0)
+  with pytest.raises(ValueError):
+    queue.submit("a").result(timeout=5)
+  assert queue.submit("b").result(timeout=5) == "b"
+  queue.close()
+
+
+def test_close_drains_queued_items():
+  gate = threading.Event()
+  pipeline = StubPipeline()
+
+  def run_batch(items):
+    gate.wait(5)
+    return pipeline(items)
+
+  queue = BatchQueue(run_batch, max_batch_size=2, max_wait=10)
+  # The first batch blocks the worker, so the rest are still queued when close() is called
+  futures = queue.submit_many(range(5))
+  closer = threading.Thread(target=queue.close)
+  closer.start()
+  gate.set()
+  closer.join(5)
+  assert not closer.is_alive()
+  assert [future.result(timeout=0) for future in futures] == [0, 2, 4, 6, 8]
+  with pytest.raises(RuntimeError, match="closed"):
+    queue.submit(5)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache, embedding_nbytes
+
+EMBEDDING_BYTES = 1024  # 256 float32s
+
+
+class StubEncoder:
+  """Returns a fixed-size float32 embedding per prompt and counts calls"""
+
+  def __init__(self):
+    self.calls = []
+
+  def __call__(self, prompt: str):
+    self.calls.append(prompt)
+    return np.full(EMBEDDING_BYTES // 4, len(prompt), dtype=np.float32)
+
+
+def test_embedding_nbytes():
+  array = np.zeros(10, dtype=np.float32)
+  assert embedding_nbytes(array) == 40
+  assert embedding_nbytes((array, [array, None])) == 80
+  assert embedding_nbytes(None) == 0
+
+
+def test_hits_and_misses_are_counted():
+  encoder = StubEncoder()
+  cache = EmbeddingCache(encoder, max_bytes=10 * EMBEDDING_BYTES)
+  first = cache.get("a cat")
+  assert cache.get("a cat") is first
+  cache.get("a dog")
+  assert encoder.calls == ["a cat", "a dog"]
+  stats = cache.stats()
+  assert (stats["hits"], stats["misses"]) == (1, 2)
+  assert stats["entries"] == 2
+  assert stats["bytes"] == 2 * EMBEDDING_BYTES
+
+
+def test_lru_evicts_least_recently_used_within_byte_bound():
+  encoder = StubEncoder()
+  cache = EmbeddingCache(encoder, max_bytes=2 * EMBEDDING_BYTES)
+  cache.get("a")
+  cache.get("b")
+  cache.get("a")  # "b" is now the least recently used
+  cache.get("c")
+  assert list(cache.entries) == ["a", "c"]
+  assert cache.stats()["bytes"] == 2 * EMBEDDING_BYTES
+
+  cache.get("b")
+  assert encoder.calls == ["a", "b", "c", "b"]
+
+
+def test_oversized_embedding_is_returned_but_not_kept():
+  cache = EmbeddingCache(StubEncoder(), max_bytes=EMBEDDING_BYTES - 1)
+  assert embedding_nbytes(cache.get("a")) == EMBEDDING_BYTES
+  assert cache.stats()["entries"] == 0
+  assert cache.stats()["bytes"] == 0
+
+
+def test_pinned_entries_are_never_evicted():
+  encoder = StubEncoder()
+  cache = EmbeddingCache(encoder, max_bytes=EMBEDDING_BYTES)
+  negative = cache.pin("blurry, low quality")
+  for i in range(20):
+    cache.get(f"prompt {i}")
+  assert cache.get("blurry, low quality") is negative
+  assert encoder.calls.count("blurry, low quality") == 1
+  # Pinned embeddings don't count towards the LRU's byte bound
+  stats = cache.stats()
+  assert stats["pinned"] == 1
+  assert stats["entries"] == 1
+  assert stats["bytes"] == EMBEDDING_BYTES
+
+
+def test_pin_is_idempotent():
+  encoder = StubEncoder()
+  cache = EmbeddingCache(encoder)
+  assert cache.pin("x") is cache.pin("x")
+  assert encoder.calls == ["x"]
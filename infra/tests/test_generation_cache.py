@@ -0,0 +1,86 @@
+import threading
+
+from generation_cache import GenerationCache, generation_key
+
+
+def test_generation_key_is_order_independent():
+  assert generation_key(prompt="a", seed=1) == generation_key(seed=1, prompt="a")
+  assert generation_key(prompt="a", seed=1) != generation_key(prompt="a", seed=2)
+
+
+def test_put_get_and_dedup(tmp_path):
+  cache = GenerationCache(tmp_path)
+  first = cache.put("k1", b"image", "jpg")
+  second = cache.put("k2", b"image", "jpg")
+  assert first == second
+  assert cache.get("k1") == cache.get("k2") == b"image"
+  assert cache.total_bytes() == len(b"image")
+  assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_put_does_not_commit_on_the_calling_thread(tmp_path):
+  commits = []
+  committed = threading.Event()
+
+  def on_change():
+    commits.append(threading.current_thread().name)
+    committed.set()
+
+  cache = GenerationCache(tmp_path, on_change=on_change)
+  cache.put("k", b"data", "jpg")
+  assert committed.wait(5)
+  assert threading.current_thread().name not in commits
+
+
+def test_containers_sharing_a_directory_keep_each_others_entries(tmp_path):
+  a = GenerationCache(tmp_path)
+  b = GenerationCache(tmp_path)
+  a.put("from-a", b"aaa", "jpg")
+  a.flush()
+  b.put("from-b", b"bbb", "jpg")
+  b.flush()
+
+  fresh = GenerationCache(tmp_path)
+  assert fresh.get("from-a") == b"aaa"
+  assert fresh.get("from-b") == b"bbb"
+
+
+def test_eviction_keeps_blobs_referenced_by_another_container(tmp_path):
+  a = GenerationCache(tmp_path, max_bytes=10)
+  b = GenerationCache(tmp_path, max_bytes=10)
+  a.put("old", b"shared", "jpg")
+  a.flush()
+  # Same bytes under another key in a container that also holds a newer, larger entry
+  b.put("other", b"shared", "jpg")
+  b.put("new", b"1234", "jpg")
+  b.flush()
+
+  a.put("newest", b"5678", "jpg")
+  a.flush()
+  fresh = GenerationCache(tmp_path, max_bytes=10)
+  assert fresh.total_bytes() <= 10
+  for key in fresh.index:
+    assert fresh.lookup(key) is not None
+
+
+def test_lookup_drops_entries_whose_blob_was_evicted_elsewhere(tmp_path):
+  cache = GenerationCache(tmp_path)
+  path = cache.put("k", b"data", "jpg")
+  cache.flush()
+  path.unlink()
+  assert cache.lookup("k") is None
+  cache.flush()
+  assert "k" not in GenerationCache(tmp_path).index
+
+
+def test_lru_eviction_by_size(tmp_path):
+  cache = GenerationCache(tmp_path, max_bytes=8)
+  cache.put("a", b"aaaa", "jpg")
+  cache.flush()
+  cache.put("b", b"bbbb", "jpg")
+  cache.flush()
+  cache.lookup("a")
+  cache.put("c", b"cccc", "jpg")
+  cache.flush()
+  assert set(cache.index) == {"a", "c"}
+  assert cache.get("b") is None
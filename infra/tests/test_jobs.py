@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobManager, JobQueueFull, JobReporter
+
+
+class FakePipeline:
+  """Stands in for a diffusers pipeline: runs `steps` steps, calling callback_on_step_end after each"""
+
+  def __init__(self, steps: int = 4, fail_at: int = None):
+    self.steps = steps
+    self.fail_at = fail_at
+
+  def __call__(self, prompt: str, callback_on_step_end=None):
+    for i in range(self.steps):
+      if i == self.fail_at:
+        raise RuntimeError("CUDA out of memory")
+      if callback_on_step_end is not None:
+        callback_on_step_end(self, i, 1000 - i, {})
+    return f"{prompt}.mp4"
+
+
+def run_job(store, job, pipeline):
+  reporter = JobReporter(store, job["id"], heartbeat_interval=0.05)
+  if not reporter.running(pipeline.steps):
+    return
+  try:
+    reporter.done(pipeline(job["params"]["prompt"], callback_on_step_end=reporter.step_callback()))
+  except Exception as e:
+    reporter.failed(str(e))
+
+
+def test_job_runs_to_completion():
+  store = {}
+  manager = JobManager(store, launch=lambda job: run_job(store, job, FakePipeline(steps=4)))
+  status = manager.submit({"prompt": "cat"})
+  assert status["status"] == DONE
+  assert status["step"] == status["total_steps"] == 4
+  assert status["result"] == "cat.mp4"
+
+
+def test_pipeline_exception_marks_job_failed():
+  store = {}
+  manager = JobManager(store, launch=lambda job: run_job(store, job, FakePipeline(steps=4, fail_at=2)))
+  status = manager.submit({"prompt": "cat"})
+  assert status["status"] == FAILED
+  assert "out of memory" in status["error"]
+  assert status["step"] == 2
+
+
+def test_launch_failure_marks_job_failed():
+  def launch(job):
+    raise ConnectionError("spawn failed")
+
+  status = JobManager({}, launch=launch).submit({"prompt": "cat"})
+  assert status["status"] == FAILED
+  assert "spawn failed" in status["error"]
+
+
+def test_queue_limit_and_positions():
+  store = {}
+  manager = JobManager(store, launch=lambda job: None, max_pending=2)
+  first = manager.submit({"prompt": "a"})
+  second = manager.submit({"prompt": "b"})
+  assert (first["queue_position"], second["queue_position"]) == (1, 2)
+  with pytest.raises(JobQueueFull):
+    manager.submit({"prompt": "c"})
+
+  JobReporter(store, first["id"]).done("a.mp4")
+  assert manager.status(second["id"])["queue_position"] == 1
+  manager.submit({"prompt": "c"})
+
+
+def test_idempotency_key_returns_existing_job_unless_failed():
+  store = {}
+  launched = []
+  manager = JobManager(store, launch=launched.append)
+  first = manager.submit({"prompt": "a"}, idempotency_key="k")
+  assert manager.submit({"prompt": "a"}, idempotency_key="k")["id"] == first["id"]
+  assert len(launched) == 1
+
+  JobReporter(store, first["id"]).failed("boom")
+  assert manager.submit({"prompt": "a"}, idempotency_key="k")["id"] != first["id"]
+
+
+def test_dead_worker_is_marked_failed_and_frees_its_slot():
+  store = {}
+  manager = JobManager(store, launch=lambda job: None, max_pending=1, stale_after=0.2)
+  job = manager.submit({"prompt": "a"})
+  # The worker starts, then its container is killed: no exception, no further writes
+  reporter = JobReporter(store, job["id"], heartbeat_interval=60)
+  reporter.running(total_steps=4)
+  reporter.stopped.set()
+  assert manager.status(job["id"])["status"] == RUNNING
+
+  time.sleep(0.3)
+  status = manager.status(job["id"])
+  assert status["status"] == FAILED
+  assert "heartbeat" in status["error"]
+  manager.submit({"prompt": "b"})
+
+
+def test_heartbeat_keeps_a_slow_step_alive():
+  store = {}
+  manager = JobManager(store, launch=lambda job: None, stale_after=0.3)
+  job = manager.submit({"prompt": "a"})
+  reporter = JobReporter(store, job["id"], heartbeat_interval=0.05)
+  reporter.running(total_steps=1)
+  time.sleep(0.6)  # e.g. VAE decoding, with no step callbacks
+  assert manager.status(job["id"])["status"] == RUNNING
+  reporter.done("a.mp4")
+  assert manager.status(job["id"])["status"] == DONE
+
+
+def test_job_never_started_times_out_and_late_worker_skips_it():
+  store = {}
+  manager = JobManager(store, launch=lambda job: None, queue_timeout=0.1)
+  job = manager.submit({"prompt": "a"})
+  assert job["status"] == QUEUED
+  time.sleep(0.2)
+  assert manager.status(job["id"])["status"] == FAILED
+
+  pipeline = FakePipeline()
+  run_job(store, store[f"job:{job['id']}"], pipeline)
+  assert manager.status(job["id"])["status"] == FAILED
+
+
+def test_events_follow_progress_until_done():
+  store = {}
+  gate = threading.Event()
+
+  class SlowPipeline(FakePipeline):
+    def __call__(self, prompt, callback_on_step_end=None):
+      gate.wait(5)
+      return super().__call__(prompt, callback_on_step_end)
+
+  def launch(job):
+    threading.Thread(target=run_job, args=(store, job, SlowPipeline(steps=3)), daemon=True).start()
+
+  manager = JobManager(store, launch=launch)
+  job = manager.submit({"prompt": "a"})
+  events = manager.events(job["id"], poll_interval=0.01, timeout=5)
+  first = next(events)
+  gate.set()
+  statuses = [first] + list(events)
+  assert statuses[-1]["status"] == DONE
+  assert statuses[-1]["result"] == "a.mp4"
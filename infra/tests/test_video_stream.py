@@ -0,0 +1,116 @@
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from video_stream import encode_fragmented_mp4, tee_to_file, to_uint8_frame
+
+WIDTH, HEIGHT = 64, 48
+
+
+def synthetic_frames(count: int):
+  for i in range(count):
+    frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.float32)
+    frame[..., i % 3] = (i + 1) / count
+    yield frame
+
+
+@pytest.fixture
+def passthrough(tmp_path):
+  """An "ffmpeg" that ignores its arguments and copies stdin to stdout, like cat"""
+  script = tmp_path / "fake-ffmpeg"
+  script.write_text("#!/bin/sh\nexec cat\n")
+  script.chmod(0o755)
+  return str(script)
+
+
+def run_with_timeout(fn, seconds: float = 10):
+  result = {}
+
+  def target():
+    try:
+      result["value"] = fn()
+    except BaseException as e:
+      result["error"] = e
+
+  thread = threading.Thread(target=target, daemon=True)
+  thread.start()
+  thread.join(seconds)
+  assert not thread.is_alive(), "timed out, the encoder deadlocked"
+  if "error" in result:
+    raise result["error"]
+  return result.get("value")
+
+
+def test_to_uint8_frame():
+  frame = np.array([[[0.0, 0.5, 1.0, 1.0]]], dtype=np.float32)
+  converted = to_uint8_frame(frame)
+  assert converted.dtype == np.uint8
+  assert converted.tolist() == [[[0, 128, 255]]]
+
+
+def test_passthrough_yields_every_frame(passthrough):
+  frames = list(synthetic_frames(10))
+  body = run_with_timeout(lambda: b"".join(encode_fragmented_mp4(frames, ffmpeg=passthrough, chunk_size=4096)))
+  assert body == b"".join(to_uint8_frame(frame).tobytes() for frame in frames)
+
+
+def test_no_frames_yields_nothing(passthrough):
+  assert list(encode_fragmented_mp4([], ffmpeg=passthrough)) == []
+
+
+def test_early_close_does_not_deadlock(passthrough):
+  # Far more frames than the pipe buffers hold, so both sides block once the consumer stops reading
+  def take_one_then_close():
+    chunks = encode_fragmented_mp4(synthetic_frames(2000), ffmpeg=passthrough, chunk_size=1024)
+    first = next(chunks)
+    chunks.close()
+    return first
+
+  assert run_with_timeout(take_one_then_close)
+
+
+def test_ffmpeg_failure_raises(tmp_path):
+  script = tmp_path / "failing-ffmpeg"
+  script.write_text("#!/bin/sh\necho broken >&2\nexit 3\n")
+  script.chmod(0o755)
+  with pytest.raises((RuntimeError, BrokenPipeError), match="3|Broken"):
+    run_with_timeout(lambda: list(encode_fragmented_mp4(synthetic_frames(5), ffmpeg=str(script))))
+
+
+def test_tee_writes_file_and_runs_on_complete(tmp_path):
+  path = tmp_path / "out.mp4"
+  completed = threading.Event()
+  chunks = list(tee_to_file(iter([b"a", b"b", b"c"]), path, on_complete=lambda p: completed.set()))
+  assert chunks == [b"a", b"b", b"c"]
+  assert path.read_bytes() == b"abc"
+  assert completed.wait(5)
+
+
+def test_tee_removes_partial_file_on_early_close(tmp_path, passthrough):
+  path = tmp_path / ".output_partial.mp4"
+  completed = []
+  stream = tee_to_file(
+    encode_fragmented_mp4(synthetic_frames(2000), ffmpeg=passthrough, chunk_size=1024),
+    path,
+    on_complete=completed.append,
+  )
+
+  def take_one_then_close():
+    next(stream)
+    stream.close()
+
+  run_with_timeout(take_one_then_close)
+  time.sleep(0.1)
+  assert not path.exists()
+  assert completed == []
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+def test_real_ffmpeg_emits_fragmented_mp4():
+  chunks = run_with_timeout(lambda: list(encode_fragmented_mp4(synthetic_frames(48), fps=24)), seconds=60)
+  body = b"".join(chunks)
+  assert body[4:8] == b"ftyp"
+  assert b"moof" in body
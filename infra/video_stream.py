@@ -0,0 +1,130 @@
+"""
+Progressive fragmented-MP4 encoding
+
+Frames are piped into ffmpeg, which writes a fragmented MP4 (empty moov plus
+one moof/mdat pair per keyframe interval) to stdout. Each fragment can be
+forwarded to the client as soon as ffmpeg emits it, so playback starts
+before the whole clip is encoded. Only numpy and an ffmpeg binary are needed,
+so this can be exercised on CPU with synthetic frames.
+"""
+
+import subprocess
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+
+CHUNK_SIZE = 64 * 1024
+
+
+def to_uint8_frame(frame) -> np.ndarray:
+  """Convert a float [0, 1] or uint8 HxWx3 frame (numpy or PIL) to contiguous uint8 RGB"""
+  array = np.asarray(frame)
+  if array.dtype != np.uint8:
+    array = (np.clip(array, 0.0, 1.0) * 255).round().astype(np.uint8)
+  return np.ascontiguousarray(array[..., :3])
+
+
+def ffmpeg_command(width: int, height: int, fps: int, ffmpeg: str = "ffmpeg") -> list[str]:
+  return [
+    ffmpeg, "-hide_banner", "-loglevel", "error",
+    "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps),
+    "-i", "pipe:0",
+    "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+    "-g", str(fps),  # one keyframe, and so one fragment, per second of video
+    "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+    "-f", "mp4", "pipe:1",
+  ]
+
+
+def encode_fragmented_mp4(
+  frames: Iterable,
+  fps: int = 24,
+  ffmpeg: str = "ffmpeg",
+  chunk_size: int = CHUNK_SIZE,
+) -> Iterator[bytes]:
+  """Yield fragmented-MP4 bytes for `frames` as ffmpeg produces them"""
+  frames = iter(frames)
+  first = next(frames, None)
+  if first is None:
+    return
+  first = to_uint8_frame(first)
+  height, width = first.shape[:2]
+
+  process = subprocess.Popen(
+    ffmpeg_command(width, height, fps, ffmpeg),
+    stdin=subprocess.PIPE,
+    stdout=subprocess.PIPE,
+    stderr=subprocess.PIPE,
+  )
+  errors: list[BaseException] = []
+
+  def feed():
+    # Runs on its own thread so stdout is drained while stdin is still being written
+    try:
+      process.stdin.write(first.tobytes())
+      for frame in frames:
+        process.stdin.write(to_uint8_frame(frame).tobytes())
+    except BaseException as e:
+      errors.append(e)
+    finally:
+      try:
+        process.stdin.close()
+      except OSError:
+        pass  # ffmpeg was killed with frames still buffered
+
+  writer = threading.Thread(target=feed, name="ffmpeg-feed", daemon=True)
+  writer.start()
+  finished = False
+  try:
+    while chunk := process.stdout.read1(chunk_size):
+      yield chunk
+    finished = True
+  finally:
+    if not finished:
+      # The consumer stopped early, so nobody drains stdout: ffmpeg blocks writing it and the
+      # feed thread blocks writing stdin. Killing ffmpeg breaks both pipes so the join returns.
+      process.kill()
+    writer.join()
+    process.stdout.close()
+    stderr = process.stderr.read().decode(errors="replace")
+    process.stderr.close()
+    returncode = process.wait()
+
+  if errors:
+    raise errors[0]
+  if returncode != 0:
+    raise RuntimeError(f"ffmpeg exited with {returncode}: {stderr.strip()}")
+
+
+def tee_to_file(
+  chunks: Iterable[bytes],
+  path: Optional[Path],
+  on_complete: Optional[Callable[[Path], None]] = None,
+) -> Iterator[bytes]:
+  """
+  Pass chunks through while also writing them to `path`
+
+  Once the stream finishes, `on_complete` is run on a background thread so
+  archiving (e.g. committing a volume) never delays the response. If the
+  stream is closed early or fails, the partial file is deleted instead.
+  """
+  if path is None:
+    yield from chunks
+    return
+
+  try:
+    with open(path, "wb") as f:
+      for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+  except BaseException:
+    # A for loop does not close its source, so stop the encoder here rather than at garbage collection
+    if hasattr(chunks, "close"):
+      chunks.close()
+    path.unlink(missing_ok=True)
+    raise
+
+  if on_complete is not None:
+    threading.Thread(target=on_complete, args=(path,), name="archive", daemon=True).start()
@@ -9,6 +9,11 @@ from diffusers import WanPipeline, AutoencoderKLWan, WanTransformer3DModel, UniP
 from diffusers.utils import export_to_video, load_image
 import modal
 
+from embedding_cache import EmbeddingCache
+from generation_cache import GenerationCache, generation_key
+from jobs import JobManager, JobQueueFull, JobReporter
+from video_stream import encode_fragmented_mp4, tee_to_file
+
 cuda_version = "12.4.0"  # should be no greater than host CUDA version
 flavor = "devel"  # includes full CUDA toolkit
 operating_sys = "ubuntu22.04"
@@ -17,6 +22,7 @@ tag = f"{cuda_version}-{flavor}-{operating_sys}"
 VOLUME_NAME = "wan2-outputs"
 OUTPUTS_PATH = Path("/outputs")  # remote path for saving video outputs
 outputs = modal.Volume.from_name(VOLUME_NAME, create_if_missing=True)
+jobs = modal.Dict.from_name("wan2-jobs", create_if_missing=True)  # job metadata and progress
 
 
 cuda_dev_image = modal.Image.from_registry(
@@ -59,7 +65,7 @@ wan2_image = wan2_image.env(
     "TORCHINDUCTOR_CACHE_DIR": "/root/.inductor-cache",
     "TORCHINDUCTOR_FX_GRAPH_CACHE": "1",
   }
-)
+).add_local_python_source("embedding_cache", "generation_cache", "jobs", "video_stream")
 
 app = modal.App("example-wan2", image=wan2_image)
 
@@ -71,6 +77,23 @@ with wan2_image.imports():
 MINUTES = 60  # seconds
 VARIANT = "schnell"  # or "dev"
 NUM_INFERENCE_STEPS = 4  # use ~50 for [dev], smaller for [schnell]
+FPS = 24
+MODEL_ID = "Wan-AI/Wan2.2-TI2V-5B-Diffusers"
+GENERATION_PARAMS = {
+  "negative_prompt": "lowres, bad anatomy, error body, error arm, error hand, error fingers, error legs, error feet, missing fingers",
+  "height": 704,
+  "width": 1280,
+  "num_frames": 121,
+  "guidance_scale": 5.0,
+  "num_inference_steps": 50,
+}
+CACHE_PATH = OUTPUTS_PATH / "cache"  # content-addressed generations on the outputs volume
+CACHE_MAX_BYTES = 20 * 1024**3
+EMBEDDING_CACHE_BYTES = 512 * 1024**2  # UMT5 embeddings are ~2 MB per prompt
+MAX_PENDING_JOBS = 16  # queued + running jobs accepted by the job API
+JOB_HEARTBEAT_SECONDS = 30
+JOB_STALE_SECONDS = 5 * JOB_HEARTBEAT_SECONDS  # running jobs with an older heartbeat are marked failed
+JOB_QUEUE_TIMEOUT = 60 * MINUTES  # queued jobs no worker picked up in this time are marked failed
 
 
 @app.cls(
@@ -97,38 +120,118 @@ class Model:
   def enter(self):
     dtype = torch.bfloat16
     device = "cuda"
-    model_id = "Wan-AI/Wan2.2-TI2V-5B-Diffusers"
+    model_id = MODEL_ID
 
     vae = AutoencoderKLWan.from_pretrained(model_id, subfolder="vae", torch_dtype=torch.float32)
     self.pipe = WanPipeline.from_pretrained(model_id, vae=vae, torch_dtype=dtype)
     self.pipe.to(device)
-
-
-
-  @modal.method()
-  def inference(self, prompt: str) -> bytes:
+    self.embeddings = EmbeddingCache(self._encode_prompt, max_bytes=EMBEDDING_CACHE_BYTES)
+    self.embeddings.pin(GENERATION_PARAMS["negative_prompt"])  # identical on every call
+    self.cache = GenerationCache(
+      CACHE_PATH, max_bytes=CACHE_MAX_BYTES, on_change=outputs.commit, reload=outputs.reload
+    )
+
+  @modal.exit()
+  def exit(self):
+    self.cache.flush()
+
+  def _cache_key(self, prompt: str, seed: int | None) -> str:
+    return generation_key(prompt=prompt, seed=seed, model=MODEL_ID, fps=FPS, **GENERATION_PARAMS)
+
+  def _encode_prompt(self, prompt: str):
+    with torch.no_grad():
+      prompt_embeds, _ = self.pipe.encode_prompt(
+        prompt=prompt, do_classifier_free_guidance=False, device="cuda"
+      )
+    return prompt_embeds
+
+  def _generate_frames(self, prompt: str, seed: int | None = None, callback=None):
     print(f"🎨 generating video with prompt: {prompt}")
 
-    height = 704
-    width = 1280
-    num_frames = 121
-    num_inference_steps = 50
-    guidance_scale = 5.0
-    negative_prompt = "lowres, bad anatomy, error body, error arm, error hand, error fingers, error legs, error feet, missing fingers"
+    params = dict(GENERATION_PARAMS)
+    negative_prompt = params.pop("negative_prompt")
+    generator = torch.Generator("cuda").manual_seed(seed) if seed is not None else None
     output = self.pipe(
-      prompt=prompt,
-      negative_prompt=negative_prompt,
-      height=height,
-      width=width,
-      num_frames=num_frames,
-      guidance_scale=guidance_scale,
-      num_inference_steps=num_inference_steps,
+      prompt_embeds=self.embeddings.get(prompt),
+      negative_prompt_embeds=self.embeddings.get(negative_prompt),
+      generator=generator,
+      callback_on_step_end=callback,
+      **params,
     ).frames[0]
     print("🎨 generation complete, exporting video...")
-    filename = f"output_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
-    export_to_video(output, f"/outputs/{filename}", fps=24)
+    return output
+
+  @modal.method()
+  def inference(self, prompt: str, seed: int | None = None, use_cache: bool = True) -> str:
+    """Generate a video and return its path on the outputs volume"""
+    return self._render_to_volume(prompt, seed, use_cache)
+
+  @modal.method()
+  def run_job(self, job_id: str, prompt: str, seed: int | None = None, use_cache: bool = True):
+    """Render a job submitted through the job API, reporting per-step progress"""
+    reporter = JobReporter(jobs, job_id, heartbeat_interval=JOB_HEARTBEAT_SECONDS)
+    if not reporter.running(GENERATION_PARAMS["num_inference_steps"]):
+      print(f"🎨 job {job_id} was already given up on, skipping")
+      return
+    try:
+      reporter.done(self._render_to_volume(prompt, seed, use_cache, reporter.step_callback()))
+    except Exception as e:
+      reporter.failed(str(e))
+      raise
+
+  def _render_to_volume(self, prompt: str, seed: int | None, use_cache: bool, callback=None) -> str:
+    key = self._cache_key(prompt, seed)
+    if use_cache and (cached := self.cache.relative_path(key)):
+      print("🎨 serving video from cache")
+      return cached
+
+    output = self._generate_frames(prompt, seed, callback)
+    filename = new_filename()
+    export_to_video(output, f"/outputs/{filename}", fps=FPS)
+    if use_cache:
+      path = self.cache.put_file(key, OUTPUTS_PATH / filename, "mp4")
+      filename = str(path.relative_to(OUTPUTS_PATH))
+    outputs.commit()  # the file is visible to other containers once this returns
     return filename
 
+  @modal.method(is_generator=True)
+  def inference_stream(
+    self,
+    prompt: str,
+    archive_filename: str | None = None,
+    seed: int | None = None,
+    use_cache: bool = True,
+  ):
+    """Yield fragmented MP4 bytes as frames are encoded, optionally archiving to the volume"""
+    key = self._cache_key(prompt, seed)
+    cached = self.cache.lookup(key) if use_cache else None
+    if cached is not None:
+      print("🎨 serving video from cache")
+      with open(cached, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+          yield chunk
+      return
+
+    output = self._generate_frames(prompt, seed)
+    if archive_filename:
+      tee_path = OUTPUTS_PATH / archive_filename
+    elif use_cache:
+      tee_path = OUTPUTS_PATH / f".{new_filename()}"
+    else:
+      tee_path = None
+
+    def on_complete(path: Path):
+      if use_cache:
+        # keep the archived copy under its own name, otherwise move the temp file into the cache
+        self.cache.put_file(key, path, "mp4", move=not archive_filename)
+      outputs.commit()
+
+    yield from tee_to_file(
+      encode_fragmented_mp4(output, fps=FPS),
+      tee_path,
+      on_complete=on_complete,
+    )
+
 
 
 def optimize(pipe, compile=True):
@@ -190,6 +293,9 @@ def main(
   #     f.write(chunk)
   # print(f"🎨 saved output to {output_path}")
 
+def new_filename() -> str:
+  return f"output_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
+
 def read_file_chunks(filename: str):
   vol = modal.Volume.from_name("wan2-outputs")
   for chunk in vol.read_file(filename):
@@ -197,14 +303,83 @@ def read_file_chunks(filename: str):
 
 @app.function()
 @modal.fastapi_endpoint()
-def generate_video_http(prompt: str) -> str:
-  """Generate a video from a text prompt using WAN2 model and return the filename."""
-  filename = model.inference.remote(prompt)
-  # print(filename, str(filename))
-  # filename = "output_20251018_023241.mp4"
-  time.sleep(10)  # wait for the file to be ready
+def generate_video_http(
+  prompt: str, archive: bool = False, seed: int | None = None, use_cache: bool = True
+):
+  """Generate a video from a text prompt using WAN2 model and stream it back as fragmented MP4.
+
+  Pass use_cache=false to always run a fresh generation, e.g. when no seed is pinned.
+  """
+  filename = new_filename()
+  return StreamingResponse(
+    model.inference_stream.remote_gen(prompt, filename if archive else None, seed, use_cache),
+    media_type="video/mp4",
+    headers={"Content-Disposition": f"attachment; filename=\"{filename}\""}
+  )
+
+@app.function()
+@modal.fastapi_endpoint()
+def get_video_http(filename: str):
+  """Stream a previously archived video back from the outputs volume."""
   return StreamingResponse(
     read_file_chunks(filename),
     media_type="video/mp4",
     headers={"Content-Disposition": f"attachment; filename=\"{filename}\""}
-  )
\ No newline at end of file
+  )
+
+@app.function(max_containers=1)  # one container, so submissions are serialised by JobManager's lock
+@modal.concurrent(max_inputs=100)
+@modal.asgi_app()
+def jobs_api():
+  """Job API: submit returns immediately, then poll, subscribe to progress, and fetch the result."""
+  import json
+
+  from fastapi import FastAPI, Header, HTTPException
+
+  web_app = FastAPI()
+  manager = JobManager(
+    jobs,
+    launch=lambda job: model.run_job.spawn(job["id"], **job["params"]),
+    max_pending=MAX_PENDING_JOBS,
+    stale_after=JOB_STALE_SECONDS,
+    queue_timeout=JOB_QUEUE_TIMEOUT,
+  )
+
+  def get_status(job_id: str) -> dict:
+    status = manager.status(job_id)
+    if status is None:
+      raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+  @web_app.post("/jobs")
+  def submit_job(
+    prompt: str,
+    seed: int | None = None,
+    use_cache: bool = True,
+    idempotency_key: str | None = Header(default=None),
+  ):
+    try:
+      return manager.submit(
+        {"prompt": prompt, "seed": seed, "use_cache": use_cache}, idempotency_key
+      )
+    except JobQueueFull as e:
+      raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+
+  @web_app.get("/jobs/{job_id}")
+  def job_status(job_id: str):
+    return get_status(job_id)
+
+  @web_app.get("/jobs/{job_id}/events")
+  def job_events(job_id: str):
+    get_status(job_id)
+    events = (f"data: {json.dumps(status)}\n\n" for status in manager.events(job_id))
+    return StreamingResponse(events, media_type="text/event-stream")
+
+  @web_app.get("/jobs/{job_id}/result")
+  def job_result(job_id: str):
+    status = get_status(job_id)
+    if status["status"] != "done":
+      raise HTTPException(status_code=409, detail=f"Job is {status['status']}")
+    return StreamingResponse(read_file_chunks(status["result"]), media_type="video/mp4")
+
+  return web_app